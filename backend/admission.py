@@ -0,0 +1,134 @@
+"""
+Admission control for embedding-based scoring.
+
+Embedding a guess is the one expensive thing /api/guess does, and running many
+at once only makes each of them slower. AdmissionController lets at most
+max_in_flight scorings run; further requests wait in a bounded queue for at
+most queue_timeout seconds. A request that finds the queue full, or whose wait
+runs out, is not admitted and the caller serves a cheaper answer instead
+(app.py falls back to a metadata-only score and flags the response as degraded).
+
+A request can take several slots at once: /api/guess/batch is charged one per
+candidate it embeds, up to max_in_flight, so a batch counts for the compute it
+uses instead of as a single guess. Waiting requests take whichever slots free
+up first, so under sustained load a wide request tends to wait out its timeout
+and be degraded; that is the intent, batches are the lower priority.
+
+    SCORING_MAX_IN_FLIGHT   concurrent embedding scorings (default 2)
+    SCORING_MAX_QUEUE       requests allowed to wait for a slot (default 8)
+    SCORING_QUEUE_TIMEOUT   longest wait for a slot, in seconds (default 2)
+
+Counters are exposed through stats() (GET /api/scoring/stats).
+"""
+
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+MAX_IN_FLIGHT = int(os.environ.get("SCORING_MAX_IN_FLIGHT", 2))
+MAX_QUEUE = int(os.environ.get("SCORING_MAX_QUEUE", 8))
+QUEUE_TIMEOUT = float(os.environ.get("SCORING_QUEUE_TIMEOUT", 2))
+
+QUEUE_FULL = "queue_full"
+QUEUE_TIMEOUT_REASON = "queue_timeout"
+
+
+class AdmissionController:
+    def __init__(self, max_in_flight=MAX_IN_FLIGHT, max_queue=MAX_QUEUE, queue_timeout=QUEUE_TIMEOUT):
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._cond = threading.Condition()
+        self._in_flight = 0
+        self._waiting = 0
+        self._counts = {"admitted": 0, "admitted_after_wait": 0, QUEUE_FULL: 0, QUEUE_TIMEOUT_REASON: 0}
+        self._peak_in_flight = 0
+        self._peak_waiting = 0
+        self._max_wait = 0.0
+
+    def _weight(self, slots):
+        return max(1, min(int(slots), self.max_in_flight))
+
+    def acquire(self, slots=1):
+        """
+        Take slots scoring slots (capped at max_in_flight). Returns None if
+        admitted, else the reason it wasn't (QUEUE_FULL or QUEUE_TIMEOUT_REASON).
+        """
+        slots = self._weight(slots)
+        with self._cond:
+            if self._in_flight + slots <= self.max_in_flight and self._waiting == 0:
+                self._admit(slots)
+                return None
+            if self._waiting >= self.max_queue:
+                self._counts[QUEUE_FULL] += 1
+                return QUEUE_FULL
+            self._waiting += 1
+            self._peak_waiting = max(self._peak_waiting, self._waiting)
+            start = time.monotonic()
+            deadline = start + self.queue_timeout
+            try:
+                while self._in_flight + slots > self.max_in_flight:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._counts[QUEUE_TIMEOUT_REASON] += 1
+                        return QUEUE_TIMEOUT_REASON
+                    self._cond.wait(remaining)
+            finally:
+                self._waiting -= 1
+                self._max_wait = max(self._max_wait, time.monotonic() - start)
+            self._admit(slots)
+            self._counts["admitted_after_wait"] += 1
+            return None
+
+    def _admit(self, slots):
+        self._in_flight += slots
+        self._peak_in_flight = max(self._peak_in_flight, self._in_flight)
+        self._counts["admitted"] += 1
+
+    def release(self, slots=1):
+        with self._cond:
+            self._in_flight -= self._weight(slots)
+            # Waiters need different numbers of slots, so let each re-check.
+            self._cond.notify_all()
+
+    @contextmanager
+    def slot(self, slots=1):
+        """with controller.slot() as rejected: ... -- rejected is None when admitted, else the reason."""
+        rejected = self.acquire(slots)
+        try:
+            yield rejected
+        finally:
+            if rejected is None:
+                self.release(slots)
+
+    def stats(self):
+        with self._cond:
+            degraded = self._counts[QUEUE_FULL] + self._counts[QUEUE_TIMEOUT_REASON]
+            total = self._counts["admitted"] + degraded
+            return {
+                "max_in_flight": self.max_in_flight,
+                "max_queue": self.max_queue,
+                "queue_timeout_seconds": self.queue_timeout,
+                "in_flight": self._in_flight,
+                "waiting": self._waiting,
+                "peak_in_flight": self._peak_in_flight,
+                "peak_waiting": self._peak_waiting,
+                "max_wait_seconds": round(self._max_wait, 3),
+                **self._counts,
+                "degraded": degraded,
+                "degraded_rate": round(degraded / total, 4) if total else 0.0,
+            }
+
+
+_scoring = None
+_scoring_lock = threading.Lock()
+
+
+def get_scoring_admission():
+    """Process-wide controller for embedding scoring, configured from the environment."""
+    global _scoring
+    with _scoring_lock:
+        if _scoring is None:
+            _scoring = AdmissionController()
+        return _scoring
@@ -0,0 +1,158 @@
+"""
+Analysis-ready audio: each song's original.wav resampled once, at ingest, to
+what the scoring model consumes (16 kHz mono), stored as raw float16 or int16
+samples behind a 32-byte header. Scoring memory-maps the file, so a guess
+costs a page-cache read instead of a WAV decode plus a 48 kHz -> 16 kHz resample.
+
+Header (little-endian, 32 bytes, keeps the samples 2-byte aligned):
+
+    magic b"WA16" | version u8 | dtype u8 (1 = int16, 2 = float16) | channels u16
+    sample_rate u32 | n_samples u64 | duration_seconds f64 | 4 bytes padding
+
+    python analysis_audio.py convert <in.wav> [out]   # write the artefact for a WAV
+    python analysis_audio.py bench [seconds]           # librosa.load vs memory-map per guess
+"""
+
+import os
+import struct
+import uuid
+
+SUFFIX = ".a16"
+SAMPLE_RATE = 16000
+DTYPE = os.environ.get("ANALYSIS_AUDIO_DTYPE", "float16")
+CACHE_DIR = os.environ.get("ANALYSIS_AUDIO_DIR") or os.path.join(os.path.dirname(__file__), "downloads", "analysis")
+
+MAGIC = b"WA16"
+VERSION = 1
+_HEADER = struct.Struct("<4sBBHIQd4x")
+_DTYPE_CODES = {"int16": 1, "float16": 2}
+_DTYPE_NAMES = {code: name for name, code in _DTYPE_CODES.items()}
+
+
+def artefact_path(wav_path):
+    """Where the artefact for wav_path (a file path, S3 key or URL) lives: same directory, same stem."""
+    return os.path.splitext(wav_path)[0] + SUFFIX
+
+
+def write(samples, out_path, sample_rate=SAMPLE_RATE, dtype=DTYPE):
+    """Write mono float samples in [-1, 1] as an artefact. Written to a temp file first, then renamed."""
+    import numpy as np
+    if dtype not in _DTYPE_CODES:
+        raise ValueError(f"unsupported analysis audio dtype {dtype!r}")
+    samples = np.asarray(samples, dtype=np.float32)
+    if dtype == "int16":
+        data = np.clip(np.round(samples * 32767), -32768, 32767).astype("<i2")
+    else:
+        data = samples.astype("<f2")
+    header = _HEADER.pack(MAGIC, VERSION, _DTYPE_CODES[dtype], 1, sample_rate, len(data), len(data) / sample_rate)
+    os.makedirs(os.path.dirname(os.path.abspath(out_path)), exist_ok=True)
+    tmp_path = f"{out_path}.{uuid.uuid4().hex}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(header)
+        f.write(data.tobytes())
+    os.replace(tmp_path, out_path)
+    return out_path
+
+
+def convert(wav_path, out_path=None, sample_rate=SAMPLE_RATE, dtype=DTYPE):
+    """
+    Resample wav_path with the same librosa.load call scoring used to make on
+    every guess, and write the result next to it (or to out_path).
+    """
+    import librosa
+    samples, _ = librosa.load(wav_path, sr=sample_rate, mono=True)
+    return write(samples, out_path or artefact_path(wav_path), sample_rate, dtype)
+
+
+def read_header(path):
+    """{"dtype", "channels", "sample_rate", "n_samples", "duration"} of an artefact; ValueError if it isn't one."""
+    with open(path, "rb") as f:
+        raw = f.read(_HEADER.size)
+    if len(raw) < _HEADER.size:
+        raise ValueError(f"{path}: too short for an analysis audio header")
+    magic, version, dtype_code, channels, sample_rate, n_samples, duration = _HEADER.unpack(raw)
+    if magic != MAGIC or version != VERSION or dtype_code not in _DTYPE_NAMES:
+        raise ValueError(f"{path}: not a version {VERSION} analysis audio file")
+    return {"dtype": _DTYPE_NAMES[dtype_code], "channels": channels, "sample_rate": sample_rate,
+            "n_samples": n_samples, "duration": duration}
+
+
+def open_samples(path):
+    """
+    (samples, sample_rate) for an artefact. float16 files come back as a
+    read-only memory map, so nothing is read until it is sliced; int16 files
+    are scaled to float32, which copies.
+    """
+    import numpy as np
+    header = read_header(path)
+    expected = _HEADER.size + header["n_samples"] * 2
+    if os.path.getsize(path) != expected:
+        raise ValueError(f"{path}: truncated ({os.path.getsize(path)} bytes, expected {expected})")
+    dtype = "<f2" if header["dtype"] == "float16" else "<i2"
+    samples = np.memmap(path, dtype=dtype, mode="r", offset=_HEADER.size, shape=(header["n_samples"],))
+    if header["dtype"] == "int16":
+        samples = samples.astype(np.float32) / 32768
+    return samples, header["sample_rate"]
+
+
+def bench(seconds=180, guesses=20):
+    """Per-guess decode cost of librosa.load on a 48 kHz WAV against opening the artefact."""
+    import tempfile
+    import time
+    import wave
+    import numpy as np
+
+    root = tempfile.mkdtemp(prefix="analysis-bench-")
+    wav_path = os.path.join(root, "original.wav")
+    rng = np.random.default_rng(0)
+    t = np.arange(seconds * 48000) / 48000
+    tone = 0.3 * np.sin(2 * np.pi * 440 * t) + 0.05 * rng.standard_normal(len(t))
+    with wave.open(wav_path, "wb") as w:
+        w.setnchannels(2)
+        w.setsampwidth(2)
+        w.setframerate(48000)
+        w.writeframes(np.repeat((tone * 32767).astype("<i2"), 2).tobytes())
+
+    def per_guess(fn):
+        cpu, wall = [], []
+        for _ in range(guesses):
+            c, s = time.process_time(), time.perf_counter()
+            fn()
+            cpu.append(time.process_time() - c)
+            wall.append(time.perf_counter() - s)
+        return {"cpu_ms": round(sorted(cpu)[len(cpu) // 2] * 1000, 2),
+                "wall_ms": round(sorted(wall)[len(wall) // 2] * 1000, 2)}
+
+    import librosa
+    reference, _ = librosa.load(wav_path, sr=SAMPLE_RATE)
+    results = {"seconds": seconds, "wav_mb": round(os.path.getsize(wav_path) / 2**20, 1)}
+    # Per song a guess touches: get the whole song as 16 kHz samples, then read a 15 s clip of it.
+    results["librosa_load"] = per_guess(lambda: librosa.load(wav_path, sr=SAMPLE_RATE)[0][:15 * SAMPLE_RATE].sum())
+    for dtype in ("float16", "int16"):
+        path = os.path.join(root, f"original-{dtype}{SUFFIX}")
+        start = time.perf_counter()
+        convert(wav_path, path, dtype=dtype)
+        convert_ms = (time.perf_counter() - start) * 1000
+        samples, _ = open_samples(path)
+        results[dtype] = {
+            "artefact_mb": round(os.path.getsize(path) / 2**20, 2),
+            "convert_once_ms": round(convert_ms, 1),
+            "max_abs_error": float(np.max(np.abs(np.asarray(samples, dtype=np.float32) - reference))),
+            **per_guess(lambda: open_samples(path)[0][:15 * SAMPLE_RATE].sum()),
+        }
+    return results
+
+
+if __name__ == "__main__":
+    import json
+    import sys
+    if len(sys.argv) >= 3 and sys.argv[1] == "convert":
+        out = convert(sys.argv[2], sys.argv[3] if len(sys.argv) > 3 else None)
+        print(json.dumps({"path": out, **read_header(out)}, indent=2))
+    elif len(sys.argv) >= 2 and sys.argv[1] == "bench":
+        print(json.dumps(bench(int(sys.argv[2]) if len(sys.argv) > 2 else 180), indent=2))
+    else:
+        print("Usage:")
+        print("  python analysis_audio.py convert <in.wav> [out]")
+        print("  python analysis_audio.py bench [seconds]")
+        sys.exit(1)
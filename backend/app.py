@@ -1,8 +1,22 @@
-from flask import Flask, jsonify, send_file, request
+from flask import Flask, Response, jsonify, send_file, request, stream_with_context
 from flask_cors import CORS
 from werkzeug.security import generate_password_hash, check_password_hash
 import os
-from similarity_score import calculate_similarity
+import json
+import base64
+import itertools
+import re
+import threading
+import uuid
+from datetime import datetime
+from contextlib import nullcontext
+import similarity_score
+from similarity_score import calculate_similarity, calculate_similarity_batch, metadata_similarity
+from admission import get_scoring_admission
+from elo import get_ledger
+from upload_stems_to_s3 import stem_urls_from_original
+from rounds import pick_clip_start, play_spotify_ids
+from catalog import get_catalog
 
 app = Flask(__name__)
 CORS(app)
@@ -15,30 +29,33 @@ try:
 except ImportError:
     pass
 
-spotify_to_songname = {}
-songname_to_spotify = {}
-try:
-    songmap_path = os.path.join(os.path.dirname(__file__), 'songmap.txt')
-    with open(songmap_path, 'r') as f:
-        for line in f:
-            line = line.strip()
-            if line and ',' in line:
-                song_name, spotify_id = line.split(',', 1)
-                spotify_to_songname[spotify_id] = song_name
-                songname_to_spotify[song_name] = spotify_id
-except Exception as e:
-    print(f"Warning: Could not load songmap.txt: {e}")
+
+# Load the scoring model in the background at startup instead of on the first guess.
+# Leave unset on web-only workers that proxy scoring elsewhere.
+if os.environ.get('SCORING_PRELOAD', '').lower() in ('1', 'true', 'yes'):
+    similarity_score.preload()
 
 SUPABASE_URL = os.environ.get('SUPABASE_URL')
 SUPABASE_KEY = os.environ.get('SUPABASE_SERVICE_ROLE_KEY') or os.environ.get('SUPABASE_KEY')
 supabase_client = None
-if SUPABASE_URL and SUPABASE_KEY:
+if os.environ.get('STORAGE_BACKEND', 'supabase').lower() == 'sqlite':
+    # Embedded database (sqlite_store.py); shares supabase_helpers' client.
+    from supabase_helpers import _client
+    supabase_client = _client()
+elif SUPABASE_URL and SUPABASE_KEY:
     try:
         from supabase import create_client
         supabase_client = create_client(SUPABASE_URL, SUPABASE_KEY)
     except Exception:
         supabase_client = None
 
+# Columns the API actually returns; avoids pulling the metadata jsonb for every row.
+SONG_COLUMNS = (
+    'id, spotify_id, title, artists, year, duration, created_at, url_original, '
+    'url_drum, url_bass, url_piano, url_guitar, url_vocals, url_other'
+)
+
+
 def _row_to_song(row):
     """Map Supabase songs row to API shape (id, name, filename + URLs for frontend)."""
     return {
@@ -47,7 +64,7 @@ def _row_to_song(row):
         'filename': row.get('url_original'),
         'artists': row.get('artists'),
         'year': row.get('year'),
-        'metadata': row.get('metadata'),
+        'duration': row.get('duration'),
         'url_original': row.get('url_original'),
         'url_drum': row.get('url_drum'),
         'url_bass': row.get('url_bass'),
@@ -58,25 +75,146 @@ def _row_to_song(row):
     }
 
 
+SONGS_PAGE_SIZE = 500
+MAX_SONGS_PAGE_SIZE = 1000
+
+
+def _encode_cursor(row):
+    """Opaque keyset cursor pointing just past row in (created_at desc, id desc) order."""
+    raw = json.dumps([row['created_at'], str(row['id'])]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+_CURSOR_TIMESTAMP = re.compile(r'[0-9T:. +\-Z]+')
+
+
+def _decode_cursor(cursor):
+    """
+    (created_at, id) from a cursor. Both end up inside a PostgREST filter, so
+    anything but an ISO timestamp and a uuid is rejected with ValueError.
+    """
+    raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+    created_at, song_id = json.loads(raw)
+    created_at = str(created_at)
+    if not _CURSOR_TIMESTAMP.fullmatch(created_at):
+        raise ValueError('cursor created_at is not a timestamp')
+    datetime.fromisoformat(created_at)
+    return created_at, str(uuid.UUID(str(song_id)))
+
+
+def _song_pages(page_size, cursor=None):
+    """
+    Yield pages of songs rows newest first, using keyset pagination on
+    (created_at, id) so each page is an index range scan, not an OFFSET.
+    """
+    while True:
+        query = (supabase_client.table('songs').select(SONG_COLUMNS)
+                 .order('created_at', desc=True).order('id', desc=True).limit(page_size))
+        if cursor is not None:
+            created_at, song_id = cursor
+            query = query.or_(f'created_at.lt."{created_at}",and(created_at.eq."{created_at}",id.lt.{song_id})')
+        rows = query.execute().data or []
+        if rows:
+            yield rows
+        if len(rows) < page_size:
+            return
+        cursor = (rows[-1]['created_at'], str(rows[-1]['id']))
+
+
+_local_songs_cache = {'mtime': None, 'songs': []}
+_local_songs_lock = threading.Lock()
+
+
+def _local_songs():
+    """Songs in DOWNLOADS_DIR, rescanned only when the directory's mtime changes (a file was added or removed)."""
+    try:
+        mtime = os.stat(DOWNLOADS_DIR).st_mtime_ns
+    except FileNotFoundError:
+        return []
+    with _local_songs_lock:
+        if _local_songs_cache['mtime'] != mtime:
+            songs = []
+            for filename in sorted(os.listdir(DOWNLOADS_DIR)):
+                if filename.endswith(('.m4a', '.mp3', '.opus', '.webm')):
+                    songs.append({
+                        'id': filename,
+                        'name': os.path.splitext(filename)[0],
+                        'filename': filename
+                    })
+            _local_songs_cache.update(mtime=mtime, songs=songs)
+        return _local_songs_cache['songs']
+
+
 @app.route('/api/songs', methods=['GET'])
 def get_songs():
+    """
+    List songs, newest first.
+    Query:
+      limit=<n>&cursor=<next_cursor>  one page: {"songs": [...], "next_cursor": str | null}
+      format=ndjson                   every song, one JSON object per line, streamed
+      (neither)                       every song as a JSON array, streamed
+    The streamed forms read the table page by page, so memory per request
+    stays constant however large the catalog is.
+    """
     try:
         if supabase_client:
-            r = supabase_client.table('songs').select('*').order('created_at', desc=True).execute()
-            return jsonify([_row_to_song(row) for row in (r.data or [])])
-
-        if not os.path.exists(DOWNLOADS_DIR):
-            return jsonify([])
-
-        songs = []
-        for filename in os.listdir(DOWNLOADS_DIR):
-            if filename.endswith(('.m4a', '.mp3', '.opus', '.webm')):
-                songs.append({
-                    'id': filename,
-                    'name': os.path.splitext(filename)[0],
-                    'filename': filename
+            if 'limit' in request.args or 'cursor' in request.args:
+                try:
+                    limit = min(max(int(request.args.get('limit', SONGS_PAGE_SIZE)), 1), MAX_SONGS_PAGE_SIZE)
+                    cursor = _decode_cursor(request.args['cursor']) if request.args.get('cursor') else None
+                except (ValueError, TypeError):
+                    return jsonify({'error': 'Invalid limit or cursor'}), 400
+                rows = next(_song_pages(limit, cursor), [])
+                return jsonify({
+                    'songs': [_row_to_song(row) for row in rows],
+                    'next_cursor': _encode_cursor(rows[-1]) if len(rows) == limit else None,
                 })
-        return jsonify(songs)
+
+            # The first page is read before the response starts, so a failing
+            # query is still a 500 rather than a 200 with a broken body.
+            pages = _song_pages(SONGS_PAGE_SIZE)
+            first_page = next(pages, None)
+            pages = itertools.chain([first_page] if first_page else [], pages)
+            if request.args.get('format') == 'ndjson':
+                def ndjson():
+                    for rows in pages:
+                        yield ''.join(json.dumps(_row_to_song(row)) + '\n' for row in rows)
+                return Response(stream_with_context(ndjson()), mimetype='application/x-ndjson')
+
+            def json_array():
+                yield '['
+                first = True
+                for rows in pages:
+                    chunk = ','.join(json.dumps(_row_to_song(row)) for row in rows)
+                    yield chunk if first else ',' + chunk
+                    first = False
+                yield ']'
+            return Response(stream_with_context(json_array()), mimetype='application/json')
+
+        return jsonify(_local_songs())
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/api/songs/search', methods=['GET'])
+def search_songs():
+    """
+    Typeahead search over song titles and artists.
+    Query: q=<words typed so far>, limit=<max results, default 10, max 50>
+    """
+    query = (request.args.get('q') or '').strip()
+    try:
+        limit = min(max(int(request.args.get('limit', 10)), 1), 50)
+    except ValueError:
+        return jsonify({'error': 'limit must be an integer'}), 400
+    if not query:
+        return jsonify([])
+    try:
+        results = get_catalog().search(query, limit=limit)
+        return jsonify([
+            {'id': str(song['id']), 'name': song.get('title') or '', 'artists': song.get('artists'), 'year': song.get('year')}
+            for song in results
+        ])
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -109,46 +247,53 @@ def _s3_bucket_from_url(url):
     return None
 
 
-STEM_INSTRUMENTS = ["drums", "bass", "piano", "guitar", "vocals", "other"]
-STEM_URL_KEYS = {"drums": "url_drum", "bass": "url_bass", "piano": "url_piano", "guitar": "url_guitar", "vocals": "url_vocals", "other": "url_other"}
-
-
 def _public_stem_urls(url_original):
     """Build public stem URLs by appending -drums.wav, -bass.wav, etc. to the base URL (no signing)."""
-    if not url_original or not url_original.strip():
-        return {}
-    base = url_original.rsplit(".", 1)[0] if "." in url_original else url_original
-    out = {}
-    for inst in STEM_INSTRUMENTS:
-        out[STEM_URL_KEYS[inst]] = f"{base}-{inst}.wav"
-    return out
+    return stem_urls_from_original(url_original)
+
+
+# Private buckets: S3_PRESIGN=1 serves presigned URLs instead (see aws.presign_urls).
+# Only objects in the configured bucket (S3_BUCKET / AWS_S3_BUCKET) under
+# S3_PRESIGN_PREFIX are signed; anything else passes through unsigned.
+S3_PRESIGN = os.environ.get('S3_PRESIGN', '').lower() in ('1', 'true', 'yes')
+S3_PRESIGN_PREFIX = os.environ.get('S3_PRESIGN_PREFIX', '')
+
+
+def _presign_allowed(bucket, key):
+    configured = os.environ.get('S3_BUCKET') or os.environ.get('AWS_S3_BUCKET')
+    return bool(bucket) and bucket == configured and key.startswith(S3_PRESIGN_PREFIX)
+
+
+def _presigned(urls):
+    """Presign the S3 URLs in urls ({column: url}) in one batch per bucket; other URLs pass through."""
+    import aws
+    targets = {column: aws.parse_s3_url(url) for column, url in urls.items()}
+    keys_by_bucket = {}
+    for column, (bucket, key, region) in targets.items():
+        if _presign_allowed(bucket, key):
+            keys_by_bucket.setdefault((bucket, region), []).append(key)
+        elif bucket:
+            print(f"[S3] not presigning {urls[column]!r}: outside bucket/prefix")
+    signed = {target: aws.presign_urls(target[0], keys, region=target[1]) for target, keys in keys_by_bucket.items()}
+    return {column: signed.get((bucket, region), {}).get(key, urls[column])
+            for column, (bucket, key, region) in targets.items()}
 
 
 def _stem_urls_for_song(url_original, bucket=None):
-    """Build stem URLs from url_original. Uses public URLs (no signatures)."""
+    """
+    Stem URLs derived from url_original. Public URLs by default; with
+    S3_PRESIGN the original and all six stems are presigned together and the
+    result includes the signed url_original.
+    """
     if not url_original:
         return {}
     urls = _public_stem_urls(url_original)
+    if S3_PRESIGN:
+        return _presigned({'url_original': url_original, **urls})
     print(f"[S3] public stem URLs: url_original={url_original!r} -> {list(urls.keys())}")
     return urls
 
 
-def _spotify_ids_from_play_file():
-    """Read play.txt (same dir as this file); return list of spotify IDs. Lines can be 'id' or 'name,id'."""
-    play_path = os.path.join(os.path.dirname(__file__), 'play.txt')
-    if not os.path.exists(play_path):
-        return []
-    ids = []
-    with open(play_path, 'r') as f:
-        for line in f:
-            line = line.strip()
-            if not line:
-                continue
-            part = line.split(',')[-1].strip()
-            if part:
-                ids.append(part)
-    return ids
-
 @app.route('/api/songs/random', methods=['GET'])
 def get_random_song():
     """Return a random song from the DB with stem URLs built from S3 (base + instrument). Song is chosen from play.txt."""
@@ -158,11 +303,11 @@ def get_random_song():
     snippet_length = float(request.args.get('snippet_length', 15))
     try:
         import random
-        spotify_ids = _spotify_ids_from_play_file()
+        spotify_ids = play_spotify_ids()
         if not spotify_ids:
             return jsonify({'error': 'play.txt is empty or not found'}), 404
         spotify_id = random.choice(spotify_ids)
-        r = supabase_client.table('songs').select('*').eq('spotify_id', spotify_id).execute()
+        r = supabase_client.table('songs').select(SONG_COLUMNS).eq('spotify_id', spotify_id).limit(1).execute()
         rows = r.data or []
         if not rows:
             return jsonify({'error': f'Song with spotify_id {spotify_id} not in database'}), 404
@@ -176,16 +321,7 @@ def get_random_song():
             for k, v in stems.items():
                 song[k] = v
         
-        duration = row.get('duration')
-        if duration and duration > snippet_length:
-            max_start_time = duration - snippet_length
-            clip_start_time = random.random() * max_start_time
-        else:
-            default_duration = 180.0
-            max_start_time = max(0, default_duration - snippet_length)
-            clip_start_time = random.random() * max_start_time
-        
-        song['clip_start_time'] = clip_start_time
+        song['clip_start_time'] = pick_clip_start(row.get('duration'), snippet_length)
         return jsonify(song)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -194,18 +330,86 @@ def get_random_song():
 @app.route('/api/stem-urls', methods=['GET'])
 def get_stem_urls():
     """
-    Derive public stem URLs from url_original (no Supabase or signing).
+    Derive stem URLs from url_original. With S3_PRESIGN set the URLs are presigned,
+    and only for a url_original that belongs to a song in the database.
     Query: url_original=<full S3 or any public URL>
     Returns: url_original + url_drum, url_bass, url_piano, url_guitar, url_vocals, url_other.
     """
     url_original = (request.args.get('url_original') or '').strip()
     if not url_original:
         return jsonify({'error': 'Missing url_original query parameter'}), 400
+    if S3_PRESIGN:
+        if not supabase_client:
+            return jsonify({'error': 'Supabase not configured'}), 503
+        try:
+            r = supabase_client.table('songs').select('id').eq('url_original', url_original).limit(1).execute()
+        except Exception as e:
+            return jsonify({'error': str(e)}), 500
+        if not r.data:
+            return jsonify({'error': 'No song with that url_original'}), 404
     stems = _stem_urls_for_song(url_original)
     out = {'url_original': url_original, **stems}
     return jsonify(out)
 
 
+def _metadata_summary(metadata):
+    return {
+        'key': metadata.get('key'),
+        'mode': metadata.get('mode'),
+        'tempo': round(metadata.get('tempo', 0), 1),
+        'energy': round(metadata.get('energy', 0), 2),
+        'valence': round(metadata.get('valence', 0), 2),
+        'loudness': round(metadata.get('loudness', 0), 2),
+    }
+
+
+def _guess_result(is_correct, scored):
+    """
+    The scoring part of a guess response. scored is what calculate_similarity
+    returns, (score, actual metadata, guessed metadata, breakdown), or None when
+    scoring failed.
+    """
+    if scored is None:
+        return {
+            'actual_song_metadata': {},
+            'guessed_song_metadata': {},
+            'similarity_score': 100 if is_correct else 50,
+            'message': "Perfect match! You guessed correctly!" if is_correct else "Unable to calculate detailed similarity.",
+            'breakdown': {},
+            'is_correct': is_correct,
+        }
+    overall_score, actual_metadata, guessed_metadata, metadata_breakdown = scored
+    similarity_percentage = int(overall_score * 100)
+
+    breakdown = {
+        'Key Match': int(metadata_breakdown['key'] * 100),
+        'Tempo Match': int(metadata_breakdown['tempo'] * 100),
+        'Energy Match': int(metadata_breakdown['energy'] * 100),
+        'Mood Match': int(metadata_breakdown['mood'] * 100),
+        'Loudness Match': int(metadata_breakdown['loud'] * 100),
+    }
+
+    if is_correct:
+        message = "Perfect match! You guessed correctly!"
+    elif similarity_percentage >= 80:
+        message = "Incredible! These songs are extremely similar!"
+    elif similarity_percentage >= 70:
+        message = "Very close! The songs share many characteristics."
+    elif similarity_percentage >= 50:
+        message = "Somewhat similar, but not quite right."
+    else:
+        message = "Not very similar. Keep trying!"
+
+    return {
+        'actual_song_metadata': _metadata_summary(actual_metadata),
+        'guessed_song_metadata': _metadata_summary(guessed_metadata),
+        'similarity_score': similarity_percentage,
+        'message': message,
+        'breakdown': breakdown,
+        'is_correct': is_correct,
+    }
+
+
 @app.route('/api/guess', methods=['POST'])
 def submit_guess():
     """Compare a guessed song with the actual song and return similarity data."""
@@ -217,18 +421,20 @@ def submit_guess():
         actual_song_id = data.get('actual_song_id')
         guessed_song_id = data.get('guessed_song_id')
         clip_start_time = data.get('clip_start_time', 0)
+        user_id = data.get('user_id')
+        stems_unmuted = data.get('stems_unmuted') or []
         
         if not actual_song_id or not guessed_song_id:
             return jsonify({'error': 'Missing actual_song_id or guessed_song_id'}), 400
         
-        actual_song_result = supabase_client.table('songs').select('*').eq('id', actual_song_id).execute()
-        guessed_song_result = supabase_client.table('songs').select('*').eq('id', guessed_song_id).execute()
+        result = supabase_client.table('songs').select(SONG_COLUMNS).in_('id', [actual_song_id, guessed_song_id]).execute()
+        rows_by_id = {str(row['id']): row for row in (result.data or [])}
         
-        if not actual_song_result.data or not guessed_song_result.data:
+        if str(actual_song_id) not in rows_by_id or str(guessed_song_id) not in rows_by_id:
             return jsonify({'error': 'One or both songs not found'}), 404
         
-        actual_song_row = actual_song_result.data[0]
-        guessed_song_row = guessed_song_result.data[0]
+        actual_song_row = rows_by_id[str(actual_song_id)]
+        guessed_song_row = rows_by_id[str(guessed_song_id)]
         actual_song = _row_to_song(actual_song_row)
         guessed_song = _row_to_song(guessed_song_row)
         
@@ -240,8 +446,9 @@ def submit_guess():
         if not actual_spotify_id or not guessed_spotify_id:
             return jsonify({'error': 'Songs missing spotify_id field'}), 400
         
-        actual_song_name = spotify_to_songname.get(actual_spotify_id)
-        guessed_song_name = spotify_to_songname.get(guessed_spotify_id)
+        catalog = get_catalog()
+        actual_song_name = catalog.slug_for_spotify_id(actual_spotify_id)
+        guessed_song_name = catalog.slug_for_spotify_id(guessed_spotify_id)
 
         print("ACTUAL SONG NAME:", actual_song_name)
         print("GUESSED SONG NAME:", guessed_song_name)
@@ -251,82 +458,149 @@ def submit_guess():
                 'error': f'Song not found in songmap: actual={actual_spotify_id}, guessed={guessed_spotify_id}'
             }), 404
         
+        # Embedding scoring is admission-controlled; when it's saturated the guess is
+        # scored from metadata alone and the response says so. A correct guess never
+        # embeds anything, so it doesn't take a slot.
+        degraded_reason = None
+        scoring_failed = False
         try:
-            overall_score, actual_metadata, guessed_metadata, metadata_breakdown = calculate_similarity(actual_song_name, guessed_song_name, int(clip_start_time), duration=15)
-            similarity_percentage = int(overall_score * 100)
-
-            
-            breakdown = {
-                'Key Match': int(metadata_breakdown['key'] * 100),
-                'Tempo Match': int(metadata_breakdown['tempo'] * 100),
-                'Energy Match': int(metadata_breakdown['energy'] * 100),
-                'Mood Match': int(metadata_breakdown['mood'] * 100),
-                'Loudness Match': int(metadata_breakdown['loud'] * 100),
-            }
-            
-            actual_song_metadata = {
-                'key': actual_metadata.get('key'),
-                'mode': actual_metadata.get('mode'),
-                'tempo': round(actual_metadata.get('tempo', 0), 1),
-                'energy': round(actual_metadata.get('energy', 0), 2),
-                'valence': round(actual_metadata.get('valence', 0), 2),
-                'loudness': round(actual_metadata.get('loudness', 0), 2),
-            }
-            
-            guessed_song_metadata = {
-                'key': guessed_metadata.get('key'),
-                'mode': guessed_metadata.get('mode'),
-                'tempo': round(guessed_metadata.get('tempo', 0), 1),
-                'energy': round(guessed_metadata.get('energy', 0), 2),
-                'valence': round(guessed_metadata.get('valence', 0), 2),
-                'loudness': round(guessed_metadata.get('loudness', 0), 2),
-            }
-            
-            if is_correct:
-                message = "Perfect match! You guessed correctly!"
-            elif similarity_percentage >= 80:
-                message = "Incredible! These songs are extremely similar!"
-            elif similarity_percentage >= 70:
-                message = "Very close! The songs share many characteristics."
-            elif similarity_percentage >= 50:
-                message = "Somewhat similar, but not quite right."
-            else:
-                message = "Not very similar. Keep trying!"
-            
+            with (nullcontext() if is_correct else get_scoring_admission().slot()) as rejected:
+                if rejected is None:
+                    scored = calculate_similarity(actual_song_name, guessed_song_name, int(clip_start_time), duration=15)
+                else:
+                    degraded_reason = rejected
+                    print(f"[guess] scoring degraded to metadata only ({rejected})")
+                    scored = metadata_similarity(actual_song_name, guessed_song_name)
+            scored = _guess_result(is_correct, scored)
         except Exception as similarity_error:
             print(f"Error calculating similarity: {similarity_error}")
             import traceback
             traceback.print_exc()
-            if is_correct:
-                similarity_percentage = 100
-                message = "Perfect match! You guessed correctly!"
-            else:
-                similarity_percentage = 50
-                message = "Unable to calculate detailed similarity."
-            breakdown = {}
-            actual_song_metadata = {}
-            guessed_song_metadata = {}
+            scored = _guess_result(is_correct, None)
+            scoring_failed = not is_correct
+        similarity_percentage = scored['similarity_score']
+
+        # A metadata-only or placeholder score reflects server load, not the guess,
+        # so it is recorded without moving the player's ELO.
+        rated = degraded_reason is None and not scoring_failed
+        elo_change, elo_rating = get_ledger().record_guess(
+            user_id=user_id,
+            actual_song_id=actual_song_id,
+            guessed_song_id=guessed_song_id,
+            similarity_score=similarity_percentage,
+            is_correct=is_correct,
+            stems_unmuted=stems_unmuted,
+            rated=rated,
+        )
         
         return jsonify({
             'actual_song': actual_song,
             'guessed_song': guessed_song,
-            'actual_song_metadata': actual_song_metadata,
-            'guessed_song_metadata': guessed_song_metadata,
-            'similarity_score': similarity_percentage,
-            'message': message,
-            'breakdown': breakdown,
-            'is_correct': is_correct
+            **scored,
+            'elo_change': elo_change,
+            'elo_rating': elo_rating,
+            'rated': rated,
+            'degraded': degraded_reason is not None,
+            'degraded_reason': degraded_reason
         })
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 
+GUESS_BATCH_MAX = int(os.environ.get('GUESS_BATCH_MAX', 25))
+
+
+@app.route('/api/guess/batch', methods=['POST'])
+def submit_guess_batch():
+    """
+    Score many guessed songs against one actual song and clip, for hints, bots
+    and analytics. Body: actual_song_id, guessed_song_ids (list), clip_start_time.
+    Each entry of results has the shape /api/guess returns, minus the ELO fields:
+    nothing is recorded. Unknown ids get {'guessed_song_id', 'error'} instead.
+    At most GUESS_BATCH_MAX ids; see check_guess_batch.py.
+    """
+    try:
+        if not supabase_client:
+            return jsonify({'error': 'Database not configured'}), 500
+
+        data = request.get_json()
+        actual_song_id = data.get('actual_song_id')
+        guessed_song_ids = data.get('guessed_song_ids')
+        clip_start_time = data.get('clip_start_time', 0)
+
+        if not actual_song_id or not isinstance(guessed_song_ids, list) or not guessed_song_ids:
+            return jsonify({'error': 'Missing actual_song_id or guessed_song_ids'}), 400
+        if len(guessed_song_ids) > GUESS_BATCH_MAX:
+            return jsonify({'error': f'At most {GUESS_BATCH_MAX} guessed_song_ids per request'}), 400
+
+        ids = list(dict.fromkeys([str(actual_song_id)] + [str(i) for i in guessed_song_ids]))
+        result = supabase_client.table('songs').select(SONG_COLUMNS).in_('id', ids).execute()
+        rows_by_id = {str(row['id']): row for row in (result.data or [])}
+
+        catalog = get_catalog()
+        slugs = {song_id: catalog.slug_for_spotify_id(row.get('spotify_id')) for song_id, row in rows_by_id.items()}
+        actual_slug = slugs.get(str(actual_song_id))
+        if not actual_slug:
+            return jsonify({'error': 'Actual song not found'}), 404
+
+        known = [str(i) for i in guessed_song_ids if slugs.get(str(i))]
+        embedded = len(set(known) - {str(actual_song_id)})
+
+        # The batch takes one admission slot per candidate it embeds (capped at
+        # SCORING_MAX_IN_FLIGHT); when they aren't granted every candidate is
+        # scored from metadata alone, as /api/guess does.
+        degraded_reason = None
+        try:
+            with (get_scoring_admission().slot(embedded) if embedded else nullcontext()) as rejected:
+                if rejected is not None:
+                    degraded_reason = rejected
+                    print(f"[guess/batch] scoring degraded to metadata only ({rejected})")
+                scores = calculate_similarity_batch(actual_slug, [slugs[i] for i in known], int(clip_start_time),
+                                                    duration=15, embed=rejected is None)
+        except Exception as similarity_error:
+            print(f"Error calculating batch similarity: {similarity_error}")
+            import traceback
+            traceback.print_exc()
+            scores = [None] * len(known)
+        scored_by_id = dict(zip(known, scores))
+
+        actual_song = _row_to_song(rows_by_id[str(actual_song_id)])
+        results = []
+        for guessed_song_id in guessed_song_ids:
+            if str(guessed_song_id) not in scored_by_id:
+                results.append({'guessed_song_id': guessed_song_id, 'error': 'Song not found'})
+                continue
+            results.append({
+                'actual_song': actual_song,
+                'guessed_song': _row_to_song(rows_by_id[str(guessed_song_id)]),
+                **_guess_result(str(guessed_song_id) == str(actual_song_id), scored_by_id[str(guessed_song_id)]),
+                'degraded': degraded_reason is not None,
+                'degraded_reason': degraded_reason,
+            })
+
+        return jsonify({
+            'actual_song': actual_song,
+            'results': results,
+            'degraded': degraded_reason is not None,
+            'degraded_reason': degraded_reason,
+        })
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
 @app.route('/api/health', methods=['GET'])
 def health():
     return jsonify({'status': 'ok'})
 
 
+@app.route('/api/scoring/stats', methods=['GET'])
+def scoring_stats():
+    """Admission-control counters for guess scoring: slots in use, queue, degraded responses."""
+    return jsonify(get_scoring_admission().stats())
+
+
 # ===== USER ENDPOINTS =====
 
 @app.route('/api/users/signup', methods=['POST'])
@@ -408,6 +682,9 @@ def login():
         
         if not check_password_hash(user['password_hash'], password):
             return jsonify({'error': 'Invalid username or password'}), 401
+
+        ledger = get_ledger()
+        ledger.seed(user['id'], user['elo_rating'])
         
         return jsonify({
             'message': 'Login successful',
@@ -415,7 +692,7 @@ def login():
                 'id': user['id'],
                 'username': user['username'],
                 'email': user['email'],
-                'elo_rating': user['elo_rating'],
+                'elo_rating': ledger.current_rating(user['id'], user['elo_rating']),
                 'created_at': user['created_at']
             }
         }), 200
@@ -435,8 +712,11 @@ def get_user(username):
         
         if not result.data:
             return jsonify({'error': 'User not found'}), 404
-        
-        return jsonify({'user': result.data[0]}), 200
+
+        # Ratings changed since the last write-behind flush are only in memory.
+        user = result.data[0]
+        user['elo_rating'] = get_ledger().current_rating(user['id'], user['elo_rating'])
+        return jsonify({'user': user}), 200
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -444,7 +724,7 @@ def get_user(username):
 
 @app.route('/api/users/<user_id>/elo', methods=['PATCH'])
 def update_elo(user_id):
-    """Update user's ELO rating."""
+    """Set a user's ELO rating. Normal play updates ratings server-side through /api/guess."""
     try:
         if not supabase_client:
             return jsonify({'error': 'Database not configured'}), 500
@@ -455,14 +735,13 @@ def update_elo(user_id):
         if new_elo is None:
             return jsonify({'error': 'elo_rating is required'}), 400
         
-        result = supabase_client.table('users').update({
-            'elo_rating': new_elo
-        }).eq('id', user_id).execute()
+        # Persisted as an adjustment event so it is ordered with pending game deltas.
+        elo_rating = get_ledger().set_rating(user_id, new_elo)
         
-        if result.data:
+        if elo_rating is not None:
             return jsonify({
                 'message': 'ELO rating updated',
-                'user': result.data[0]
+                'user': {'id': user_id, 'elo_rating': elo_rating}
             }), 200
         else:
             return jsonify({'error': 'User not found'}), 404
@@ -1,13 +1,99 @@
-import os, boto3
+import os, re, boto3, hashlib, threading, time
 from dotenv import load_dotenv
 from botocore.client import Config
+from botocore.exceptions import ClientError
+from boto3.s3.transfer import TransferConfig
 
 if not os.environ.get("GITHUB_ACTIONS") and not os.environ.get("DYNO"):
     load_dotenv()
     load_dotenv(os.path.join(os.path.dirname(__file__), "..", ".env"))
     load_dotenv("env")
 
-def upload_file(filename, bucket, object_name=None):
+DEFAULT_REGION = "us-east-2"
+MB = 1024 * 1024
+
+# Stems are ~30-60 MB WAVs: split them into 16 MB parts uploaded 8 at a time.
+# file_etag() uses the same threshold/chunk size to predict the multipart ETag.
+TRANSFER_CONFIG = TransferConfig(
+    multipart_threshold=16 * MB,
+    multipart_chunksize=16 * MB,
+    max_concurrency=8,
+    use_threads=True,
+)
+
+# upload_file results; both are truthy, so "if not upload_file(...)" still means failure.
+UPLOADED = "uploaded"
+UNCHANGED = "unchanged"
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_client(region=None):
+    '''
+    Return a shared S3 client for the current credentials and region.
+    boto3 clients are thread-safe, so one client (and its connection pool) is
+    reused by every call instead of building a new one each time.
+    Set S3_ENDPOINT_URL to point at a local S3 stand-in (see s3_mock.py).
+    '''
+    access = os.getenv('AWS_ID') or os.getenv('AWS_ACCESS_KEY_ID')
+    secret = os.getenv('AWS_KEY') or os.getenv('AWS_SECRET_ACCESS_KEY')
+    region = region or os.getenv('AWS_REGION') or DEFAULT_REGION
+    endpoint = os.getenv('S3_ENDPOINT_URL')
+    key = (access, secret, region, endpoint)
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None:
+            client = boto3.client(
+                's3',
+                aws_access_key_id=access,
+                aws_secret_access_key=secret,
+                endpoint_url=endpoint,
+                config=Config(
+                    signature_version="s3v4",
+                    region_name=region,
+                    max_pool_connections=32,
+                    s3={'addressing_style': 'path'} if endpoint else {},
+                ),
+            )
+            _clients[key] = client
+        return client
+
+
+def file_etag(filename, config=TRANSFER_CONFIG):
+    '''
+    ETag S3 will report for filename when uploaded with config: the MD5 of the
+    file for single-part uploads, or the MD5 of the part MD5s plus "-<parts>"
+    for multipart uploads.
+    '''
+    size = os.path.getsize(filename)
+    with open(filename, 'rb') as f:
+        if size < config.multipart_threshold:
+            return hashlib.md5(f.read()).hexdigest()
+        part_digests = []
+        while True:
+            chunk = f.read(config.multipart_chunksize)
+            if not chunk:
+                break
+            part_digests.append(hashlib.md5(chunk).digest())
+    return f"{hashlib.md5(b''.join(part_digests)).hexdigest()}-{len(part_digests)}"
+
+
+def is_unchanged(filename, bucket, object_name):
+    '''
+    True if bucket/object_name already holds the same bytes as filename,
+    judged by size and ETag. Missing objects count as changed.
+    '''
+    try:
+        head = get_client().head_object(Bucket=bucket, Key=object_name)
+    except ClientError:
+        return False
+    if head.get('ContentLength') != os.path.getsize(filename):
+        return False
+    return head.get('ETag', '').strip('"') == file_etag(filename)
+
+
+def upload_file(filename, bucket, object_name=None, skip_unchanged=False):
     '''
     Upload a file to an s3 bucket
     Parameters
@@ -18,23 +104,26 @@ def upload_file(filename, bucket, object_name=None):
         name of bucket to be uploaded to
     object_name : string
         name of file once uploaded, defaulted to filename
+    skip_unchanged : boolean
+        if True, don't upload when the object already has the same content
 
     Returns
     -------
-    boolean
-        True if successful, False otherwise
+    string or boolean
+        UPLOADED if the file was uploaded, UNCHANGED if it was skipped because
+        the object already has the same content, False if the upload failed
     '''
     if object_name is None:
         object_name = os.path.basename(filename)
-    access = os.getenv('AWS_ID') or os.getenv('AWS_ACCESS_KEY_ID')
-    secret = os.getenv('AWS_KEY') or os.getenv('AWS_SECRET_ACCESS_KEY')
-    client = boto3.client('s3', aws_access_key_id=access, aws_secret_access_key=secret)
     try:
-        client.upload_file(filename, bucket, object_name)
+        if skip_unchanged and is_unchanged(filename, bucket, object_name):
+            print(f"[S3] unchanged, skipping s3://{bucket}/{object_name}")
+            return UNCHANGED
+        get_client().upload_file(filename, bucket, object_name, Config=TRANSFER_CONFIG)
     except Exception as e:
         print(f"file at {filename} was not successfully uploaded {e}")
         return False
-    return True
+    return UPLOADED
 
 def download_file(filename, bucketname, dir):
     '''
@@ -53,11 +142,8 @@ def download_file(filename, bucketname, dir):
     boolean
         True if successful, False otherwise
     '''
-    access = os.getenv('AWS_ID') or os.getenv('AWS_ACCESS_KEY_ID')
-    secret = os.getenv('AWS_KEY') or os.getenv('AWS_SECRET_ACCESS_KEY')
-    client = boto3.client('s3', aws_access_key_id=access, aws_secret_access_key=secret)
     try:
-        client.download_file(bucketname, filename, dir)
+        get_client().download_file(bucketname, filename, dir, Config=TRANSFER_CONFIG)
         print(f"File '{filename}' downloaded from bucket '{bucketname}' to '{dir}'")
     except:
         print(f"failed to download {filename} from {bucketname} to {dir}")
@@ -65,11 +151,8 @@ def download_file(filename, bucketname, dir):
     return True
 
 def delete_file(filename, bucketname):
-    access = os.getenv('AWS_ID') or os.getenv('AWS_ACCESS_KEY_ID')
-    secret = os.getenv('AWS_KEY') or os.getenv('AWS_SECRET_ACCESS_KEY')
-    client = boto3.client('s3', aws_access_key_id=access, aws_secret_access_key=secret)
     try:
-        client.delete_object(Bucket=bucketname, Key=filename)
+        get_client().delete_object(Bucket=bucketname, Key=filename)
         print(f"File '{filename}' deleted from bucket '{bucketname}'")
     except Exception:
         print(f"failed to delete {filename} from {bucketname}")
@@ -77,12 +160,109 @@ def delete_file(filename, bucketname):
     return True
 
 def generate_url(filename, bucketname):
-    access = os.getenv('AWS_ID') or os.getenv('AWS_ACCESS_KEY_ID')
-    secret = os.getenv('AWS_KEY') or os.getenv('AWS_SECRET_ACCESS_KEY')
-    client = boto3.client('s3', aws_access_key_id=access, aws_secret_access_key=secret, config=Config(
-            signature_version="s3v4",
-            region_name="us-east-2",
-        ))
-    url = client.generate_presigned_url(ClientMethod='get_object', Params={'Bucket' : bucketname, 'Key' : filename}, ExpiresIn=120)
+    url = presign_urls(bucketname, [filename], expires_in=120, region=DEFAULT_REGION)[filename]
     print(f"[S3] presigned URL: bucket={bucketname} key={filename}\n  -> {url}")
-    return url
\ No newline at end of file
+    return url
+
+
+# Presigned GET URLs live PRESIGN_EXPIRES seconds. A cached URL is handed out
+# again only while it has at least PRESIGN_MIN_TTL seconds left, so a player
+# that receives it can still start (and finish) fetching the stem.
+PRESIGN_EXPIRES = int(os.getenv('S3_PRESIGN_EXPIRES', 3600))
+PRESIGN_MIN_TTL = int(os.getenv('S3_PRESIGN_MIN_TTL', 300))
+PRESIGN_CACHE_SIZE = 20000
+
+_presigned = {}
+_presigned_lock = threading.Lock()
+
+
+def presign_urls(bucket, keys, expires_in=None, region=None):
+    '''
+    Presigned GET URLs for several objects of one bucket, e.g. a round's
+    original and its six stems, signed with the shared client in one call.
+
+    Parameters
+    ----------
+    bucket : str
+        S3 bucket name.
+    keys : iterable of str
+        Object keys to sign.
+    expires_in : int, optional
+        URL lifetime in seconds. Defaults to PRESIGN_EXPIRES.
+    region : str, optional
+        Region of the bucket, which the signature is scoped to. Defaults to
+        AWS_REGION, then DEFAULT_REGION.
+
+    Returns
+    -------
+    dict
+        {key: url}. URLs are cached per key and reused until less than
+        PRESIGN_MIN_TTL (at most half of expires_in) remains, so repeated
+        rounds of the same song cost a dict lookup instead of a signature.
+    '''
+    expires_in = expires_in or PRESIGN_EXPIRES
+    min_ttl = min(PRESIGN_MIN_TTL, expires_in // 2)
+    region = region or os.getenv('AWS_REGION') or DEFAULT_REGION
+    client = get_client(region)
+    now = time.time()
+    urls, missing = {}, []
+    with _presigned_lock:
+        for key in keys:
+            cached = _presigned.get((region, bucket, key, expires_in))
+            if cached and cached[1] - now >= min_ttl:
+                urls[key] = cached[0]
+            else:
+                missing.append(key)
+    if not missing:
+        return urls
+
+    signed = {}
+    for key in missing:
+        signed[key] = client.generate_presigned_url(
+            ClientMethod='get_object', Params={'Bucket': bucket, 'Key': key}, ExpiresIn=expires_in)
+    with _presigned_lock:
+        if len(_presigned) + len(signed) > PRESIGN_CACHE_SIZE:
+            for cache_key in [k for k, (_, expires_at) in _presigned.items() if expires_at - now < min_ttl]:
+                del _presigned[cache_key]
+            while _presigned and len(_presigned) + len(signed) > PRESIGN_CACHE_SIZE:
+                del _presigned[next(iter(_presigned))]
+        for key, url in signed.items():
+            _presigned[(region, bucket, key, expires_in)] = (url, now + expires_in)
+    urls.update(signed)
+    return urls
+
+
+def _region_from_host(host):
+    """Region named in an AWS S3 hostname (s3.<region>., s3-<region>., s3.dualstack.<region>.), else None."""
+    match = re.search(r'(?:^|\.)s3[.-](?:dualstack\.)?([a-z]{2}(?:-[a-z]+)+-\d+)\.amazonaws\.com(?:\.cn)?$', host)
+    return match.group(1) if match else None
+
+
+def parse_s3_url(url):
+    '''
+    (bucket, key, region) of an S3 object URL: virtual-hosted
+    (https://bucket.s3.region.amazonaws.com/key), path-style
+    (https://s3.region.amazonaws.com/bucket/key) or under S3_ENDPOINT_URL.
+    region is None when the host doesn't name one (legacy global endpoint,
+    S3_ENDPOINT_URL). (None, None, None) if url doesn't look like one.
+    '''
+    from urllib.parse import unquote, urlparse
+    if not url:
+        return None, None, None
+    parsed = urlparse(url)
+    host = parsed.netloc.lower()
+    path = unquote(parsed.path).lstrip('/')
+    endpoint = os.getenv('S3_ENDPOINT_URL')
+    if endpoint and urlparse(endpoint).netloc.lower() == host:
+        bucket, _, key = path.partition('/')
+        return (bucket, key, None) if bucket and key else (None, None, None)
+    if not host.endswith(('.amazonaws.com', '.amazonaws.com.cn')):
+        return None, None, None
+    region = _region_from_host(host)
+    if '.s3.' in host or '.s3-' in host:
+        bucket = re.split(r'\.s3[.-]', host, maxsplit=1)[0]
+        return (bucket, path, region) if path else (None, None, None)
+    if host.startswith(('s3.', 's3-')):
+        bucket, _, key = path.partition('/')
+        return (bucket, key, region) if bucket and key else (None, None, None)
+    return None, None, None
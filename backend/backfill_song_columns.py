@@ -0,0 +1,106 @@
+"""
+Fill the typed songs columns added in supabase/migrations/004_add_song_feature_columns.sql
+for rows that predate them:
+  - key, mode, tempo, energy, valence, danceability, loudness from the metadata jsonb
+  - duration from the WAV header of url_original (a ranged GET, not the whole file)
+  - url_drum, url_bass, ... derived from url_original
+
+Only missing values are written, so the script is safe to re-run.
+"""
+
+import struct
+import requests
+
+from supabase_helpers import FEATURE_COLUMNS, _client, feature_columns
+from upload_stems_to_s3 import STEM_URL_COLUMNS, stem_urls_from_original
+
+PAGE_SIZE = 500
+HEADER_BYTES = 64 * 1024
+
+
+def wav_duration(url):
+    """
+    Duration in seconds of the WAV at url, read from its RIFF header.
+    Returns None if the header can't be fetched or parsed.
+    """
+    try:
+        response = requests.get(url, headers={"Range": f"bytes=0-{HEADER_BYTES - 1}"}, timeout=30)
+        response.raise_for_status()
+    except requests.RequestException as e:
+        print(f"Could not fetch header for {url}: {e}")
+        return None
+    data = response.content
+    if len(data) < 12 or data[:4] != b"RIFF" or data[8:12] != b"WAVE":
+        return None
+
+    # Total object size, for streamed WAVs whose data chunk size is a placeholder.
+    total_size = None
+    content_range = response.headers.get("Content-Range", "")
+    if "/" in content_range and not content_range.endswith("/*"):
+        total_size = int(content_range.rsplit("/", 1)[1])
+    elif response.status_code == 200:
+        total_size = len(data)
+
+    byte_rate = None
+    pos = 12
+    while pos + 8 <= len(data):
+        chunk_id = data[pos:pos + 4]
+        chunk_size = struct.unpack("<I", data[pos + 4:pos + 8])[0]
+        if chunk_id == b"fmt " and pos + 20 <= len(data):
+            byte_rate = struct.unpack("<I", data[pos + 16:pos + 20])[0]
+        elif chunk_id == b"data":
+            if not byte_rate:
+                return None
+            data_start = pos + 8
+            if total_size is not None and (chunk_size in (0, 0xFFFFFFFF) or data_start + chunk_size > total_size):
+                chunk_size = total_size - data_start
+            return chunk_size / byte_rate
+        pos += 8 + chunk_size + (chunk_size & 1)
+    return None
+
+
+def _missing_values(row):
+    """Column values to write for a row, leaving existing ones alone."""
+    update = {}
+    for column, value in feature_columns(row.get("metadata")).items():
+        if row.get(column) is None:
+            update[column] = value
+    for column, url in stem_urls_from_original(row.get("url_original")).items():
+        if not row.get(column):
+            update[column] = url
+    if row.get("duration") is None and row.get("url_original"):
+        duration = wav_duration(row["url_original"])
+        if duration is not None:
+            update["duration"] = round(duration, 3)
+    return update
+
+
+def backfill(dry_run=False):
+    client = _client()
+    columns = ["id", "url_original", "metadata", "duration", *FEATURE_COLUMNS, *STEM_URL_COLUMNS.values()]
+    updated = 0
+    last_id = None
+    while True:
+        query = client.table("songs").select(",".join(columns)).order("id").limit(PAGE_SIZE)
+        if last_id is not None:
+            query = query.gt("id", last_id)
+        rows = query.execute().data or []
+        if not rows:
+            break
+        for row in rows:
+            update = _missing_values(row)
+            if not update:
+                continue
+            print(f"{row['id']}: {sorted(update)}")
+            if not dry_run:
+                client.table("songs").update(update).eq("id", row["id"]).execute()
+            updated += 1
+        last_id = rows[-1]["id"]
+    return updated
+
+
+if __name__ == "__main__":
+    import sys
+    dry_run = "--dry-run" in sys.argv[1:]
+    count = backfill(dry_run=dry_run)
+    print(f"{'Would update' if dry_run else 'Updated'} {count} songs")
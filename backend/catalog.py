@@ -0,0 +1,242 @@
+"""
+In-memory catalog of playable songs, built once per process.
+
+Merges songmap.txt (slug <-> spotify_id, the names similarity_score uses) with
+the songs table (id, title, artists, year) and indexes the result for:
+  - O(1) lookups by songs.id, spotify_id and slug
+  - typeahead search over title and artists (search("blind lig"))
+
+Search tokens are lower-cased, accent-stripped words. Distinct tokens are kept
+sorted, so every song with a token starting with a prefix lies in one
+contiguous range found by bisection. A query is answered from its most
+selective token's range, checking the remaining tokens against each
+candidate's own token list, and stops as soon as `limit` songs are found.
+"""
+
+import bisect
+import os
+import re
+import threading
+import time
+import unicodedata
+
+from rounds import load_songmap
+
+REFRESH_SECONDS = float(os.environ.get("CATALOG_REFRESH_SECONDS", 300))
+PAGE_SIZE = 1000
+
+_WORD = re.compile(r"[a-z0-9]+")
+
+
+def tokenize(text):
+    """Lower-case, accent-stripped alphanumeric words of text."""
+    if not text:
+        return []
+    text = unicodedata.normalize("NFKD", text)
+    text = "".join(c for c in text if not unicodedata.combining(c)).lower()
+    return _WORD.findall(text)
+
+
+class Catalog:
+    def __init__(self, songs, slug_to_spotify=None):
+        """
+        songs: iterable of dicts with id, spotify_id, title, artists (and any other columns).
+        slug_to_spotify: songmap names, e.g. {"blinding-lights": "0VjIjW4GlUZAMYd2vXMi3b"}.
+        """
+        self.songs = list(songs)
+        self.loaded_at = time.monotonic()
+        slug_to_spotify = slug_to_spotify or {}
+        self._by_id = {}
+        self._by_spotify_id = {}
+        for song in self.songs:
+            if song.get("id") is not None:
+                self._by_id[str(song["id"])] = song
+            if song.get("spotify_id"):
+                self._by_spotify_id[song["spotify_id"]] = song
+        self._spotify_by_slug = dict(slug_to_spotify)
+        self._slug_by_spotify = {spotify_id: slug for slug, spotify_id in slug_to_spotify.items()}
+
+        # Search index: only songs with a database id can be guessed.
+        searchable = sorted(
+            (s for s in self.songs if s.get("id") is not None),
+            key=lambda s: ((s.get("title") or "").lower(), (s.get("artists") or "").lower()),
+        )
+        self._search_songs = searchable
+        self._song_tokens = []
+        postings = {}
+        for index, song in enumerate(searchable):
+            tokens = tuple(dict.fromkeys(tokenize(song.get("title")) + tokenize(song.get("artists"))))
+            self._song_tokens.append(tokens)
+            for token in tokens:
+                postings.setdefault(token, []).append(index)
+        self._tokens = sorted(postings)
+        self._postings = [postings[t] for t in self._tokens]
+        # _cumulative[i] = number of postings in tokens[:i], so any prefix range's size is O(1).
+        self._cumulative = [0]
+        for plist in self._postings:
+            self._cumulative.append(self._cumulative[-1] + len(plist))
+
+    # ----- lookups -----
+
+    def by_id(self, song_id):
+        return self._by_id.get(str(song_id))
+
+    def by_spotify_id(self, spotify_id):
+        return self._by_spotify_id.get(spotify_id)
+
+    def by_slug(self, slug):
+        spotify_id = self._spotify_by_slug.get(slug)
+        return self._by_spotify_id.get(spotify_id) if spotify_id else None
+
+    def spotify_id_for_slug(self, slug):
+        return self._spotify_by_slug.get(slug)
+
+    def slug_for_spotify_id(self, spotify_id):
+        return self._slug_by_spotify.get(spotify_id)
+
+    # ----- search -----
+
+    def _prefix_range(self, prefix):
+        lo = bisect.bisect_left(self._tokens, prefix)
+        hi = bisect.bisect_left(self._tokens, prefix + "\uffff", lo)
+        return lo, hi
+
+    def search(self, query, limit=10):
+        """
+        Songs whose title/artist words start with every word of query, best
+        first: songs matching the pivot word exactly, then by title.
+        """
+        words = list(dict.fromkeys(tokenize(query)))
+        if not words or limit <= 0:
+            return []
+        ranges = [(w, *self._prefix_range(w)) for w in words]
+        counts = [self._cumulative[hi] - self._cumulative[lo] for _, lo, hi in ranges]
+        if min(counts) == 0:
+            return []
+        pivot = counts.index(min(counts))
+        _, lo, hi = ranges[pivot]
+        others = [w for i, w in enumerate(words) if i != pivot]
+
+        results = []
+        seen = set()
+        for token_index in range(lo, hi):
+            for index in self._postings[token_index]:
+                if index in seen:
+                    continue
+                seen.add(index)
+                song_tokens = self._song_tokens[index]
+                if all(any(t.startswith(w) for t in song_tokens) for w in others):
+                    results.append(self._search_songs[index])
+                    if len(results) >= limit:
+                        return results
+        return results
+
+
+def load_catalog():
+    """Build a Catalog from songmap.txt and (when configured) the songs table."""
+    try:
+        _, slug_to_spotify = load_songmap()
+    except OSError as e:
+        print(f"Warning: Could not load songmap.txt: {e}")
+        slug_to_spotify = {}
+    songs = []
+    try:
+        from supabase_helpers import _client
+        client = _client()
+    except Exception:
+        client = None
+    if client is not None:
+        start = 0
+        while True:
+            r = client.table("songs").select("id, spotify_id, title, artists, year") \
+                .order("id").range(start, start + PAGE_SIZE - 1).execute()
+            rows = r.data or []
+            songs.extend(rows)
+            if len(rows) < PAGE_SIZE:
+                break
+            start += PAGE_SIZE
+    known = {s.get("spotify_id") for s in songs}
+    for slug, spotify_id in slug_to_spotify.items():
+        if spotify_id not in known:
+            songs.append({"id": None, "spotify_id": spotify_id, "title": slug.replace("-", " "), "artists": None})
+    return Catalog(songs, slug_to_spotify)
+
+
+_catalog = None
+_catalog_lock = threading.Lock()
+
+
+def _refresh(stale):
+    """Rebuild the catalog in the background; on failure keep serving the stale one. Releases _catalog_lock."""
+    global _catalog
+    try:
+        _catalog = load_catalog()
+    except Exception as e:
+        print(f"Warning: catalog refresh failed, keeping the old one: {e}")
+        stale.loaded_at = time.monotonic()
+    finally:
+        _catalog_lock.release()
+
+
+def get_catalog():
+    """
+    Process-wide catalog, rebuilt when older than REFRESH_SECONDS. The rebuild
+    runs on a background thread, one at a time; callers keep getting the
+    previous catalog until it finishes. Only the very first load blocks.
+    """
+    global _catalog
+    current = _catalog
+    if current is not None and time.monotonic() - current.loaded_at < REFRESH_SECONDS:
+        return current
+    if current is None:
+        with _catalog_lock:
+            if _catalog is None:
+                _catalog = load_catalog()
+            return _catalog
+    if _catalog_lock.acquire(blocking=False):
+        try:
+            threading.Thread(target=_refresh, args=(current,), name="catalog-refresh", daemon=True).start()
+        except Exception:
+            _catalog_lock.release()
+            raise
+    return current
+
+
+if __name__ == "__main__":
+    import json
+    import random
+    import string
+    import sys
+
+    # Search latency on a synthetic catalog: python catalog.py [n_songs]
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    rng = random.Random(0)
+    vocabulary = ["".join(rng.choices(string.ascii_lowercase, k=rng.randint(3, 9))) for _ in range(20000)]
+    fake = [
+        {"id": str(i), "spotify_id": f"sp{i}", "title": " ".join(rng.choices(vocabulary, k=rng.randint(1, 4))),
+         "artists": " ".join(rng.choices(vocabulary, k=rng.randint(1, 2)))}
+        for i in range(n)
+    ]
+    start = time.perf_counter()
+    catalog = Catalog(fake)
+    build_seconds = time.perf_counter() - start
+    queries = []
+    for _ in range(2000):
+        song = rng.choice(fake)
+        words = song["title"].split()
+        queries.append(" ".join(words[:-1] + [words[-1][:rng.randint(1, len(words[-1]))]]))
+    queries += ["a", "e", "s", "th"]
+    timings = []
+    for q in queries:
+        start = time.perf_counter()
+        catalog.search(q, limit=10)
+        timings.append(time.perf_counter() - start)
+    timings.sort()
+    print(json.dumps({
+        "songs": n,
+        "build_seconds": round(build_seconds, 2),
+        "queries": len(queries),
+        "p50_us": round(timings[len(timings) // 2] * 1e6, 1),
+        "p99_us": round(timings[int(len(timings) * 0.99)] * 1e6, 1),
+        "max_us": round(timings[-1] * 1e6, 1),
+    }, indent=2))
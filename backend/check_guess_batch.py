@@ -0,0 +1,184 @@
+"""
+Checks for calculate_similarity_batch and POST /api/guess/batch against the
+loadtest stand-ins (fake Supabase, generated WAVs served over HTTP):
+
+  - each candidate's batch score matches calculate_similarity for the same
+    pair, and embed=False matches metadata_similarity
+  - the embedding runs on float16 analysis audio, the dtype ingest produces
+  - unknown ids get an error entry and more than GUESS_BATCH_MAX ids is a 400
+  - a batch takes one scoring slot per candidate it embeds (up to
+    SCORING_MAX_IN_FLIGHT), is served metadata-only when they don't free up
+    in time, and a batch that only repeats the actual song takes none
+  - an audio server that accepts connections but never answers fails the
+    scoring within AUDIO_FETCH_TIMEOUT and gives its slots back
+
+The real model runs when torch is installed (the first run downloads it).
+Otherwise, or with --stand-in, a deterministic spectral embedding stands in
+for the model, which still covers windowing, batching and score combination.
+
+    python check_guess_batch.py [--stand-in]
+
+Exits 1 on regression so it can run in CI.
+"""
+
+import os
+import random
+import socket
+import sys
+import tempfile
+import threading
+import time
+
+AUDIO_SECONDS = 75  # three guess windows per song: 0 s, 60 s and the last 15 s
+CANDIDATES = 6
+START_SECOND = 10
+TOLERANCE = 1e-3
+
+
+def _stand_in_embedding(processor, model, audio_array):
+    """Log band energies of each window's spectrum, shaped like the model's (batch, hidden) output."""
+    import numpy as np
+    windows = audio_array if isinstance(audio_array, list) else [audio_array]
+    rows = []
+    for window in windows:
+        spectrum = np.abs(np.fft.rfft(np.asarray(window, dtype=np.float32)))
+        rows.append(np.log1p([band.sum() for band in np.array_split(spectrum, 64)]))
+    return np.asarray(rows, dtype=np.float32)
+
+
+def _setup(stand_in):
+    """Seed a fake database, serve generated WAVs and wire app.py to both. Returns (app, ss, tables, dtypes seen)."""
+    os.environ.setdefault("ANALYSIS_AUDIO_DIR", tempfile.mkdtemp(prefix="guess-batch-audio-"))
+    import loadtest
+    _, audio_base = loadtest.start_file_server(AUDIO_SECONDS)
+    os.environ["AWS_FILE_FORM"] = f"{audio_base}/clips/placeholder.wav"
+    tables, _ = loadtest.seed_tables(audio_base, extra_songs=0, users=1, audio_seconds=AUDIO_SECONDS,
+                                     rng=random.Random(0))
+
+    import app
+    import catalog
+    import similarity_score as ss
+    import supabase_helpers
+    from fake_supabase import FakeSupabase
+    client = FakeSupabase(tables)
+    app.supabase_client = client
+    supabase_helpers._supabase = client
+    catalog._catalog = None
+
+    dtypes = set()
+    embed = _stand_in_embedding if stand_in else ss._get_embedding
+    if stand_in:
+        ss._load_model = lambda: (None, None)
+
+    def recording_embedding(processor, model, audio_array):
+        windows = audio_array if isinstance(audio_array, list) else [audio_array]
+        dtypes.update(str(getattr(w, "dtype", "list")) for w in windows)
+        return embed(processor, model, audio_array)
+    ss._get_embedding = recording_embedding
+    return app, ss, tables, dtypes
+
+
+def check(stand_in=False):
+    failures = []
+
+    def expect(label, ok, detail):
+        print(f"  {'ok' if ok else 'FAIL':4} {label}: {detail}")
+        if not ok:
+            failures.append(label)
+
+    if not stand_in:
+        try:
+            import torch  # noqa: F401
+        except ImportError:
+            print("  torch is not installed; using the stand-in embedding")
+            stand_in = True
+    app, ss, tables, dtypes = _setup(stand_in)
+    from admission import QUEUE_TIMEOUT_REASON, AdmissionController
+    import admission
+
+    catalog = ss.get_catalog()
+    songs = [s for s in tables["songs"] if catalog.slug_for_spotify_id(s["spotify_id"])][:CANDIDATES]
+    slugs = [catalog.slug_for_spotify_id(s["spotify_id"]) for s in songs]
+    actual, actual_slug = songs[0], slugs[0]
+
+    # Decode every song once so the comparisons below read the cached float16 analysis audio.
+    for slug in slugs:
+        ss._get_audio_array(slug)
+    dtypes.clear()
+
+    batch = ss.calculate_similarity_batch(actual_slug, slugs, START_SECOND, duration=15)
+    single = [ss.calculate_similarity(actual_slug, slug, START_SECOND, duration=15) for slug in slugs]
+    diff = max(abs(b[0] - s[0]) for b, s in zip(batch, single))
+    expect("batch scores match calculate_similarity", diff <= TOLERANCE, f"max |diff| {diff:.2e} over {len(slugs)} candidates")
+    spread = max(b[0] for b in batch[1:]) - min(b[0] for b in batch[1:])
+    expect("candidates score differently", spread > 0, f"spread {spread:.3f}")
+    expect("embedding ran on float16 analysis audio", "float16" in dtypes, f"input dtypes {sorted(dtypes)}")
+
+    metadata_only = ss.calculate_similarity_batch(actual_slug, slugs, START_SECOND, duration=15, embed=False)
+    reference = [ss.metadata_similarity(actual_slug, slug) for slug in slugs]
+    diff = max(abs(b[0] - r[0]) for b, r in zip(metadata_only, reference))
+    expect("embed=False matches metadata_similarity", diff <= 1e-9, f"max |diff| {diff:.2e}")
+
+    test_client = app.app.test_client()
+
+    def post(ids):
+        return test_client.post("/api/guess/batch", json={
+            "actual_song_id": actual["id"], "guessed_song_ids": ids, "clip_start_time": START_SECOND})
+
+    unknown = "00000000-0000-4000-8000-999999999999"
+    admission._scoring = AdmissionController(max_in_flight=2, max_queue=8, queue_timeout=0.3)
+    response = post([s["id"] for s in songs] + [unknown])
+    body = response.get_json()
+    results = body.get("results", [])
+    expect("batch endpoint answers", response.status_code == 200 and not body["degraded"],
+           f"status {response.status_code}, degraded {body.get('degraded')}")
+    expect("unknown id gets an error entry", results and results[-1].get("error") == "Song not found",
+           f"last entry {results[-1] if results else None}")
+    expected = [int(b[0] * 100) for b in batch]
+    got = [r.get("similarity_score") for r in results[:-1]]
+    expect("endpoint scores match the library", got == expected, f"{got} vs {expected}")
+    stats = admission._scoring.stats()
+    expect("a batch is charged a slot per embedded candidate", stats["peak_in_flight"] == 2,
+           f"peak_in_flight {stats['peak_in_flight']} of {stats['max_in_flight']}")
+
+    controller = admission._scoring
+    held = controller.acquire()  # a single /api/guess in flight
+    release = threading.Timer(1.0, controller.release)
+    release.start()
+    body = post([s["id"] for s in songs[1:3]]).get_json()
+    release.join()
+    expect("batch degrades while its slots are busy",
+           held is None and body.get("degraded_reason") == QUEUE_TIMEOUT_REASON
+           and all(r.get("degraded") for r in body["results"]),
+           f"degraded_reason {body.get('degraded_reason')}")
+
+    admitted = controller.stats()["admitted"]
+    body = post([actual["id"]]).get_json()
+    expect("a batch of only the actual song takes no slot",
+           controller.stats()["admitted"] == admitted and body["results"][0]["similarity_score"] == 100,
+           f"admitted {admitted} -> {controller.stats()['admitted']}")
+
+    too_many = post([actual["id"]] * (app.GUESS_BATCH_MAX + 1)).status_code
+    expect(f"more than GUESS_BATCH_MAX ({app.GUESS_BATCH_MAX}) ids is a 400", too_many == 400, f"status {too_many}")
+
+    # Songs not fetched yet, from a server that never answers.
+    stalled = socket.create_server(("127.0.0.1", 0))
+    os.environ["AWS_FILE_FORM"] = f"http://127.0.0.1:{stalled.getsockname()[1]}/clips/placeholder.wav"
+    ss.AUDIO_FETCH_TIMEOUT = (0.5, 0.5)
+    fresh = [s for s in tables["songs"] if catalog.slug_for_spotify_id(s["spotify_id"])][CANDIDATES:CANDIDATES + 2]
+    start = time.perf_counter()
+    body = test_client.post("/api/guess/batch", json={
+        "actual_song_id": fresh[0]["id"], "guessed_song_ids": [fresh[1]["id"]], "clip_start_time": START_SECOND}).get_json()
+    elapsed = time.perf_counter() - start
+    stalled.close()
+    expect("a stalled audio fetch fails the scoring and frees its slots",
+           elapsed < 5 and controller.stats()["in_flight"] == 0
+           and body["results"][0]["message"] == "Unable to calculate detailed similarity.",
+           f"{elapsed:.1f} s, in_flight {controller.stats()['in_flight']}, message {body['results'][0].get('message')!r}")
+    return failures
+
+
+if __name__ == "__main__":
+    failed = check(stand_in="--stand-in" in sys.argv[1:])
+    print("FAILED: " + ", ".join(failed) if failed else "OK")
+    sys.exit(1 if failed else 0)
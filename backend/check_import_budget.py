@@ -0,0 +1,61 @@
+"""
+Cold-start check for the web tier: imports app.py in a fresh interpreter and
+fails if that takes longer than the budget or pulls in the ML stack, which
+must only load on first scoring (see similarity_score.preload). The import
+is timed RUNS times and the fastest counts, so a busy CI box does not flake.
+
+    python check_import_budget.py [budget_seconds]
+
+Exits 1 on regression so it can run in CI.
+"""
+
+import json
+import os
+import subprocess
+import sys
+
+# app imports in about 0.15 s; importing transformers alone adds over a second.
+DEFAULT_BUDGET_SECONDS = 0.3
+RUNS = 3
+HEAVY_MODULES = ["torch", "transformers", "librosa", "sklearn", "numba", "scipy"]
+
+_PROBE = f"""
+import json, sys, time
+start = time.perf_counter()
+import app
+elapsed = time.perf_counter() - start
+heavy = [m for m in {HEAVY_MODULES!r} if m in sys.modules]
+print(json.dumps({{"seconds": elapsed, "heavy_modules": heavy, "modules": len(sys.modules)}}))
+"""
+
+
+def _measure_once(env):
+    out = subprocess.run(
+        [sys.executable, "-c", _PROBE],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def measure(runs=RUNS):
+    env = {**os.environ, "SCORING_PRELOAD": "0"}
+    results = [_measure_once(env) for _ in range(runs)]
+    return min(results, key=lambda r: r["seconds"])
+
+
+if __name__ == "__main__":
+    budget = float(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_BUDGET_SECONDS
+    result = measure()
+    result["budget_seconds"] = budget
+    print(json.dumps(result, indent=2))
+    if result["heavy_modules"]:
+        print(f"FAIL: importing app loaded {result['heavy_modules']}", file=sys.stderr)
+        sys.exit(1)
+    if result["seconds"] > budget:
+        print(f"FAIL: importing app took {result['seconds']:.2f}s (budget {budget}s)", file=sys.stderr)
+        sys.exit(1)
+    print("OK")
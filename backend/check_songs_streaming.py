@@ -0,0 +1,128 @@
+"""
+Checks for GET /api/songs against a temporary SQLite database (sqlite_store):
+
+  - streaming the whole catalog (JSON array and NDJSON) allocates about the
+    same at SMALL and LARGE catalog sizes, i.e. memory stays flat instead of
+    growing with the table
+  - keyset pages chain without gaps or repeats
+  - a malformed or injected cursor is a 400, a failing query a 500
+
+    python check_songs_streaming.py
+
+Exits 1 on regression so it can run in CI.
+"""
+
+import base64
+import json
+import os
+import sys
+import tempfile
+import tracemalloc
+from datetime import datetime, timedelta, timezone
+
+SMALL = 2000
+LARGE = 20000
+# Peak allocation while streaming LARGE may be at most this multiple of SMALL's.
+MAX_GROWTH = 1.5
+
+
+def _seed(client, n):
+    now = datetime.now(timezone.utc)
+    rows = [{
+        "id": f"00000000-0000-4000-8000-{i:012d}",
+        "spotify_id": f"sp{i:08d}",
+        "title": f"Song {i}",
+        "artists": f"Artist {i % 97}",
+        "created_at": (now - timedelta(seconds=i)).isoformat(),
+        "url_original": f"https://example.invalid/songs/sp{i:08d}/original.wav",
+    } for i in range(n)]
+    for start in range(0, n, 1000):
+        client.table("songs").insert(rows[start:start + 1000]).execute()
+
+
+def _install(app, client):
+    import catalog
+    import supabase_helpers
+    app.supabase_client = client
+    supabase_helpers._supabase = client
+    catalog._catalog = None
+
+
+def stream_peak(app, n, fmt):
+    """(peak bytes allocated while streaming, body bytes) for a catalog of n songs."""
+    from sqlite_store import SQLiteClient
+    client = SQLiteClient(os.path.join(tempfile.mkdtemp(prefix="songs-stream-"), "wics.db"))
+    _seed(client, n)
+    _install(app, client)
+    query = "?format=ndjson" if fmt == "ndjson" else ""
+    test_client = app.app.test_client()
+    tracemalloc.start()
+    response = test_client.get(f"/api/songs{query}", buffered=False)
+    body = 0
+    for chunk in response.response:
+        body += len(chunk)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    response.close()
+    return peak, body
+
+
+def check():
+    import app
+    from sqlite_store import SQLiteClient
+    failures = []
+
+    def expect(label, ok, detail):
+        print(f"  {'ok' if ok else 'FAIL':4} {label}: {detail}")
+        if not ok:
+            failures.append(label)
+
+    for fmt in ("json", "ndjson"):
+        small_peak, small_body = stream_peak(app, SMALL, fmt)
+        large_peak, large_body = stream_peak(app, LARGE, fmt)
+        expect(f"{fmt}: memory flat from {SMALL} to {LARGE} songs", large_peak <= small_peak * MAX_GROWTH,
+               f"peak {small_peak / 1024:.0f} KiB -> {large_peak / 1024:.0f} KiB for a "
+               f"{small_body / 1024:.0f} KiB -> {large_body / 1024:.0f} KiB body")
+
+    client = SQLiteClient(os.path.join(tempfile.mkdtemp(prefix="songs-pages-"), "wics.db"))
+    _seed(client, 250)
+    _install(app, client)
+    test_client = app.app.test_client()
+    seen, cursor = [], None
+    while True:
+        page = test_client.get("/api/songs", query_string={"limit": 100, **({"cursor": cursor} if cursor else {})}).get_json()
+        seen.extend(song["id"] for song in page["songs"])
+        cursor = page["next_cursor"]
+        if not cursor:
+            break
+    expect("keyset pages cover every song once", len(seen) == len(set(seen)) == 250, f"{len(seen)} ids, {len(set(seen))} distinct")
+
+    def cursor_of(created_at, song_id):
+        return base64.urlsafe_b64encode(json.dumps([created_at, song_id]).encode()).decode().rstrip("=")
+
+    for label, cursor in (
+        ("injected filter in created_at", cursor_of('2024-01-01",id.gt.0', "00000000-0000-4000-8000-000000000001")),
+        ("injected filter in id", cursor_of("2024-01-01T00:00:00+00:00", "1),or(id.gt.0")),
+        ("not base64 json", "%%%"),
+    ):
+        status = test_client.get("/api/songs", query_string={"limit": 10, "cursor": cursor}).status_code
+        expect(f"cursor rejected: {label}", status == 400, f"status {status}")
+
+    class Failing:
+        def table(self, name):
+            raise RuntimeError("database unavailable")
+
+    app.supabase_client = Failing()
+    for query in ("", "?format=ndjson"):
+        try:
+            status = test_client.get(f"/api/songs{query}").status_code
+        except Exception as e:
+            status = f"200 then {type(e).__name__} mid-stream"
+        expect(f"failing query is a 500 (/api/songs{query})", status == 500, f"status {status}")
+    return failures
+
+
+if __name__ == "__main__":
+    failed = check()
+    print("FAILED: " + ", ".join(failed) if failed else "OK")
+    sys.exit(1 if failed else 0)
@@ -1,12 +1,22 @@
 import yt_dlp
 from pydub import AudioSegment
 import os
+import re
+import hashlib
 
-def download_song_as_wav(song_name):
+def song_work_dir(song_name, root='downloads'):
+    """Deterministic per-song directory, so concurrent downloads never share files."""
+    slug = re.sub(r"[^a-z0-9-]", "", song_name.lower().replace(" ", "-")) or "song"
+    digest = hashlib.sha1(song_name.encode()).hexdigest()[:8]
+    return os.path.join(root, f"{slug}-{digest}")
+
+
+def download_song_as_wav(song_name, out_dir='downloads'):
+    """Download a song as a 48 kHz mono WAV into out_dir. Returns the WAV path, or None on failure."""
 
     ydl_opts = {
         'format': 'bestaudio/best',
-        'outtmpl': 'downloads/%(title)s',
+        'outtmpl': os.path.join(out_dir, '%(title)s'),
         'postprocessors': [{
             'key': 'FFmpegExtractAudio',
             'preferredcodec': 'wav',
@@ -17,7 +27,7 @@ def download_song_as_wav(song_name):
             '-ac', '1'
         ],
     }
-    os.makedirs('downloads', exist_ok=True)
+    os.makedirs(out_dir, exist_ok=True)
 
     search_query = f"ytsearch1:{song_name} audio"
     
@@ -27,18 +37,54 @@ def download_song_as_wav(song_name):
             info = ydl.extract_info(search_query, download=True)
             
             if 'entries' in info:
-                video = info['entries'][0]
-                print(f"Downloaded {video['title']}")
-                print(f"Saved {video['title']}.wav")
-            else:
-                print(f"Downloaded {info['title']}")
-                print(f"Saved {info['title']}.wav")
+                info = info['entries'][0]
+            print(f"Downloaded {info['title']}")
+            path = ydl.prepare_filename(info) + '.wav'
+            if not os.path.exists(path):
+                # out_dir holds only this song, so any WAV in it is the one we just made.
+                wavs = [os.path.join(out_dir, f) for f in os.listdir(out_dir) if f.lower().endswith('.wav')]
+                path = wavs[0] if wavs else None
+            print(f"Saved {path}")
+            return path
                 
     except Exception as e:
         print(f"Error downloading song: {e}")
+    return None
 
 
-def download_and_upload_to_s3(song_name, bucket, object_name=None):
+def download_audio(song_name, out_dir):
+    """
+    Download the best audio stream for a search query into out_dir without
+    transcoding. Returns the path of the downloaded file, or None on failure.
+    """
+    ydl_opts = {
+        'format': 'bestaudio/best',
+        'outtmpl': os.path.join(out_dir, 'source.%(ext)s'),
+        'quiet': True,
+        'noprogress': True,
+    }
+    os.makedirs(out_dir, exist_ok=True)
+    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+        info = ydl.extract_info(f"ytsearch1:{song_name} audio", download=True)
+        if 'entries' in info:
+            if not info['entries']:
+                return None
+            info = info['entries'][0]
+        path = ydl.prepare_filename(info)
+    return path if os.path.exists(path) else None
+
+
+def transcode_to_wav(src, dst, sample_rate=48000):
+    """Convert any audio file ffmpeg can read to a mono WAV at sample_rate (same format download_song_as_wav produces)."""
+    import subprocess
+    subprocess.run(
+        ['ffmpeg', '-y', '-loglevel', 'error', '-i', src, '-ar', str(sample_rate), '-ac', '1', dst],
+        check=True,
+    )
+    return dst
+
+
+def download_and_upload_to_s3(song_name, bucket, object_name=None, work_dir=None):
     """
     Pipeline: download the song as WAV (via download_song_as_wav), then upload
     the resulting file to the given S3 bucket.
@@ -51,30 +97,31 @@ def download_and_upload_to_s3(song_name, bucket, object_name=None):
         S3 bucket name to upload to.
     object_name : str, optional
         S3 object key. If None, uses the downloaded filename (e.g. "Title.wav").
+    work_dir : str, optional
+        Directory to download into. Defaults to a per-song directory under
+        downloads/ (see song_work_dir), so parallel runs don't pick up each
+        other's files. The upload is skipped if S3 already has the same content.
 
     Returns
     -------
     str | None
         URL https://{bucket}.s3.us-east-2.amazonaws.com/{object_name} on success, None otherwise.
     """
-    import glob
     import aws
 
-    download_song_as_wav(song_name)
-
-    downloads_dir = "downloads"
-    wavs = glob.glob(os.path.join(downloads_dir, "*.wav"))
-    if not wavs:
-        print("No WAV file found in downloads/ after download.")
+    if work_dir is None:
+        work_dir = song_work_dir(song_name)
+    wav_path = download_song_as_wav(song_name, work_dir)
+    if wav_path is None:
+        print(f"No WAV file found in {work_dir} after download.")
         return None
 
-    latest_wav = max(wavs, key=os.path.getmtime)
     if object_name is None:
-        object_name = os.path.basename(latest_wav)
+        object_name = os.path.basename(wav_path)
     elif not object_name.lower().endswith(".wav"):
         object_name = object_name.rstrip("/") + ".wav"
 
-    if not aws.upload_file(latest_wav, bucket, object_name):
+    if not aws.upload_file(wav_path, bucket, object_name, skip_unchanged=True):
         return None
     url = f"https://{bucket}.s3.us-east-2.amazonaws.com/{object_name}"
     print(f"Uploaded to {url}")
@@ -0,0 +1,424 @@
+"""
+Server-side ELO scoring with write-behind persistence.
+
+Guess outcomes are turned into ELO deltas here and applied to an in-memory
+rating table right away. Each game event (user, songs, score, delta) is appended
+to a local journal and buffered; a background thread flushes the buffer to
+Supabase in a single `record_game_events` RPC call whenever FLUSH_MAX_EVENTS
+events are pending or FLUSH_INTERVAL seconds have passed. The RPC inserts the
+events and applies their deltas atomically, skipping event ids it has already
+seen, so replaying the journal after a crash never double-counts a game.
+
+Each process journals to its own file (elo_journal.<pid>.jsonl next to
+ELO_JOURNAL_PATH) and holds a lock on it while running. At start-up a process
+also adopts the journals of processes that are no longer running, so several
+workers can share one directory without erasing each other's events.
+
+A batch the database refuses outright (an unknown user, a malformed id) is
+split until the offending events are found; those are appended to
+elo_journal.rejected.jsonl instead of being retried forever. Any other flush
+failure is treated as transient and the whole batch is retried.
+
+Environment:
+    ELO_FLUSH_MAX_EVENTS   flush when this many events are pending (default 200)
+    ELO_FLUSH_INTERVAL     flush at least this often, in seconds (default 5)
+    ELO_JOURNAL_PATH       journal base name (default backend/elo_journal.jsonl)
+"""
+
+import atexit
+import glob
+import json
+import os
+import sqlite3
+import threading
+import uuid
+from datetime import datetime, timezone
+
+# Same scoring rules the frontend used to apply client-side.
+POINTS_PER_NON_VOCAL_STEM = 10
+POINTS_FOR_VOCALS = 50
+DEFAULT_ELO = 1200
+
+FLUSH_MAX_EVENTS = int(os.environ.get("ELO_FLUSH_MAX_EVENTS", 200))
+FLUSH_INTERVAL = float(os.environ.get("ELO_FLUSH_INTERVAL", 5))
+JOURNAL_PATH = os.environ.get("ELO_JOURNAL_PATH") or os.path.join(os.path.dirname(__file__), "elo_journal.jsonl")
+
+
+def _valid_uuid(value):
+    try:
+        uuid.UUID(str(value))
+        return True
+    except ValueError:
+        return False
+
+
+def _is_rejected(exc):
+    """
+    True when the database refused the events themselves rather than failing to
+    run: Postgres data and integrity errors (SQLSTATE classes 22 and 23, e.g. a
+    bad uuid or a foreign key violation) or SQLite's IntegrityError.
+    """
+    if isinstance(exc, sqlite3.IntegrityError):
+        return True
+    return str(getattr(exc, "code", "") or "").startswith(("22", "23"))
+
+
+def _try_lock(f):
+    """Take a non-blocking exclusive lock on an open file. False if another process holds it."""
+    try:
+        import fcntl
+    except ImportError:
+        import msvcrt
+        try:
+            msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+            return True
+        except OSError:
+            return False
+    try:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return True
+    except OSError:
+        return False
+
+
+def _read_journal(path):
+    """Events in a journal file, skipping a torn last line left by a crash mid-write."""
+    events = []
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                events.append(json.loads(line))
+            except ValueError:
+                print(f"[ELO] skipping unreadable journal line: {line[:80]!r}")
+    return events
+
+
+def compute_elo_delta(similarity_score, stems_unmuted=None):
+    """
+    ELO change for one guess: the similarity score (0-100) minus a penalty for
+    every stem the player unmuted. stems_unmuted is a list of stem labels
+    (e.g. ["Drums", "Vocals"]) or a dict keyed by label.
+    """
+    stems = {str(s).lower() for s in (stems_unmuted or [])}
+    vocals = 1 if "vocals" in stems else 0
+    non_vocal = len(stems) - vocals
+    return int(similarity_score) - non_vocal * POINTS_PER_NON_VOCAL_STEM - vocals * POINTS_FOR_VOCALS
+
+
+class WriteBehindBuffer:
+    """
+    Buffers events in memory and hands them to flush_fn in batches.
+
+    Every event is written to this process's journal before it is accepted,
+    and the journal is rewritten to hold only unflushed events after each
+    successful flush. On start-up, events left in this process's journal or in
+    the journal of any process that is no longer running are loaded back into
+    the buffer and flushed with the next batch.
+    """
+
+    def __init__(self, flush_fn, journal_path=JOURNAL_PATH, max_events=FLUSH_MAX_EVENTS, interval=FLUSH_INTERVAL,
+                 rejects=_is_rejected):
+        self._flush_fn = flush_fn
+        self._rejects = rejects
+        base, ext = os.path.splitext(journal_path)
+        self._journal_glob = f"{glob.escape(base)}.*{ext}"
+        self._legacy_path = journal_path
+        self._journal_path = f"{base}.{os.getpid()}{ext}"
+        self._rejected_path = f"{base}.rejected{ext}"
+        self._max_events = max_events
+        self._interval = interval
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._closed = False
+        self._lock_file = open(self._journal_path + ".lock", "a")
+        if not _try_lock(self._lock_file):
+            raise RuntimeError(f"{self._journal_path} is locked by another process")
+        self._pending, adopted = self._recover()
+        self._journal = open(self._journal_path, "a")
+        if adopted:
+            # Adopted events now live in our journal; only then drop the orphans.
+            with self._lock:
+                self._rewrite_journal()
+            for path, lock_file in adopted:
+                os.remove(path)
+                lock_file.close()
+                self._remove_quietly(path + ".lock")
+        self._thread = threading.Thread(target=self._run, name="elo-write-behind", daemon=True)
+        self._thread.start()
+
+    @staticmethod
+    def _remove_quietly(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def _recover(self):
+        """
+        Load events left by a previous run of this process and by dead processes.
+        Returns (events, [(orphan journal path, its held lock file)]).
+        """
+        events = _read_journal(self._journal_path) if os.path.exists(self._journal_path) else []
+        adopted = []
+        candidates = glob.glob(self._journal_glob) + [self._legacy_path]
+        for path in candidates:
+            if path in (self._journal_path, self._rejected_path) or not os.path.exists(path):
+                continue
+            lock_file = open(path + ".lock", "a")
+            if not _try_lock(lock_file):
+                lock_file.close()  # its process is still running
+                continue
+            try:
+                orphan = _read_journal(path)
+            except FileNotFoundError:
+                lock_file.close()  # adopted by another process in the meantime
+                continue
+            print(f"[ELO] adopting {len(orphan)} unflushed events from {path}")
+            events.extend(orphan)
+            adopted.append((path, lock_file))
+        if events:
+            print(f"[ELO] recovered {len(events)} unflushed events into {self._journal_path}")
+        return events, adopted
+
+    def append(self, event):
+        line = json.dumps(event)
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("write-behind buffer is closed")
+            self._journal.write(line + "\n")
+            self._journal.flush()
+            self._pending.append(event)
+            full = len(self._pending) >= self._max_events
+        if full:
+            self._wake.set()
+
+    def pending_count(self):
+        with self._lock:
+            return len(self._pending)
+
+    def flush(self):
+        """Send all pending events to flush_fn. Returns the number flushed (0 on failure)."""
+        with self._flush_lock:
+            with self._lock:
+                batch = self._pending
+                self._pending = []
+            if not batch:
+                return 0
+            try:
+                rejected = self._flush_batch(batch)
+            except Exception as e:
+                print(f"[ELO] flush of {len(batch)} events failed, will retry: {e}")
+                with self._lock:
+                    self._pending = batch + self._pending
+                return 0
+            if rejected:
+                self._dead_letter(rejected)
+            with self._lock:
+                self._rewrite_journal()
+            return len(batch) - len(rejected)
+
+    def _flush_batch(self, batch):
+        """
+        Flush batch, splitting it in halves while the database rejects it to find
+        the events it refuses. Returns those events; re-raises transient errors
+        (halves already sent are safe to resend, the RPC skips known ids).
+        """
+        try:
+            self._flush_fn(batch)
+            return []
+        except Exception as e:
+            if not self._rejects(e):
+                raise
+            if len(batch) == 1:
+                print(f"[ELO] event {batch[0].get('id')} rejected: {e}")
+                return batch
+        mid = len(batch) // 2
+        return self._flush_batch(batch[:mid]) + self._flush_batch(batch[mid:])
+
+    def _dead_letter(self, events):
+        """Set rejected events aside so they stop blocking the events behind them."""
+        with open(self._rejected_path, "a") as f:
+            for event in events:
+                f.write(json.dumps(event) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        print(f"[ELO] moved {len(events)} rejected events to {self._rejected_path}")
+
+    def _rewrite_journal(self):
+        """Replace the journal with the events still pending. Caller holds self._lock."""
+        tmp_path = self._journal_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            for event in self._pending:
+                f.write(json.dumps(event) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self._journal.close()
+        os.replace(tmp_path, self._journal_path)
+        self._journal = open(self._journal_path, "a")
+
+    def _run(self):
+        while not self._closed:
+            self._wake.wait(self._interval)
+            self._wake.clear()
+            if self._closed:
+                break
+            self.flush()
+
+    def close(self):
+        """Stop the flush thread, flush what is left and fsync the journal."""
+        if self._closed:
+            return
+        self._closed = True
+        self._wake.set()
+        self._thread.join(timeout=self._interval + 1)
+        self.flush()
+        with self._lock:
+            self._journal.flush()
+            os.fsync(self._journal.fileno())
+            self._journal.close()
+            empty = not self._pending
+        if empty:
+            self._remove_quietly(self._journal_path)
+        self._lock_file.close()
+        if empty:
+            self._remove_quietly(self._journal_path + ".lock")
+
+
+class EloLedger:
+    """
+    In-memory ELO ratings backed by a WriteBehindBuffer of game events.
+
+    Ratings are loaded from the database at most once per user per process
+    (or seeded from the login response) and then updated in memory. The
+    database stays authoritative because guesses persist deltas, not absolute
+    values, and manual adjustments persist a set-to value the database applies
+    in order, so several workers can share the same users safely.
+    """
+
+    def __init__(self, buffer, load_rating):
+        self._buffer = buffer
+        self._load_rating = load_rating
+        self._ratings = {}
+        self._lock = threading.Lock()
+
+    def seed(self, user_id, rating):
+        """Remember a rating read elsewhere (e.g. at login) unless we already track this user."""
+        if user_id is None or rating is None:
+            return
+        with self._lock:
+            self._ratings.setdefault(str(user_id), rating)
+
+    def current_rating(self, user_id, default=None):
+        with self._lock:
+            return self._ratings.get(str(user_id), default)
+
+    def _known_user(self, user_id):
+        """
+        True if user_id is a user we can rate, loading their rating on first
+        sight. Malformed ids, unknown users and failed lookups are False, so
+        the guess is recorded anonymously instead of poisoning a flush.
+        """
+        if not user_id or not _valid_uuid(user_id):
+            return False
+        user_id = str(user_id)
+        if self.current_rating(user_id) is not None:
+            return True
+        try:
+            loaded = self._load_rating(user_id)
+        except Exception as e:
+            print(f"[ELO] could not load rating for {user_id}, skipping ELO: {e}")
+            return False
+        if loaded is None:
+            return False
+        self.seed(user_id, loaded)
+        return True
+
+    def _apply(self, user_id, delta):
+        """Add delta to a tracked rating. Call with self._lock held."""
+        user_id = str(user_id)
+        self._ratings[user_id] += delta
+        return self._ratings[user_id]
+
+    def record_guess(self, *, user_id, actual_song_id, guessed_song_id, similarity_score, is_correct, stems_unmuted=None,
+                     rated=True):
+        """
+        Record one guess. If user_id names a known user and the guess is rated,
+        its ELO delta is applied in memory. Returns (elo_delta, new_rating); both
+        are None for anonymous and unrated guesses. Unrated guesses (a score that
+        could not be computed properly) are still recorded, with a zero delta.
+        """
+        if not self._known_user(user_id):
+            user_id = None
+        delta = compute_elo_delta(similarity_score, stems_unmuted) if user_id and rated else 0
+        event = {
+            "id": str(uuid.uuid4()),
+            "user_id": str(user_id) if user_id else None,
+            "actual_song_id": actual_song_id if _valid_uuid(actual_song_id) else None,
+            "guessed_song_id": guessed_song_id if _valid_uuid(guessed_song_id) else None,
+            "similarity_score": int(similarity_score),
+            "is_correct": bool(is_correct),
+            "stems_unmuted": sorted(str(s) for s in (stems_unmuted or [])),
+            "elo_delta": delta,
+            "created_at": datetime.now(timezone.utc).isoformat(),
+        }
+        if not (user_id and rated):
+            self._buffer.append(event)
+            return None, None
+        # Applied and queued under one lock, so the journal orders events as they were applied.
+        with self._lock:
+            rating = self._apply(user_id, delta)
+            self._buffer.append(event)
+        return delta, rating
+
+    def set_rating(self, user_id, new_rating):
+        """
+        Move a user to an absolute rating, persisted as a set-to event (elo_set)
+        that the database applies as is, so a rating cached here that is stale
+        against other workers can't skew it. elo_delta records the change as
+        this process saw it.
+        """
+        if not self._known_user(user_id):
+            return None
+        user_id = str(user_id)
+        rating = int(new_rating)
+        with self._lock:
+            delta = rating - self._ratings[user_id]
+            self._ratings[user_id] = rating
+            self._buffer.append({
+                "id": str(uuid.uuid4()),
+                "user_id": user_id,
+                "actual_song_id": None,
+                "guessed_song_id": None,
+                "similarity_score": None,
+                "is_correct": None,
+                "stems_unmuted": [],
+                "elo_delta": delta,
+                "elo_set": rating,
+                "created_at": datetime.now(timezone.utc).isoformat(),
+            })
+        return rating
+
+    def flush(self):
+        return self._buffer.flush()
+
+    def close(self):
+        self._buffer.close()
+
+
+_ledger = None
+_ledger_lock = threading.Lock()
+
+
+def get_ledger():
+    """Process-wide ledger persisting through supabase_helpers; flushed durably at exit."""
+    global _ledger
+    with _ledger_lock:
+        if _ledger is None:
+            from supabase_helpers import get_elo_rating, record_game_events
+            _ledger = EloLedger(WriteBehindBuffer(record_game_events), get_elo_rating)
+            atexit.register(_ledger.close)
+        return _ledger
@@ -0,0 +1,189 @@
+"""
+In-process stand-in for the parts of the supabase-py client the backend uses:
+
+    client.table(name).select(cols).eq(...).in_(...).gt(...).or_(...)
+          .order(col, desc=...).limit(n).range(a, b).execute()
+    client.table(name).insert(row) / .update(values).eq(...) / .upsert(row, on_conflict=...)
+    client.rpc("record_game_events", {"events": [...]}).execute()
+
+Rows live in plain lists guarded by a lock. Meant for load tests and offline
+runs, not for checking PostgREST edge cases.
+"""
+
+import re
+import threading
+import uuid
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+
+class FakeSupabase:
+    def __init__(self, tables=None):
+        self.tables = {name: list(rows) for name, rows in (tables or {}).items()}
+        self.lock = threading.Lock()
+        self.calls = 0
+
+    def table(self, name):
+        self.tables.setdefault(name, [])
+        return _Query(self, name)
+
+    def rpc(self, name, params):
+        if name != "record_game_events":
+            raise ValueError(f"fake supabase has no function {name!r}")
+        return _Result(lambda: self._record_game_events(params.get("events") or []))
+
+    def _record_game_events(self, events):
+        """Like migration 005's function: skip known ids, apply elo_set or elo_delta per event, in order."""
+        with self.lock:
+            self.calls += 1
+            seen = {e["id"] for e in self.tables.setdefault("game_events", [])}
+            users = {str(u["id"]): u for u in self.tables.get("users", [])}
+            updated = 0
+            for event in events:
+                if event["id"] in seen:
+                    continue
+                self.tables["game_events"].append(dict(event))
+                seen.add(event["id"])
+                user = users.get(str(event.get("user_id")))
+                if user is None:
+                    continue
+                if event.get("elo_set") is not None:
+                    user["elo_rating"] = event["elo_set"]
+                elif event.get("elo_delta"):
+                    user["elo_rating"] += event["elo_delta"]
+                else:
+                    continue
+                updated += 1
+            return updated
+
+
+class _Result:
+    def __init__(self, fn):
+        self._fn = fn
+
+    def execute(self):
+        return SimpleNamespace(data=self._fn())
+
+
+def _compare(value, op, target):
+    if value is None:
+        return False
+    value, target = str(value), str(target)
+    return {"eq": value == target, "lt": value < target, "gt": value > target}[op]
+
+
+def _parse_or(expression):
+    """
+    Parse the keyset filter app.py builds:
+    a.lt."x",and(a.eq."x",b.lt.y)  ->  predicate over a row.
+    """
+    m = re.fullmatch(r'(\w+)\.lt\."?([^",]+)"?,and\((\w+)\.eq\."?([^",]+)"?,(\w+)\.lt\."?([^",)]+)"?\)', expression)
+    if not m:
+        raise ValueError(f"fake supabase can't parse or filter {expression!r}")
+    col_a, val_a, _, _, col_b, val_b = m.groups()
+    return lambda row: _compare(row.get(col_a), "lt", val_a) or (
+        _compare(row.get(col_a), "eq", val_a) and _compare(row.get(col_b), "lt", val_b))
+
+
+class _Query:
+    def __init__(self, client, name):
+        self._client = client
+        self._name = name
+        self._columns = None
+        self._filters = []
+        self._orders = []
+        self._limit = None
+        self._offset = 0
+        self._action = "select"
+        self._payload = None
+        self._on_conflict = None
+
+    # ----- builders -----
+
+    def select(self, columns="*"):
+        if columns.strip() != "*":
+            self._columns = [c.strip() for c in columns.split(",")]
+        return self
+
+    def eq(self, column, value):
+        self._filters.append(lambda row: _compare(row.get(column), "eq", value))
+        return self
+
+    def gt(self, column, value):
+        self._filters.append(lambda row: _compare(row.get(column), "gt", value))
+        return self
+
+    def in_(self, column, values):
+        wanted = {str(v) for v in values}
+        self._filters.append(lambda row: str(row.get(column)) in wanted)
+        return self
+
+    def or_(self, expression):
+        self._filters.append(_parse_or(expression))
+        return self
+
+    def order(self, column, desc=False):
+        self._orders.append((column, desc))
+        return self
+
+    def limit(self, n):
+        self._limit = n
+        return self
+
+    def range(self, start, end):
+        self._offset = start
+        self._limit = end - start + 1
+        return self
+
+    def insert(self, row):
+        self._action, self._payload = "insert", row
+        return self
+
+    def update(self, values):
+        self._action, self._payload = "update", values
+        return self
+
+    def upsert(self, row, on_conflict=None):
+        self._action, self._payload, self._on_conflict = "upsert", row, on_conflict
+        return self
+
+    # ----- execution -----
+
+    def _project(self, row):
+        if self._columns is None:
+            return dict(row)
+        return {c: row.get(c) for c in self._columns}
+
+    def _matches(self, row):
+        return all(f(row) for f in self._filters)
+
+    def execute(self):
+        client = self._client
+        with client.lock:
+            client.calls += 1
+            rows = client.tables[self._name]
+            if self._action == "select":
+                found = [r for r in rows if self._matches(r)]
+                for column, desc in reversed(self._orders):
+                    found.sort(key=lambda r: (r.get(column) is None, str(r.get(column))), reverse=desc)
+                end = None if self._limit is None else self._offset + self._limit
+                data = [self._project(r) for r in found[self._offset:end]]
+            elif self._action == "insert":
+                row = {"id": str(uuid.uuid4()), "created_at": datetime.now(timezone.utc).isoformat(), **self._payload}
+                rows.append(row)
+                data = [dict(row)]
+            elif self._action == "update":
+                data = []
+                for row in rows:
+                    if self._matches(row):
+                        row.update(self._payload)
+                        data.append(dict(row))
+            else:
+                key = self._on_conflict or "id"
+                existing = next((r for r in rows if r.get(key) == self._payload.get(key)), None)
+                if existing is None:
+                    existing = {"id": str(uuid.uuid4()), "created_at": datetime.now(timezone.utc).isoformat()}
+                    rows.append(existing)
+                existing.update(self._payload)
+                data = [dict(existing)]
+        return SimpleNamespace(data=data)
@@ -0,0 +1,181 @@
+"""
+Local manifest of what catalog ingest has already done for each spotify_id:
+the downloaded WAV and its SHA-256, the S3 object it was uploaded to, and the
+songs row it was inserted as. ingest_pipeline.py consults it so a re-run only
+does the missing steps.
+
+The manifest is a small SQLite database in WAL mode, so several ingest
+workers (threads or separate processes) can share it. Before working on a
+song a worker claims it with a short lease that it keeps renewing (renew())
+while the run lasts; other workers skip songs with a live claim. A claim left
+by a crashed worker expires LEASE_SECONDS later, or can be taken over at once
+with claim(..., reclaim=True) (ingest_pipeline.py --reclaim).
+
+    INGEST_LEASE_SECONDS   claim lease, renewed every third of it (default 120)
+    INGEST_WORKER_ID       worker name recorded on claims (default <pid>-<random>);
+                           a rerun with the same id takes back its own claims
+"""
+
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+LEASE_SECONDS = float(os.environ.get("INGEST_LEASE_SECONDS", 120))
+
+_SCHEMA = """
+create table if not exists manifest (
+  spotify_id text primary key,
+  wav_path text,
+  wav_sha256 text,
+  wav_size integer,
+  wav_mtime real,
+  duration real,
+  object_name text,
+  url_original text,
+  uploaded_sha256 text,
+  song_id text,
+  inserted_url text,
+  claimed_by text,
+  claimed_until real,
+  updated_at real
+)
+"""
+
+
+def sha256_file(path, chunk_size=1024 * 1024):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class Manifest:
+    def __init__(self, path, worker_id=None):
+        self.path = path
+        self.worker_id = worker_id or os.environ.get("INGEST_WORKER_ID") or f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("pragma journal_mode=wal")
+        self._conn.execute(_SCHEMA)
+        columns = {row["name"] for row in self._conn.execute("pragma table_info(manifest)")}
+        for name, kind in (("wav_size", "integer"), ("wav_mtime", "real")):
+            if name not in columns:
+                self._conn.execute(f"alter table manifest add column {name} {kind}")
+
+    def get(self, spotify_id):
+        with self._lock:
+            row = self._conn.execute("select * from manifest where spotify_id = ?", (spotify_id,)).fetchone()
+        return dict(row) if row else {}
+
+    def _update(self, spotify_id, **fields):
+        fields["updated_at"] = time.time()
+        names = ", ".join(fields)
+        placeholders = ", ".join("?" for _ in fields)
+        updates = ", ".join(f"{k} = excluded.{k}" for k in fields)
+        with self._lock:
+            self._conn.execute(
+                f"insert into manifest (spotify_id, {names}) values (?, {placeholders}) "
+                f"on conflict(spotify_id) do update set {updates}",
+                (spotify_id, *fields.values()),
+            )
+
+    # ----- claims -----
+
+    def claim(self, spotify_id, lease_seconds=LEASE_SECONDS, reclaim=False):
+        """
+        Take the song for this worker unless another worker holds a live claim
+        (or regardless, with reclaim=True). Returns True if claimed.
+        """
+        now = time.time()
+        with self._lock:
+            self._conn.execute("begin immediate")
+            try:
+                row = self._conn.execute(
+                    "select claimed_by, claimed_until from manifest where spotify_id = ?", (spotify_id,)
+                ).fetchone()
+                if not reclaim and row and row["claimed_by"] not in (None, self.worker_id) \
+                        and (row["claimed_until"] or 0) > now:
+                    self._conn.execute("rollback")
+                    return False
+                self._conn.execute(
+                    "insert into manifest (spotify_id, claimed_by, claimed_until, updated_at) values (?, ?, ?, ?) "
+                    "on conflict(spotify_id) do update set claimed_by = excluded.claimed_by, "
+                    "claimed_until = excluded.claimed_until, updated_at = excluded.updated_at",
+                    (spotify_id, self.worker_id, now + lease_seconds, now),
+                )
+                self._conn.execute("commit")
+                return True
+            except Exception:
+                self._conn.execute("rollback")
+                raise
+
+    def renew(self, lease_seconds=LEASE_SECONDS):
+        """Extend every claim this worker holds by lease_seconds from now. Returns how many."""
+        with self._lock:
+            cursor = self._conn.execute(
+                "update manifest set claimed_until = ? where claimed_by = ?",
+                (time.time() + lease_seconds, self.worker_id),
+            )
+        return cursor.rowcount
+
+    def release(self, spotify_id):
+        with self._lock:
+            self._conn.execute(
+                "update manifest set claimed_by = null, claimed_until = null where spotify_id = ? and claimed_by = ?",
+                (spotify_id, self.worker_id),
+            )
+
+    # ----- steps -----
+
+    def local_wav(self, spotify_id):
+        """
+        The manifest entry if its recorded WAV still exists with the recorded
+        hash, else None. The file is only re-hashed when its size or mtime
+        differ from what was recorded.
+        """
+        entry = self.get(spotify_id)
+        path = entry.get("wav_path")
+        if not path or not entry.get("wav_sha256"):
+            return None
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        if st.st_size == entry.get("wav_size") and st.st_mtime == entry.get("wav_mtime"):
+            return entry
+        if sha256_file(path) != entry["wav_sha256"]:
+            return None
+        self._update(spotify_id, wav_size=st.st_size, wav_mtime=st.st_mtime)
+        return entry
+
+    def mark_downloaded(self, spotify_id, wav_path, wav_sha256, duration=None):
+        st = os.stat(wav_path)
+        self._update(spotify_id, wav_path=wav_path, wav_sha256=wav_sha256, duration=duration,
+                     wav_size=st.st_size, wav_mtime=st.st_mtime)
+
+    def is_uploaded(self, spotify_id, object_name, wav_sha256):
+        entry = self.get(spotify_id)
+        return bool(entry.get("url_original")) and entry.get("object_name") == object_name \
+            and entry.get("uploaded_sha256") == wav_sha256
+
+    def mark_uploaded(self, spotify_id, object_name, url_original, wav_sha256):
+        self._update(spotify_id, object_name=object_name, url_original=url_original, uploaded_sha256=wav_sha256)
+
+    def is_inserted(self, spotify_id, url_original=None):
+        entry = self.get(spotify_id)
+        if not entry.get("song_id"):
+            return False
+        return url_original is None or entry.get("inserted_url") == url_original
+
+    def mark_inserted(self, spotify_id, song_id, url_original):
+        self._update(spotify_id, song_id=str(song_id), inserted_url=url_original, url_original=url_original)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,528 @@
+"""
+Staged, parallel ingestion of songs into S3 + Supabase.
+
+Each song moves through a chain of stages (download -> transcode -> analyze ->
+upload -> metadata -> insert). Stages are connected by bounded queues, so a
+slow stage makes the ones before it wait instead of piling up files on disk,
+and each stage has its own worker pool: network-bound stages run on threads,
+CPU-bound ones in a process pool.
+
+Failed stage calls are retried with exponential backoff; an item that keeps
+failing is reported and dropped. After every stage the item's state is
+appended to a checkpoint file, so re-running with the same checkpoint skips
+finished songs and restarts unfinished ones at the stage after the last one
+that completed.
+
+dry_run=True swaps every external dependency (yt-dlp, ffmpeg, S3, ReccoBeats,
+Supabase) for local stand-ins with a configurable fake latency, which is
+handy for measuring pipeline throughput:
+
+    python ingest_pipeline.py ../songs.txt --dry-run
+"""
+
+import json
+import multiprocessing
+import os
+import queue
+import re
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+DOWNLOADS_DIR = os.path.join(os.path.dirname(__file__), "downloads")
+INGEST_DIR = os.path.join(DOWNLOADS_DIR, "ingest")
+
+_STOP = object()
+
+
+class Stage:
+    """One step of the pipeline. fn takes an item dict and returns the updated item."""
+
+    def __init__(self, name, fn, workers=1, processes=False, retries=2):
+        self.name = name
+        self.fn = fn
+        self.workers = workers
+        self.processes = processes
+        self.retries = retries
+
+
+class Checkpoint:
+    """Append-only JSONL log of the last stage each item completed."""
+
+    def __init__(self, path):
+        self.path = path
+        self.progress = {}
+        self._lock = threading.Lock()
+        self._file = None
+        if path is None:
+            return
+        if os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    self.progress[entry["key"]] = (entry["stage"], entry["item"])
+        self._file = open(path, "a")
+
+    def record(self, key, stage, item):
+        if self._file is None:
+            return
+        with self._lock:
+            self._file.write(json.dumps({"key": key, "stage": stage, "item": item}) + "\n")
+            self._file.flush()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+
+
+def run_pipeline(items, stages, *, key="spotify_id", checkpoint_path=None, queue_size=8, retry_delay=1.0):
+    """
+    Push items through stages. Returns (completed_items, stats) where stats has
+    per-stage done/failed counts and busy seconds plus overall throughput.
+    """
+    checkpoint = Checkpoint(checkpoint_path)
+    stage_index = {stage.name: i for i, stage in enumerate(stages)}
+    queues = [queue.Queue(maxsize=queue_size) for _ in stages]
+    completed = []
+    failed = []
+    stats = {stage.name: {"done": 0, "failed": 0, "busy_seconds": 0.0} for stage in stages}
+    stats_lock = threading.Lock()
+    pools = {
+        # spawn, not fork: the pool starts while worker threads are already running.
+        stage.name: ProcessPoolExecutor(max_workers=stage.workers, mp_context=multiprocessing.get_context("spawn"))
+        for stage in stages if stage.processes
+    }
+    remaining_workers = [stage.workers for stage in stages]
+
+    def call(stage, item):
+        if stage.processes:
+            return pools[stage.name].submit(stage.fn, item).result()
+        return stage.fn(item)
+
+    def worker(i):
+        stage = stages[i]
+        try:
+            while True:
+                item = queues[i].get()
+                if item is _STOP:
+                    break
+                result = None
+                error = None
+                started = time.perf_counter()
+                for attempt in range(stage.retries + 1):
+                    try:
+                        result = call(stage, dict(item))
+                        error = None
+                        break
+                    except Exception as e:
+                        error = e
+                        if attempt < stage.retries:
+                            time.sleep(retry_delay * 2 ** attempt)
+                if error is None:
+                    try:
+                        checkpoint.record(result.get(key), stage.name, result)
+                    except Exception as e:
+                        error = RuntimeError(f"checkpoint write failed: {e}")
+                elapsed = time.perf_counter() - started
+                with stats_lock:
+                    stats[stage.name]["busy_seconds"] += elapsed
+                    stats[stage.name]["done" if error is None else "failed"] += 1
+                if error is not None:
+                    print(f"[{stage.name}] {item.get(key)} failed after {stage.retries + 1} attempts: {error}")
+                    with stats_lock:
+                        failed.append((item, stage.name, str(error)))
+                    continue
+                if i + 1 < len(stages):
+                    queues[i + 1].put(result)
+                else:
+                    with stats_lock:
+                        completed.append(result)
+        finally:
+            # The last worker of a stage to exit tells the next stage to stop,
+            # even if it is exiting on an unexpected error, so join() can't hang.
+            with stats_lock:
+                remaining_workers[i] -= 1
+                last = remaining_workers[i] == 0
+            if last and i + 1 < len(stages):
+                for _ in range(stages[i + 1].workers):
+                    queues[i + 1].put(_STOP)
+
+    threads = []
+    for i, stage in enumerate(stages):
+        for n in range(stage.workers):
+            t = threading.Thread(target=worker, args=(i,), name=f"{stage.name}-{n}", daemon=True)
+            t.start()
+            threads.append(t)
+
+    started = time.perf_counter()
+    skipped = 0
+    for item in items:
+        done_stage, saved = checkpoint.progress.get(item.get(key), (None, None))
+        if done_stage is None or done_stage not in stage_index:
+            queues[0].put(item)
+            continue
+        next_index = stage_index[done_stage] + 1
+        if next_index == len(stages):
+            skipped += 1
+            completed.append(saved)
+        else:
+            queues[next_index].put(saved)
+    for _ in range(stages[0].workers):
+        queues[0].put(_STOP)
+
+    for t in threads:
+        t.join()
+    for pool in pools.values():
+        pool.shutdown()
+    checkpoint.close()
+
+    elapsed = time.perf_counter() - started
+    processed = len(completed) - skipped
+    stats["total"] = {
+        "completed": len(completed),
+        "skipped": skipped,
+        "failed": len(failed),
+        "seconds": round(elapsed, 3),
+        "songs_per_minute": round(processed / elapsed * 60, 2) if elapsed > 0 else 0.0,
+    }
+    return completed, stats
+
+
+def read_song_list(txt_path):
+    """Parse lines of 'title, artist, year, spotify_id' into pipeline items."""
+    items = []
+    with open(txt_path) as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            parts = [p.strip() for p in line.rsplit(",", 3)]
+            if len(parts) != 4:
+                continue
+            title, artist, year_str, spotify_id = parts
+            try:
+                year = int(year_str)
+            except ValueError:
+                continue
+            slug = re.sub(r"[^a-z0-9-]", "", title.lower().replace(" ", "-"))
+            items.append({
+                "spotify_id": spotify_id,
+                "title": title,
+                "artist": artist,
+                "year": year,
+                "song_name": f"{title} {artist}",
+                "object_name": f"{slug}.wav" if slug else f"{spotify_id}.wav",
+                "work_dir": os.path.join(INGEST_DIR, spotify_id),
+            })
+    return items
+
+
+# ===== STAGES =====
+
+def download_stage(item):
+    from download_song import download_audio
+    path = download_audio(item["song_name"], item["work_dir"])
+    if path is None:
+        raise RuntimeError(f"no download result for {item['song_name']!r}")
+    item["source_path"] = path
+    return item
+
+
+def transcode_stage(item):
+    # ffmpeg runs as its own process, so a thread per call is enough to use every core.
+    from download_song import transcode_to_wav
+    item["wav_path"] = transcode_to_wav(item["source_path"], os.path.join(item["work_dir"], "original.wav"))
+    return item
+
+
+def analyze_stage(item):
+    """
+    Read the WAV header for duration, hash the file and write the 16 kHz
+    analysis audio next to it (see analysis_audio.py); runs in a worker process.
+    """
+    import wave
+    import analysis_audio
+    from ingest_manifest import sha256_file
+    with wave.open(item["wav_path"], "rb") as w:
+        item["duration"] = round(w.getnframes() / w.getframerate(), 3)
+    if not item.get("wav_sha256"):
+        item["wav_sha256"] = sha256_file(item["wav_path"])
+    path = analysis_audio.artefact_path(item["wav_path"])
+    if not (os.path.exists(path) and os.path.getmtime(path) >= os.path.getmtime(item["wav_path"])):
+        try:
+            analysis_audio.convert(item["wav_path"], path)
+        except ImportError as e:
+            # Scoring still works without it, decoding the WAV instead.
+            print(f"[analyze] no analysis audio for {item['spotify_id']}: {e}")
+            return item
+    item["analysis_path"] = path
+    return item
+
+
+def make_upload_stage(bucket):
+    def upload_stage(item):
+        import aws
+        if not aws.upload_file(item["wav_path"], bucket, item["object_name"]):
+            raise RuntimeError(f"upload of {item['object_name']} failed")
+        if item.get("analysis_path"):
+            import analysis_audio
+            key = analysis_audio.artefact_path(item["object_name"])
+            if not aws.upload_file(item["analysis_path"], bucket, key, skip_unchanged=True):
+                raise RuntimeError(f"upload of {key} failed")
+        item["url_original"] = f"https://{bucket}.s3.us-east-2.amazonaws.com/{item['object_name']}"
+        return item
+    return upload_stage
+
+
+def metadata_stage(item):
+    from recco_beats import get_metadata_for_track
+    item["metadata"] = get_metadata_for_track(item["spotify_id"])
+    return item
+
+
+def insert_stage(item):
+    from supabase_helpers import insert_song
+    item["row"] = insert_song(
+        spotify_id=item["spotify_id"],
+        title=item["title"],
+        artists=item["artist"],
+        year=item["year"],
+        metadata=item.get("metadata"),
+        url_original=item["url_original"],
+        duration=item.get("duration"),
+    )
+    if item["row"] is None:
+        raise RuntimeError(f"insert of {item['spotify_id']} returned no row")
+    return item
+
+
+# ===== LOCAL STAND-INS (dry run) =====
+
+DRY_RUN_LATENCY = float(os.environ.get("INGEST_DRY_RUN_LATENCY", 0.2))
+DRY_RUN_CLIP_SECONDS = 10
+
+
+def _fake_download(item):
+    import wave
+    time.sleep(DRY_RUN_LATENCY * 2)
+    os.makedirs(item["work_dir"], exist_ok=True)
+    path = os.path.join(item["work_dir"], "source.wav")
+    # 480 Hz square-ish tone: one 100-sample period at 48 kHz, repeated.
+    period = b"".join((8000 if n < 50 else -8000).to_bytes(2, "little", signed=True) for n in range(100))
+    with wave.open(path, "wb") as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(48000)
+        w.writeframes(period * (480 * DRY_RUN_CLIP_SECONDS))
+    item["source_path"] = path
+    return item
+
+
+def _fake_transcode(item):
+    import shutil
+    dst = os.path.join(item["work_dir"], "original.wav")
+    shutil.copyfile(item["source_path"], dst)
+    item["wav_path"] = dst
+    return item
+
+
+def _make_fake_upload(bucket_dir):
+    def fake_upload(item):
+        import shutil
+        time.sleep(DRY_RUN_LATENCY)
+        os.makedirs(bucket_dir, exist_ok=True)
+        dst = os.path.join(bucket_dir, item["object_name"])
+        shutil.copyfile(item["wav_path"], dst)
+        if item.get("analysis_path"):
+            import analysis_audio
+            shutil.copyfile(item["analysis_path"], analysis_audio.artefact_path(dst))
+        item["url_original"] = "file://" + os.path.abspath(dst)
+        return item
+    return fake_upload
+
+
+def _fake_metadata(item):
+    import random
+    time.sleep(DRY_RUN_LATENCY)
+    rng = random.Random(item["spotify_id"])
+    item["metadata"] = {
+        "key": rng.randrange(12), "mode": rng.randrange(2), "tempo": rng.uniform(60, 180),
+        "energy": rng.random(), "valence": rng.random(), "danceability": rng.random(),
+        "loudness": rng.uniform(-20, 0),
+    }
+    return item
+
+
+def _make_fake_insert(table_path):
+    lock = threading.Lock()
+
+    def fake_insert(item):
+        time.sleep(DRY_RUN_LATENCY / 2)
+        row = {k: item.get(k) for k in ("spotify_id", "title", "artist", "year", "metadata", "url_original", "duration")}
+        with lock, open(table_path, "a") as f:
+            f.write(json.dumps(row) + "\n")
+        item["row"] = row
+        return item
+    return fake_insert
+
+
+def build_stages(bucket=None, dry_run=False, workers=None):
+    """
+    Stage list for ingest. workers overrides per-stage pool sizes by stage name,
+    e.g. {"download": 8}.
+    """
+    cpus = os.cpu_count() or 2
+    sizes = {"download": 4, "transcode": cpus, "analyze": cpus, "upload": 8, "metadata": 4, "insert": 2}
+    sizes.update(workers or {})
+    if dry_run:
+        fns = {
+            "download": _fake_download,
+            "transcode": _fake_transcode,
+            "upload": _make_fake_upload(os.path.join(INGEST_DIR, "_dry_run_bucket")),
+            "metadata": _fake_metadata,
+            "insert": _make_fake_insert(os.path.join(INGEST_DIR, "_dry_run_songs.jsonl")),
+        }
+    else:
+        fns = {
+            "download": download_stage,
+            "transcode": transcode_stage,
+            "upload": make_upload_stage(bucket),
+            "metadata": metadata_stage,
+            "insert": insert_stage,
+        }
+    return [
+        Stage("download", fns["download"], sizes["download"], retries=2),
+        Stage("transcode", fns["transcode"], sizes["transcode"], retries=1),
+        Stage("analyze", analyze_stage, sizes["analyze"], processes=True, retries=0),
+        Stage("upload", fns["upload"], sizes["upload"], retries=3),
+        Stage("metadata", fns["metadata"], sizes["metadata"], retries=3),
+        Stage("insert", fns["insert"], sizes["insert"], retries=3),
+    ]
+
+
+def with_manifest(stages, manifest):
+    """
+    Wrap stages so each one first checks the manifest and skips work that is
+    already done (same WAV hash downloaded, uploaded or inserted), and records
+    what it did afterwards.
+    """
+    fns = {stage.name: stage.fn for stage in stages}
+
+    def download(item):
+        entry = manifest.local_wav(item["spotify_id"])
+        if entry:
+            item.update(wav_path=entry["wav_path"], wav_sha256=entry["wav_sha256"], duration=entry["duration"])
+            return item
+        return fns["download"](item)
+
+    def transcode(item):
+        if item.get("wav_sha256"):
+            return item
+        return fns["transcode"](item)
+
+    def upload(item):
+        spotify_id = item["spotify_id"]
+        manifest.mark_downloaded(spotify_id, item["wav_path"], item["wav_sha256"], item.get("duration"))
+        if manifest.is_uploaded(spotify_id, item["object_name"], item["wav_sha256"]):
+            item["url_original"] = manifest.get(spotify_id)["url_original"]
+            return item
+        item = fns["upload"](item)
+        manifest.mark_uploaded(spotify_id, item["object_name"], item["url_original"], item["wav_sha256"])
+        return item
+
+    def insert(item):
+        spotify_id = item["spotify_id"]
+        if manifest.is_inserted(spotify_id, item["url_original"]):
+            item["row"] = None
+            return item
+        item = fns["insert"](item)
+        manifest.mark_inserted(spotify_id, item["row"].get("id", spotify_id), item["url_original"])
+        return item
+
+    wrapped = {"download": download, "transcode": transcode, "upload": upload, "insert": insert}
+    return [
+        Stage(stage.name, wrapped.get(stage.name, stage.fn), stage.workers, stage.processes, stage.retries)
+        for stage in stages
+    ]
+
+
+def ingest(txt_path, bucket=None, *, dry_run=False, checkpoint_path=None, manifest_path=None, workers=None,
+           reclaim=False):
+    """
+    Run the full ingest for a song list. Songs the manifest (or Supabase) says
+    are already inserted are skipped, and songs another worker has claimed are
+    left to it unless reclaim is set (e.g. rerunning after a crash). Claims are
+    renewed in the background for as long as the run lasts. Returns (completed_items, stats).
+    """
+    from ingest_manifest import LEASE_SECONDS, Manifest
+
+    prefix = "dry_run_" if dry_run else ""
+    if checkpoint_path is None:
+        checkpoint_path = os.path.join(INGEST_DIR, f"{prefix}checkpoint.jsonl")
+    if manifest_path is None:
+        manifest_path = os.path.join(INGEST_DIR, f"{prefix}manifest.sqlite3")
+    os.makedirs(os.path.dirname(checkpoint_path) or ".", exist_ok=True)
+    manifest = Manifest(manifest_path)
+    items = read_song_list(txt_path)
+    if not dry_run:
+        # Songs inserted by another machine or an older ingest count as done.
+        from supabase_helpers import get_existing_songs
+        existing = get_existing_songs([item["spotify_id"] for item in items])
+        for spotify_id, row in existing.items():
+            if not manifest.is_inserted(spotify_id):
+                manifest.mark_inserted(spotify_id, row["id"], row["url_original"])
+    todo = [item for item in items if not manifest.is_inserted(item["spotify_id"])]
+    claimed = [item for item in todo if manifest.claim(item["spotify_id"], reclaim=reclaim)]
+    stop_renewing = threading.Event()
+
+    def renew_claims():
+        while not stop_renewing.wait(LEASE_SECONDS / 3):
+            try:
+                manifest.renew()
+            except Exception as e:
+                print(f"Could not renew ingest claims: {e}")
+
+    renewer = threading.Thread(target=renew_claims, name="ingest-lease", daemon=True)
+    renewer.start()
+    if not dry_run:
+        # One batched ReccoBeats pass up front; the metadata stage then reads the on-disk cache.
+        from recco_beats import get_metadata_for_tracks
+        try:
+            get_metadata_for_tracks([item["spotify_id"] for item in claimed])
+        except Exception as e:
+            print(f"Metadata prefetch failed, falling back to per-song lookups: {e}")
+    stages = with_manifest(build_stages(bucket, dry_run=dry_run, workers=workers), manifest)
+    try:
+        completed, stats = run_pipeline(claimed, stages, checkpoint_path=checkpoint_path)
+    finally:
+        stop_renewing.set()
+        renewer.join()
+        for item in claimed:
+            manifest.release(item["spotify_id"])
+        manifest.close()
+    stats["total"]["already_ingested"] = len(items) - len(todo)
+    stats["total"]["claimed_by_other_workers"] = len(todo) - len(claimed)
+    return completed, stats
+
+
+if __name__ == "__main__":
+    import sys
+    args = [a for a in sys.argv[1:] if not a.startswith("--")]
+    if not args:
+        print("Usage: python ingest_pipeline.py <songs.txt> [--dry-run] [--fresh] [--reclaim]", file=sys.stderr)
+        print("  songs.txt: lines of 'title, artist, year, spotify_id'", file=sys.stderr)
+        print("  --dry-run: use local stand-ins instead of yt-dlp/S3/ReccoBeats/Supabase", file=sys.stderr)
+        print("  --fresh:   ignore the checkpoint from a previous run", file=sys.stderr)
+        print("  --reclaim: take over songs other (e.g. crashed) workers still hold claims on", file=sys.stderr)
+        sys.exit(1)
+    dry_run = "--dry-run" in sys.argv
+    checkpoint = os.path.join(INGEST_DIR, "dry_run_checkpoint.jsonl" if dry_run else "checkpoint.jsonl")
+    if "--fresh" in sys.argv and os.path.exists(checkpoint):
+        os.remove(checkpoint)
+    bucket = os.environ.get("AWS_S3_BUCKET") or os.environ.get("S3_BUCKET") or "wics-2026-audio"
+    completed, stats = ingest(args[0], bucket, dry_run=dry_run, checkpoint_path=checkpoint,
+                              reclaim="--reclaim" in sys.argv)
+    print(json.dumps(stats, indent=2))
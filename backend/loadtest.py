@@ -0,0 +1,407 @@
+"""
+Load test for the Flask API without Supabase or S3.
+
+Boots app.py in-process against:
+  - fake_supabase.FakeSupabase (or, with --storage sqlite, a temporary
+    sqlite_store database) seeded with the songmap songs plus synthetic filler
+    rows and a set of users, installed as app.supabase_client and
+    supabase_helpers' client, so the catalog, ELO ledger and metadata lookups
+    all hit it too
+  - a local HTTP file server that answers any *.wav path with a generated
+    16 kHz mono WAV, used for url_original / stem URLs and AWS_FILE_FORM
+
+then drives a weighted mix of /api/songs (streamed and paged),
+/api/songs/random, /api/guess and /api/users/login from N concurrent clients
+and prints per-endpoint throughput, p50/p95/p99 latency, error rates and
+degraded (metadata-only) guess counts as JSON.
+
+    python loadtest.py --concurrency 32 --duration 30 --out loadtest.json
+    python loadtest.py --mix random=5,guess=5 --scoring-latency 0.2
+    python loadtest.py --real-scoring            # needs the ML stack installed
+
+By default the embedding half of the similarity score is replaced with a sleep
+of --scoring-latency seconds, at most --scoring-capacity at a time (the
+metadata half still runs against the fake database); --real-scoring runs similarity_score unchanged against the file server.
+"""
+
+import argparse
+import contextlib
+import functools
+import io
+import json
+import logging
+import math
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import wave
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+DEFAULT_MIX = "random=4,guess=3,songs_page=2,songs=1,login=1"
+PASSWORD = "loadtest-password"
+AUDIO_SECONDS = 30
+SAMPLE_RATE = 16000
+
+
+# ----- local file server -----
+
+@functools.lru_cache(maxsize=64)
+def _wav_bytes(name, seconds):
+    """A deterministic tone for name, so different songs sound (and embed) differently."""
+    freq = 110 + (sum(name.encode()) % 48) * 10
+    frames = bytearray()
+    for i in range(seconds * SAMPLE_RATE):
+        sample = int(8000 * math.sin(2 * math.pi * freq * i / SAMPLE_RATE))
+        frames += sample.to_bytes(2, "little", signed=True)
+    out = io.BytesIO()
+    with wave.open(out, "wb") as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(SAMPLE_RATE)
+        w.writeframes(bytes(frames))
+    return out.getvalue()
+
+
+class _AudioHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        path = self.path.split("?")[0]
+        if not path.endswith(".wav"):
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        body = _wav_bytes(os.path.basename(path), self.server.audio_seconds)
+        self.send_response(200)
+        self.send_header("Content-Type", "audio/wav")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_file_server(audio_seconds=AUDIO_SECONDS):
+    """Serve generated WAVs in a background thread. Returns (server, base_url)."""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _AudioHandler)
+    server.daemon_threads = True
+    server.audio_seconds = audio_seconds
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+# ----- seed data -----
+
+def seed_tables(audio_base, extra_songs, users, audio_seconds, rng):
+    from werkzeug.security import generate_password_hash
+    from rounds import load_songmap
+
+    _, slug_to_spotify = load_songmap()
+    now = datetime.now(timezone.utc)
+    songs = []
+
+    def add_song(title, spotify_id):
+        n = len(songs)
+        songs.append({
+            "id": f"00000000-0000-4000-8000-{n:012d}",
+            "spotify_id": spotify_id,
+            "title": title,
+            "artists": f"Artist {n % 97}",
+            "year": 1970 + n % 55,
+            "duration": float(audio_seconds),
+            "created_at": (now - timedelta(seconds=n)).isoformat(),
+            "url_original": f"{audio_base}/songs/{spotify_id}.wav",
+            **{inst: f"{audio_base}/songs/{spotify_id}-{suffix}.wav" for inst, suffix in (
+                ("url_drum", "drums"), ("url_bass", "bass"), ("url_piano", "piano"),
+                ("url_guitar", "guitar"), ("url_vocals", "vocals"), ("url_other", "other"))},
+            "key": rng.randrange(12),
+            "mode": rng.randrange(2),
+            "tempo": rng.uniform(70, 170),
+            "energy": rng.random(),
+            "valence": rng.random(),
+            "danceability": rng.random(),
+            "loudness": rng.uniform(-12, -3),
+        })
+
+    # spotify_id is unique on songs (migration 004); songmap may alias one id under two slugs.
+    for slug, spotify_id in slug_to_spotify.items():
+        if spotify_id not in {s["spotify_id"] for s in songs}:
+            add_song(slug.replace("-", " ").title(), spotify_id)
+    for i in range(extra_songs):
+        add_song(f"Filler Song {i}", f"filler{i:018d}")
+
+    # pbkdf2 is deliberately slow; hash once and share it.
+    password_hash = generate_password_hash(PASSWORD)
+    user_rows = [{
+        "id": f"00000000-0000-4000-9000-{i:012d}",
+        "username": f"loadtest{i}",
+        "email": f"loadtest{i}@example.com",
+        "password_hash": password_hash,
+        "elo_rating": 1000,
+        "created_at": now.isoformat(),
+    } for i in range(users)]
+    return {"songs": songs, "users": user_rows}, slug_to_spotify
+
+
+# ----- app under test -----
+
+def boot_app(tables, scoring_latency, real_scoring, audio_base, storage="fake", workdir=None, scoring_capacity=2):
+    """Import app.py wired to the stand-ins and serve it on a free port. Returns (server, base_url, client)."""
+    os.environ.setdefault("S3_BUCKET", "loadtest")
+    if real_scoring:
+        os.environ["AWS_FILE_FORM"] = f"{audio_base}/clips/placeholder.wav"
+
+    import app
+    import catalog
+    import similarity_score
+    import supabase_helpers
+    from werkzeug.serving import make_server
+
+    if storage == "sqlite":
+        from sqlite_store import SQLiteClient
+        client = SQLiteClient(os.path.join(workdir or tempfile.mkdtemp(), "loadtest.db"))
+        for name, rows in tables.items():
+            client.table(name).insert(rows).execute()
+    else:
+        from fake_supabase import FakeSupabase
+        client = FakeSupabase(tables)
+    app.supabase_client = client
+    supabase_helpers._supabase = client
+    catalog._catalog = None
+
+    if not real_scoring:
+        # Like model inference on a few cores: at most scoring_capacity run at once, the rest queue.
+        capacity = threading.Semaphore(scoring_capacity)
+
+        def stub_similarity(orig_id, guess_id, start_second, duration=15):
+            # Same song: the real embedding score returns 1 without running the model.
+            if orig_id != guess_id:
+                with capacity:
+                    time.sleep(scoring_latency)
+            embedding = 1.0 if orig_id == guess_id else 0.5
+            diff, orig_metadata, guess_metadata = similarity_score._filter_metadata_diff(orig_id, guess_id)
+            score = float(similarity_score._combine_scores([embedding], {k: [v] for k, v in diff.items()})[0])
+            return score, orig_metadata, guess_metadata, diff
+        app.calculate_similarity = stub_similarity
+
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    server = make_server("127.0.0.1", 0, app.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}", client
+
+
+# ----- traffic -----
+
+class Scenario:
+    """Builds one request per call for each endpoint in the mix."""
+
+    def __init__(self, base_url, tables, slug_to_spotify, rng):
+        from rounds import play_spotify_ids
+        self.base_url = base_url
+        self.rng = rng
+        by_spotify = {s["spotify_id"]: s for s in tables["songs"]}
+        self.play_songs = [by_spotify[sid] for sid in play_spotify_ids() if sid in by_spotify]
+        self.guessable = [by_spotify[sid] for sid in slug_to_spotify.values() if sid in by_spotify]
+        self.users = tables["users"]
+        self.cursors = []
+
+    def songs(self, session):
+        return session.get(f"{self.base_url}/api/songs", timeout=60)
+
+    def songs_page(self, session):
+        params = {"limit": 50}
+        if self.cursors and self.rng.random() < 0.5:
+            params["cursor"] = self.rng.choice(self.cursors)
+        r = session.get(f"{self.base_url}/api/songs", params=params, timeout=60)
+        if r.ok and r.json().get("next_cursor") and len(self.cursors) < 100:
+            self.cursors.append(r.json()["next_cursor"])
+        return r
+
+    def random(self, session):
+        return session.get(f"{self.base_url}/api/songs/random", timeout=60)
+
+    def guess(self, session):
+        actual = self.rng.choice(self.play_songs)
+        guessed = actual if self.rng.random() < 0.2 else self.rng.choice(self.guessable)
+        return session.post(f"{self.base_url}/api/guess", json={
+            "actual_song_id": actual["id"],
+            "guessed_song_id": guessed["id"],
+            "clip_start_time": self.rng.randrange(0, AUDIO_SECONDS - 15 + 1),
+            "user_id": self.rng.choice(self.users)["id"] if self.users else None,
+            "stems_unmuted": self.rng.sample(["drums", "bass", "piano", "guitar", "vocals", "other"],
+                                             self.rng.randint(1, 6)),
+        }, timeout=120)
+
+    def login(self, session):
+        user = self.rng.choice(self.users)
+        return session.post(f"{self.base_url}/api/users/login",
+                            json={"username": user["username"], "password": PASSWORD}, timeout=60)
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        if name.strip() not in ("songs", "songs_page", "random", "guess", "login"):
+            raise ValueError(f"unknown endpoint in mix: {name!r}")
+        mix[name.strip()] = float(weight or 1)
+    return mix
+
+
+def _percentile(sorted_values, p):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, math.ceil(p / 100 * len(sorted_values)) - 1))
+    return round(sorted_values[index] * 1000, 2)
+
+
+def run(scenario, mix, concurrency, duration, max_requests):
+    names = list(mix)
+    weights = [mix[n] for n in names]
+    records = []
+    records_lock = threading.Lock()
+    issued = [0]
+    deadline = time.monotonic() + duration
+
+    def client(seed):
+        rng = random.Random(seed)
+        session = requests.Session()
+        while time.monotonic() < deadline:
+            with records_lock:
+                if max_requests and issued[0] >= max_requests:
+                    return
+                issued[0] += 1
+            name = rng.choices(names, weights)[0]
+            start = time.perf_counter()
+            try:
+                response = getattr(scenario, name)(session)
+                _ = response.content
+                status = response.status_code
+                degraded = name == "guess" and response.ok and bool(response.json().get("degraded"))
+            except requests.RequestException as e:
+                status, degraded = type(e).__name__, False
+            elapsed = time.perf_counter() - start
+            with records_lock:
+                records.append((name, elapsed, status, degraded))
+
+    start = time.monotonic()
+    with ThreadPoolExecutor(concurrency) as pool:
+        for f in [pool.submit(client, i) for i in range(concurrency)]:
+            f.result()
+    wall = time.monotonic() - start
+
+    endpoints = {}
+    for name in names:
+        mine = [r for r in records if r[0] == name]
+        latencies = sorted(r[1] for r in mine)
+        errors = sum(1 for r in mine if not (isinstance(r[2], int) and r[2] < 400))
+        statuses = {}
+        for r in mine:
+            statuses[str(r[2])] = statuses.get(str(r[2]), 0) + 1
+        endpoints[name] = {
+            "requests": len(mine),
+            "errors": errors,
+            "error_rate": round(errors / len(mine), 4) if mine else 0.0,
+            "throughput_rps": round(len(mine) / wall, 2),
+            "p50_ms": _percentile(latencies, 50),
+            "p95_ms": _percentile(latencies, 95),
+            "p99_ms": _percentile(latencies, 99),
+            "max_ms": _percentile(latencies, 100),
+            "statuses": statuses,
+            "degraded": sum(1 for r in mine if r[3]),
+        }
+    total_errors = sum(e["errors"] for e in endpoints.values())
+    return {
+        "wall_seconds": round(wall, 2),
+        "total": {
+            "requests": len(records),
+            "errors": total_errors,
+            "error_rate": round(total_errors / len(records), 4) if records else 0.0,
+            "throughput_rps": round(len(records) / wall, 2),
+        },
+        "endpoints": endpoints,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load-test the API against local Supabase and S3 stand-ins.")
+    parser.add_argument("--concurrency", type=int, default=16, help="concurrent clients (default 16)")
+    parser.add_argument("--duration", type=float, default=20, help="seconds to run (default 20)")
+    parser.add_argument("--requests", type=int, default=0, help="stop after this many requests (default: no cap)")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help=f"endpoint weights (default {DEFAULT_MIX})")
+    parser.add_argument("--extra-songs", type=int, default=2000, help="synthetic songs added to the songmap ones")
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--scoring-latency", type=float, default=0.05,
+                        help="seconds the stubbed embedding score sleeps (default 0.05)")
+    parser.add_argument("--scoring-capacity", type=int, default=2,
+                        help="stubbed scorings that can run at once; the rest queue (default 2)")
+    parser.add_argument("--storage", choices=("fake", "sqlite"), default="fake",
+                        help="in-memory fake of the Supabase API, or the embedded SQLite backend")
+    parser.add_argument("--real-scoring", action="store_true", help="run the real similarity model")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", help="also write the JSON report to this file")
+    args = parser.parse_args(argv)
+
+    mix = parse_mix(args.mix)
+    rng = random.Random(args.seed)
+    workdir = tempfile.mkdtemp(prefix="loadtest-")
+    os.environ["ELO_JOURNAL_PATH"] = os.path.join(workdir, "elo_journal.jsonl")
+
+    # app.py prints per request; keep stdout for the report.
+    with contextlib.redirect_stdout(sys.stderr):
+        file_server, audio_base = start_file_server()
+        tables, slug_to_spotify = seed_tables(audio_base, args.extra_songs, args.users, AUDIO_SECONDS, rng)
+        server, base_url, client = boot_app(tables, args.scoring_latency, args.real_scoring, audio_base,
+                                            args.storage, workdir, args.scoring_capacity)
+        scenario = Scenario(base_url, tables, slug_to_spotify, rng)
+        # Warm up: build the catalog and seed the ledger before timing.
+        session = requests.Session()
+        for name in mix:
+            getattr(scenario, name)(session)
+
+        result = run(scenario, mix, args.concurrency, args.duration, args.requests)
+        admission = session.get(f"{base_url}/api/scoring/stats", timeout=10).json()
+
+        from elo import get_ledger
+        get_ledger().close()
+        server.shutdown()
+        file_server.shutdown()
+
+    report = {
+        "config": {
+            "concurrency": args.concurrency,
+            "duration": args.duration,
+            "requests": args.requests or None,
+            "mix": mix,
+            "songs": len(tables["songs"]),
+            "users": args.users,
+            "storage": args.storage,
+            "scoring": "real" if args.real_scoring else f"stub({args.scoring_latency}s x{args.scoring_capacity})",
+            "seed": args.seed,
+        },
+        **result,
+        "backend": {
+            "storage_calls": getattr(client, "calls", None),
+            "game_events_recorded": len(client.table("game_events").select("id").execute().data),
+            "scoring_admission": admission,
+        },
+    }
+    text = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(text + "\n")
+    print(text)
+    return 0 if result["total"]["requests"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
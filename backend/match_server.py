@@ -0,0 +1,400 @@
+"""
+Live multiplayer match server (asyncio + websockets).
+
+Players connect over a WebSocket and join a match by id. When a match has
+PLAYERS_PER_MATCH players it starts: every round the server picks a song and
+clip window once, serialises the round message once and broadcasts the same
+bytes to all players. Guesses are timed on the server from the moment the
+round was sent and scored with calculate_similarity in a thread pool, so the
+event loop only ever does bookkeeping and I/O.
+
+Client -> server messages (JSON):
+    {"type": "join", "match_id": "abc", "player": "alice"}
+    {"type": "guess", "guessed_song_id": "<songs.id>"}
+
+Server -> client messages:
+    joined, round, guess_result, player_guessed, round_over, match_over, error
+
+A guess still being scored when its round ends gets a guess_result with
+"late": true that doesn't count. If no song can be picked for a round after
+PICK_ATTEMPTS tries the match ends with a match_over carrying an "error".
+
+Environment:
+    MATCH_PLAYERS, MATCH_ROUNDS, MATCH_ROUND_SECONDS, MATCH_SCORING_THREADS
+
+    python match_server.py [port] [--dry-run]     # serve (dry run: fake songs and scores)
+    python match_server.py bench [matches] [players_per_match]
+"""
+
+import asyncio
+import json
+import os
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from websockets.asyncio.server import broadcast, serve
+
+PLAYERS_PER_MATCH = int(os.environ.get("MATCH_PLAYERS", 2))
+ROUNDS_PER_MATCH = int(os.environ.get("MATCH_ROUNDS", 5))
+ROUND_SECONDS = float(os.environ.get("MATCH_ROUND_SECONDS", 45))
+SCORING_THREADS = int(os.environ.get("MATCH_SCORING_THREADS", 4))
+SNIPPET_LENGTH = 15
+NEXT_ROUND_DELAY = 3.0
+PICK_ATTEMPTS = 3
+PICK_RETRY_DELAY = 1.0
+
+
+class Match:
+    def __init__(self, match_id, size):
+        self.id = match_id
+        self.size = size
+        self.players = {}  # player name -> connection
+        self.scores = {}
+        self.round_number = 0
+        self.round = None
+        self.round_sent_at = 0.0
+        self.guesses = {}
+        self.round_timer = None
+        self.started = False
+        self.finished = False
+
+
+class MatchServer:
+    """
+    pick_round() -> dict with at least id, clip_start_time and the stem URLs.
+    score_guess(round, guessed_song_id) -> dict with similarity_score (0-100).
+    Both are blocking and run in executors.
+    """
+
+    def __init__(self, pick_round, score_guess, *, players_per_match=PLAYERS_PER_MATCH,
+                 rounds=ROUNDS_PER_MATCH, round_seconds=ROUND_SECONDS, next_round_delay=NEXT_ROUND_DELAY,
+                 scoring_threads=SCORING_THREADS):
+        self.pick_round = pick_round
+        self.score_guess = score_guess
+        self.players_per_match = players_per_match
+        self.rounds = rounds
+        self.round_seconds = round_seconds
+        self.next_round_delay = next_round_delay
+        self.matches = {}
+        self._scoring_pool = ThreadPoolExecutor(max_workers=scoring_threads, thread_name_prefix="match-scoring")
+        self._io_pool = ThreadPoolExecutor(max_workers=32, thread_name_prefix="match-io")
+        self._tasks = set()
+
+    def _spawn(self, coro):
+        """Run coro as a background task, keeping a reference until it ends and logging its failure."""
+        task = asyncio.get_running_loop().create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._task_done)
+        return task
+
+    def _task_done(self, task):
+        self._tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            print(f"[match] background task failed: {task.exception()!r}")
+
+    # ----- connection handling -----
+
+    async def handler(self, connection):
+        match = None
+        player = None
+        try:
+            async for raw in connection:
+                try:
+                    message = json.loads(raw)
+                except ValueError:
+                    await connection.send(json.dumps({"type": "error", "error": "invalid JSON"}))
+                    continue
+                kind = message.get("type")
+                if kind == "join" and match is None:
+                    match, player = await self._join(connection, message)
+                elif kind == "guess" and match is not None:
+                    await self._guess(connection, match, player, message)
+                else:
+                    await connection.send(json.dumps({"type": "error", "error": f"unexpected message {kind!r}"}))
+        finally:
+            if match is not None:
+                self._leave(match, player)
+
+    async def _join(self, connection, message):
+        match_id = str(message.get("match_id") or "")
+        player = str(message.get("player") or "")
+        if not match_id or not player:
+            await connection.send(json.dumps({"type": "error", "error": "match_id and player are required"}))
+            return None, None
+        match = self.matches.get(match_id)
+        if match is None:
+            match = self.matches[match_id] = Match(match_id, self.players_per_match)
+        if match.started or player in match.players or len(match.players) >= match.size:
+            await connection.send(json.dumps({"type": "error", "error": "match is full or already started"}))
+            return None, None
+        match.players[player] = connection
+        match.scores[player] = 0
+        broadcast(match.players.values(), json.dumps({
+            "type": "joined", "match_id": match_id, "players": list(match.players), "size": match.size,
+        }))
+        if len(match.players) == match.size:
+            match.started = True
+            self._spawn(self._start_round(match))
+        return match, player
+
+    def _leave(self, match, player):
+        match.players.pop(player, None)
+        if not match.players:
+            if match.round_timer is not None:
+                match.round_timer.cancel()
+            match.finished = True
+            self._forget(match)
+        elif match.round is not None and all(match.guesses.get(p) is not None for p in match.players):
+            self._end_round(match)
+
+    def _forget(self, match):
+        """Drop a finished match, unless its id already belongs to a newer match."""
+        if self.matches.get(match.id) is match:
+            del self.matches[match.id]
+
+    def _finish(self, match, error=None):
+        match.finished = True
+        message = {"type": "match_over", "scores": match.scores}
+        if error:
+            message["error"] = error
+        broadcast(match.players.values(), json.dumps(message))
+        self._forget(match)
+
+    # ----- rounds -----
+
+    async def _start_round(self, match):
+        loop = asyncio.get_running_loop()
+        song = None
+        error = None
+        for attempt in range(PICK_ATTEMPTS):
+            if attempt:
+                await asyncio.sleep(PICK_RETRY_DELAY * 2 ** (attempt - 1))
+            if match.finished:
+                return
+            try:
+                song = await loop.run_in_executor(self._io_pool, self.pick_round)
+            except Exception as e:
+                error = e
+            else:
+                if song:
+                    break
+                error = "pick_round returned no song"
+            print(f"[match {match.id}] could not pick a song (attempt {attempt + 1}/{PICK_ATTEMPTS}): {error}")
+        if match.finished:
+            return
+        if song is None:
+            # No round can be played: end the match rather than leave players waiting on nothing.
+            self._finish(match, error=f"could not pick a song: {error}")
+            return
+        match.round_number += 1
+        match.round = song
+        match.guesses = {}
+        match.round_sent_at = loop.time()
+        # Only what players need to play the round; the answer stays on the server.
+        payload = {k: v for k, v in song.items() if k.startswith("url_") or k == "clip_start_time"}
+        broadcast(match.players.values(), json.dumps({
+            "type": "round",
+            "round": match.round_number,
+            "rounds": self.rounds,
+            "seconds": self.round_seconds,
+            "sent_at": time.time(),
+            **payload,
+        }))
+        match.round_timer = loop.call_later(self.round_seconds, self._end_round, match, match.round_number)
+
+    async def _guess(self, connection, match, player, message):
+        loop = asyncio.get_running_loop()
+        round_number = match.round_number
+        if match.round is None or player in match.guesses:
+            await connection.send(json.dumps({"type": "error", "error": "no open round or already guessed"}))
+            return
+        elapsed = loop.time() - match.round_sent_at
+        match.guesses[player] = None  # placeholder so a second guess is rejected while scoring
+        guessed_song_id = message.get("guessed_song_id")
+        try:
+            result = await loop.run_in_executor(self._scoring_pool, self.score_guess, match.round, guessed_song_id)
+        except Exception as e:
+            print(f"[match {match.id}] scoring failed: {e}")
+            result = {"similarity_score": 0, "is_correct": False}
+        result = {**result, "elapsed": round(elapsed, 3), "guessed_song_id": guessed_song_id}
+        if match.round_number != round_number or match.round is None:
+            # The round ended while we were scoring: still answer, but it doesn't count.
+            await connection.send(json.dumps({"type": "guess_result", "round": round_number, "late": True, **result}))
+            return
+        match.guesses[player] = result
+        match.scores[player] += int(result.get("similarity_score", 0))
+        await connection.send(json.dumps({"type": "guess_result", "round": round_number, **result}))
+        broadcast(match.players.values(), json.dumps({
+            "type": "player_guessed", "round": round_number, "player": player, "elapsed": round(elapsed, 3),
+        }))
+        if all(match.guesses.get(p) is not None for p in match.players):
+            self._end_round(match)
+
+    def _end_round(self, match, round_number=None):
+        if match.round is None or (round_number is not None and round_number != match.round_number):
+            return
+        if match.round_timer is not None:
+            match.round_timer.cancel()
+            match.round_timer = None
+        answer = {k: match.round.get(k) for k in ("id", "name", "artists")}
+        match.round = None
+        broadcast(match.players.values(), json.dumps({
+            "type": "round_over",
+            "round": match.round_number,
+            "answer": answer,
+            "guesses": {p: g for p, g in match.guesses.items() if g is not None},
+            "scores": match.scores,
+        }))
+        if match.round_number >= self.rounds:
+            self._finish(match)
+            return
+        loop = asyncio.get_running_loop()
+        loop.call_later(self.next_round_delay, lambda: self._spawn(self._start_round(match)))
+
+    async def serve(self, host="0.0.0.0", port=5002):
+        async with serve(self.handler, host, port, compression=None) as server:
+            await server.serve_forever()
+
+
+# ===== ROUND PROVIDERS =====
+
+def pick_round():
+    """Choose a song from play.txt the same way /api/songs/random does."""
+    from rounds import pick_clip_start, play_spotify_ids
+    from supabase_helpers import get_song
+    from upload_stems_to_s3 import stem_urls_from_original
+
+    spotify_id = random.choice(play_spotify_ids())
+    row = get_song(spotify_id=spotify_id)
+    if row is None:
+        raise LookupError(f"Song with spotify_id {spotify_id} not in database")
+    return {
+        "id": str(row["id"]),
+        "spotify_id": row["spotify_id"],
+        "name": row.get("title") or "",
+        "artists": row.get("artists"),
+        "url_original": row["url_original"],
+        **stem_urls_from_original(row["url_original"]),
+        "clip_start_time": pick_clip_start(row.get("duration"), SNIPPET_LENGTH),
+    }
+
+
+def score_guess(song, guessed_song_id):
+    """Score a guess against the round's song with calculate_similarity (blocking)."""
+    from catalog import get_catalog
+    from similarity_score import calculate_similarity
+
+    if str(guessed_song_id) == song["id"]:
+        return {"similarity_score": 100, "is_correct": True}
+    catalog = get_catalog()
+    guessed = catalog.by_id(guessed_song_id)
+    if guessed is None:
+        raise LookupError(f"unknown song {guessed_song_id}")
+    overall, _, _, _ = calculate_similarity(
+        catalog.slug_for_spotify_id(song["spotify_id"]),
+        catalog.slug_for_spotify_id(guessed["spotify_id"]),
+        int(song["clip_start_time"]),
+        duration=SNIPPET_LENGTH,
+    )
+    return {"similarity_score": int(overall * 100), "is_correct": False}
+
+
+# Local stand-ins for --dry-run and the benchmark.
+
+FAKE_CATALOG = [f"song-{n:03d}" for n in range(50)]
+
+
+def fake_pick_round():
+    song_id = random.choice(FAKE_CATALOG)
+    base = f"http://127.0.0.1:8000/{song_id}"
+    return {
+        "id": song_id,
+        "name": song_id,
+        "artists": "Local",
+        "url_original": f"{base}.wav",
+        **{f"url_{inst}": f"{base}-{inst}.wav" for inst in ("drum", "bass", "piano", "guitar", "vocals", "other")},
+        "clip_start_time": random.random() * 165,
+    }
+
+
+def fake_score_guess(song, guessed_song_id):
+    time.sleep(0.005)
+    if guessed_song_id == song["id"]:
+        return {"similarity_score": 100, "is_correct": True}
+    return {"similarity_score": random.Random(f"{song['id']}{guessed_song_id}").randrange(20, 90), "is_correct": False}
+
+
+# ===== LOAD GENERATOR =====
+
+async def _bench_player(url, match_id, player, latencies, counters, connecting):
+    from websockets.asyncio.client import connect
+
+    async with connecting:
+        ws = await connect(url, compression=None, max_queue=None, open_timeout=60)
+    async with ws:
+        await ws.send(json.dumps({"type": "join", "match_id": match_id, "player": player}))
+        async for raw in ws:
+            message = json.loads(raw)
+            kind = message["type"]
+            if kind == "round":
+                latencies.append(time.time() - message["sent_at"])
+                await asyncio.sleep(random.random() * 0.2)
+                await ws.send(json.dumps({"type": "guess", "guessed_song_id": random.choice(FAKE_CATALOG)}))
+            elif kind == "guess_result":
+                counters["guesses"] += 1
+            elif kind == "match_over":
+                counters["matches_finished"] += 1
+                return
+            elif kind == "error":
+                counters["errors"] += 1
+
+
+async def bench(matches=500, players=4, rounds=3):
+    server = MatchServer(fake_pick_round, fake_score_guess, players_per_match=players, rounds=rounds,
+                         round_seconds=5, next_round_delay=0.1, scoring_threads=8)
+    latencies = []
+    counters = {"guesses": 0, "matches_finished": 0, "errors": 0}
+    async with serve(server.handler, "127.0.0.1", 0, compression=None) as ws_server:
+        port = ws_server.sockets[0].getsockname()[1]
+        url = f"ws://127.0.0.1:{port}"
+        # Ramp up like real traffic rather than opening every socket in the same tick.
+        connecting = asyncio.Semaphore(100)
+        start = time.perf_counter()
+        results = await asyncio.gather(*(
+            _bench_player(url, f"m{m}", f"p{p}", latencies, counters, connecting)
+            for m in range(matches) for p in range(players)
+        ), return_exceptions=True)
+        counters["errors"] += sum(isinstance(r, Exception) for r in results)
+        elapsed = time.perf_counter() - start
+    latencies.sort()
+
+    def pct(q):
+        return round(latencies[min(len(latencies) - 1, int(q * len(latencies)))] * 1000, 2) if latencies else None
+
+    return {
+        "matches": matches,
+        "players": matches * players,
+        "seconds": round(elapsed, 3),
+        "round_messages": len(latencies),
+        "round_delivery_ms": {"p50": pct(0.5), "p95": pct(0.95), "p99": pct(0.99)},
+        "guesses_per_second": round(counters["guesses"] / elapsed, 1),
+        **counters,
+    }
+
+
+if __name__ == "__main__":
+    import sys
+    args = [a for a in sys.argv[1:] if not a.startswith("--")]
+    if args and args[0] == "bench":
+        n_matches = int(args[1]) if len(args) > 1 else 500
+        n_players = int(args[2]) if len(args) > 2 else 4
+        print(json.dumps(asyncio.run(bench(n_matches, n_players)), indent=2))
+    else:
+        port = int(args[0]) if args else 5002
+        if "--dry-run" in sys.argv:
+            match_server = MatchServer(fake_pick_round, fake_score_guess)
+        else:
+            match_server = MatchServer(pick_round, score_guess)
+        print(f"Match server on ws://0.0.0.0:{port}")
+        asyncio.run(match_server.serve(port=port))
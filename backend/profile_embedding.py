@@ -0,0 +1,300 @@
+"""
+Speed/accuracy profile of similarity_score's cheaper embedding modes
+(SCORING_EMBEDDING_LAYERS, SCORING_FRAME_POOL, SCORING_INPUT_SECONDS).
+
+For every setting in the sweep it embeds each catalog song's guess windows
+once, then scores a set of puzzles (a song and clip start) against every other
+song with calculate_similarity's weighting, and compares with the full model:
+
+    window_ms       model time per guess window, batched as calculate_similarity_batch does
+    clip_ms         model time for one clip embedded on its own (median)
+    peak_rss_mb     peak resident memory of a fresh process that loads the model
+                    and embeds one batch; forward_rss_mb is the part above the loaded model
+    spearman        rank correlation of a puzzle's scores with the full model's (mean over puzzles)
+    top10_overlap   share of the full model's 10 best candidates also in this setting's 10 best
+    top1_agreement  share of puzzles whose best candidate is unchanged
+    max_abs_diff    largest change in any overall score
+
+and finally names the fastest setting that stays within --min-spearman and
+--min-top10 of the full model.
+
+    python profile_embedding.py --songs 200 --puzzles 20
+    python profile_embedding.py --layers 12,6,4 --frame-pool 1,2 --input-seconds 0,8 --out profile.json
+    python profile_embedding.py smoke     # real model on float16 analysis audio; exits 1 on failure
+
+Song audio comes from AWS_FILE_FORM through _get_audio_array (cached locally as
+analysis audio, so float16 memory maps), metadata from the configured storage
+backend. Songs stay memory-mapped; _get_embedding casts each batch to float32.
+The sweep switches modes on the shared model, so run it in its own process,
+not inside the server.
+"""
+
+import argparse
+import itertools
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import similarity_score as ss
+from catalog import get_catalog
+from supabase_helpers import FEATURE_COLUMNS, get_metadata_by_spotify_ids
+
+DURATION = 15
+
+
+def _rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _ranks(values):
+    import numpy as np
+    ranks = np.empty(len(values))
+    ranks[np.argsort(values, kind="stable")] = np.arange(len(values))
+    return ranks
+
+
+def _spearman(a, b):
+    import numpy as np
+    ra, rb = _ranks(a), _ranks(b)
+    if ra.std() == 0 or rb.std() == 0:
+        return 1.0
+    return float(np.corrcoef(ra, rb)[0, 1])
+
+
+def load_songs(limit=0):
+    """(slugs, metadata, audio) for catalog songs with complete metadata and audio, in catalog order."""
+    catalog = get_catalog()
+    slugs = list(dict.fromkeys(
+        slug for slug in (catalog.slug_for_spotify_id(s.get("spotify_id")) for s in catalog.songs) if slug))
+    metadata = get_metadata_by_spotify_ids([catalog.spotify_id_for_slug(s) for s in slugs])
+    slugs = [s for s in slugs
+             if all(metadata.get(catalog.spotify_id_for_slug(s), {}).get(c) is not None for c in FEATURE_COLUMNS)]
+    if limit:
+        slugs = slugs[:limit]
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        audio = list(pool.map(ss._get_audio_array, slugs))
+    keep = [i for i, a in enumerate(audio) if len(a) >= DURATION * ss.sampling_rate]
+    return ([slugs[i] for i in keep],
+            [metadata[catalog.spotify_id_for_slug(slugs[i])] for i in keep],
+            [audio[i] for i in keep])
+
+
+def pick_puzzles(audio, count, rng):
+    """[(song index, clip start second)] for count distinct songs."""
+    puzzles = []
+    for index in rng.sample(range(len(audio)), min(count, len(audio))):
+        seconds = len(audio[index]) // ss.sampling_rate
+        puzzles.append((index, rng.randrange(max(1, seconds - DURATION))))
+    return puzzles
+
+
+def score_setting(metadata, audio, puzzles, batch_size):
+    """Embed everything under the current mode. Returns (timings, [scores per puzzle, aligned with songs])."""
+    import numpy as np
+    processor, model = ss._load_model()
+
+    windows, owners = [], []
+    for owner, audio_array in enumerate(audio):
+        for window in ss._guess_windows(audio_array, DURATION):
+            windows.append(window)
+            owners.append(owner)
+    ss._embed_windows(processor, model, windows[:batch_size], batch_size)  # warm-up
+    start = time.perf_counter()
+    window_embeddings = ss._embed_windows(processor, model, windows, batch_size)
+    window_ms = (time.perf_counter() - start) * 1000 / len(windows)
+    window_embeddings /= np.maximum(np.linalg.norm(window_embeddings, axis=1, keepdims=True), 1e-12)
+
+    clip_times, all_scores = [], []
+    for index, start_second in puzzles:
+        clip = audio[index][start_second * ss.sampling_rate : (start_second + DURATION) * ss.sampling_rate]
+        start = time.perf_counter()
+        clip_embedding = ss._get_embedding(processor, model, clip)[0]
+        clip_times.append((time.perf_counter() - start) * 1000)
+        clip_embedding /= max(np.linalg.norm(clip_embedding), 1e-12)
+
+        embedding = np.full(len(audio), -np.inf)
+        np.maximum.at(embedding, owners, window_embeddings @ clip_embedding)
+        embedding[index] = 1
+        scores = ss._combine_scores(embedding, ss._metadata_diff_arrays(metadata[index], metadata))
+        scores[index] = np.nan  # the answer itself always wins; rank the other songs
+        all_scores.append(scores)
+
+    timings = {"windows": len(windows), "window_ms": round(window_ms, 2),
+               "clip_ms": round(sorted(clip_times)[len(clip_times) // 2], 2)}
+    return timings, all_scores
+
+
+def compare(reference, scores):
+    """Agreement of one setting's puzzle scores with the reference's."""
+    import numpy as np
+    spearman, top10, top1, max_diff = [], [], [], 0.0
+    for ref, got in zip(reference, scores):
+        valid = ~np.isnan(ref)
+        ref, got = ref[valid], got[valid]
+        spearman.append(_spearman(ref, got))
+        k = min(10, len(ref))
+        top10.append(len(set(np.argsort(-ref)[:k]) & set(np.argsort(-got)[:k])) / k)
+        top1.append(int(np.argmax(ref) == np.argmax(got)))
+        max_diff = max(max_diff, float(np.max(np.abs(ref - got))))
+    return {"spearman": round(float(np.mean(spearman)), 4), "spearman_min": round(float(np.min(spearman)), 4),
+            "top10_overlap": round(float(np.mean(top10)), 4), "top1_agreement": round(float(np.mean(top1)), 4),
+            "max_abs_diff": round(max_diff, 4)}
+
+
+def measure_memory(layers, frame_pool, input_seconds, batch_size):
+    """Peak RSS of a fresh process embedding one batch of noise windows under a setting."""
+    out = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "_memory", str(layers), str(frame_pool),
+         str(input_seconds), str(batch_size)],
+        capture_output=True, text=True, check=True)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def _analysis_noise(seconds):
+    """seconds of noise written and reopened as analysis audio, i.e. the float16 memory map scoring reads."""
+    import tempfile
+    import numpy as np
+    import analysis_audio
+    rng = np.random.default_rng(0)
+    path = os.path.join(tempfile.mkdtemp(prefix="profile-embedding-"), "noise" + analysis_audio.SUFFIX)
+    analysis_audio.write(rng.standard_normal(int(seconds * ss.sampling_rate)) * 0.1, path, ss.sampling_rate)
+    samples, _ = analysis_audio.open_samples(path)
+    return samples
+
+
+def _memory_child(layers, frame_pool, input_seconds, batch_size):
+    ss.set_embedding_mode(layers, frame_pool, input_seconds)
+    processor, model = ss._load_model()
+    loaded = _rss_mb()
+    samples = _analysis_noise(batch_size * DURATION)
+    windows = [samples[i * DURATION * ss.sampling_rate : (i + 1) * DURATION * ss.sampling_rate] for i in range(batch_size)]
+    ss._embed_windows(processor, model, windows, batch_size)
+    peak = _rss_mb()
+    print(json.dumps({"peak_rss_mb": round(peak, 1), "forward_rss_mb": round(peak - loaded, 1)}))
+
+
+def smoke():
+    """
+    Run the real model through _get_embedding and _embed_windows on float16
+    analysis audio, at full depth and in a cheap mode. Returns failures.
+    """
+    import numpy as np
+    failures = []
+    samples = _analysis_noise(150)
+    clip = samples[10 * ss.sampling_rate : (10 + DURATION) * ss.sampling_rate]
+    windows = ss._guess_windows(samples, DURATION)
+    saved = ss.set_embedding_mode()
+    try:
+        for setting in ((0, 1, 0.0), (4, 2, 8.0)):
+            ss.set_embedding_mode(*setting)
+            try:
+                processor, model = ss._load_model()
+                clip_embedding = ss._get_embedding(processor, model, clip)
+                window_embeddings = ss._embed_windows(processor, model, windows, 2)
+            except Exception as e:
+                failures.append(f"{setting}: {type(e).__name__}: {e}")
+                continue
+            ok = (clip_embedding.shape[0] == 1 and window_embeddings.shape == (len(windows), clip_embedding.shape[1])
+                  and np.isfinite(clip_embedding).all() and np.isfinite(window_embeddings).all())
+            print(f"  {'ok' if ok else 'FAIL':4} layers={setting[0]} frame_pool={setting[1]} input_seconds={setting[2]}: "
+                  f"{clip.dtype} audio -> clip {clip_embedding.shape}, windows {window_embeddings.shape}")
+            if not ok:
+                failures.append(f"{setting}: bad embedding shape or values")
+    finally:
+        ss.set_embedding_mode(saved["layers"], saved["frame_pool"], saved["input_seconds"])
+    return failures
+
+
+def profile(layers, frame_pools, input_seconds, songs=0, puzzles=20, batch_size=ss.BATCH_WINDOWS,
+            min_spearman=0.95, min_top10=0.8, memory=True, seed=0):
+    depth = ss.full_depth()
+    slugs, metadata, audio = load_songs(songs)
+    if len(slugs) < 2:
+        raise SystemExit("need at least two catalog songs with metadata and audio")
+    puzzle_list = pick_puzzles(audio, puzzles, random.Random(seed))
+    print(f"[profile] {len(slugs)} songs, {len(puzzle_list)} puzzles, full model has {depth} layers", flush=True)
+
+    reference_setting = (depth, 1, 0.0)
+    settings = [reference_setting] + [
+        s for s in dict.fromkeys((min(l, depth), p, float(i)) for l, p, i in itertools.product(layers, frame_pools, input_seconds))
+        if s != reference_setting]
+
+    results, reference = [], None
+    saved = ss.set_embedding_mode()
+    try:
+        for setting in settings:
+            ss.set_embedding_mode(*setting)
+            timings, scores = score_setting(metadata, audio, puzzle_list, batch_size)
+            if reference is None:
+                reference = scores
+            row = {"layers": setting[0], "frame_pool": setting[1], "input_seconds": setting[2], **timings,
+                   **compare(reference, scores)}
+            if memory:
+                row.update(measure_memory(*setting, batch_size))
+            print(json.dumps(row), flush=True)
+            results.append(row)
+    finally:
+        ss.set_embedding_mode(saved["layers"], saved["frame_pool"], saved["input_seconds"])
+
+    full_ms = results[0]["window_ms"]
+    for row in results:
+        row["speedup"] = round(full_ms / row["window_ms"], 2) if row["window_ms"] else None
+    acceptable = [r for r in results if r["spearman"] >= min_spearman and r["top10_overlap"] >= min_top10]
+    best = min(acceptable, key=lambda r: r["window_ms"])
+    return {
+        "songs": len(slugs), "puzzles": len(puzzle_list), "batch_size": batch_size,
+        "thresholds": {"min_spearman": min_spearman, "min_top10": min_top10},
+        "results": results,
+        "recommended": {"SCORING_EMBEDDING_LAYERS": 0 if best["layers"] == depth else best["layers"],
+                        "SCORING_FRAME_POOL": best["frame_pool"],
+                        "SCORING_INPUT_SECONDS": best["input_seconds"],
+                        "speedup": best["speedup"]},
+    }
+
+
+def _ints(text):
+    return [int(v) for v in text.split(",") if v.strip()]
+
+
+def main(argv=None):
+    if argv is None and len(sys.argv) > 1 and sys.argv[1] == "_memory":
+        layers, frame_pool, input_seconds, batch_size = sys.argv[2:6]
+        _memory_child(int(layers), int(frame_pool), float(input_seconds), int(batch_size))
+        return
+    if argv is None and len(sys.argv) > 1 and sys.argv[1] == "smoke":
+        failed = smoke()
+        print("FAILED: " + "; ".join(failed) if failed else "OK")
+        sys.exit(1 if failed else 0)
+    parser = argparse.ArgumentParser(description="Sweep embedding depth and report speed and agreement with the full model.")
+    parser.add_argument("--layers", default="12,10,8,6,4,3,2,1", help="transformer depths to try (default 12,10,8,6,4,3,2,1)")
+    parser.add_argument("--frame-pool", default="1", help="frame pooling factors to try (default 1)")
+    parser.add_argument("--input-seconds", default="0", help="input lengths to try in seconds, 0 = whole clip (default 0)")
+    parser.add_argument("--songs", type=int, default=0, help="only the first N catalog songs (default: all)")
+    parser.add_argument("--puzzles", type=int, default=20, help="songs used as the actual song (default 20)")
+    parser.add_argument("--batch-size", type=int, default=ss.BATCH_WINDOWS)
+    parser.add_argument("--min-spearman", type=float, default=0.95)
+    parser.add_argument("--min-top10", type=float, default=0.8)
+    parser.add_argument("--no-memory", action="store_true", help="skip the per-setting memory measurement")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", help="also write the JSON report to this file")
+    args = parser.parse_args(argv)
+
+    report = profile(_ints(args.layers), _ints(args.frame_pool),
+                     [float(v) for v in args.input_seconds.split(",") if v.strip()],
+                     songs=args.songs, puzzles=args.puzzles, batch_size=args.batch_size,
+                     min_spearman=args.min_spearman, min_top10=args.min_top10,
+                     memory=not args.no_memory, seed=args.seed)
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(text + "\n")
+
+
+if __name__ == "__main__":
+    main()
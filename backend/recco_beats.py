@@ -1,8 +1,23 @@
 import json
+import math
+import os
 import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager
 import requests
+from requests.adapters import HTTPAdapter
 
-BASE_URL = "https://api.reccobeats.com/v1"
+BASE_URL = os.environ.get("RECCOBEATS_BASE_URL", "https://api.reccobeats.com/v1")
+
+# Most ids the audio-features endpoint accepts per request.
+MAX_BATCH = int(os.environ.get("RECCOBEATS_MAX_BATCH", 40))
+MAX_RETRIES = 5
+BACKOFF_SECONDS = 1.0
+# Seconds an id ReccoBeats didn't know is not asked for again.
+NEGATIVE_TTL = float(os.environ.get("RECCOBEATS_NEGATIVE_TTL", 7 * 24 * 3600))
+CACHE_PATH = os.environ.get("RECCOBEATS_CACHE_PATH") or os.path.join(os.path.dirname(__file__), "reccobeats_cache.json")
 
 # the audio features that we acc want to store
 
@@ -11,28 +26,189 @@ AUDIO_FEATURE_KEYS = [
     "key", "liveness", "loudness", "mode", "speechiness", "tempo", "valence",
 ]
 
+_session = None
+_session_lock = threading.Lock()
+
+
+def _get_session():
+    """Shared session so every request reuses pooled keep-alive connections."""
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16)
+            _session.mount("https://", adapter)
+            _session.mount("http://", adapter)
+        return _session
+
+
+@contextmanager
+def _file_lock(path):
+    """Exclusive lock on path (created if missing) held across processes for the with block."""
+    with open(path, "a") as f:
+        try:
+            import fcntl
+        except ImportError:
+            import msvcrt
+            while True:
+                try:
+                    msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    pass
+            try:
+                yield
+            finally:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+            return
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+class MetadataCache:
+    """
+    On-disk JSON cache of audio features keyed by spotify_id. Ids ReccoBeats
+    doesn't know are remembered too, as {"missing_at": unix time}, and not asked
+    for again for NEGATIVE_TTL seconds. Writes merge with whatever other
+    processes have written, under a lock file next to the cache.
+    """
+
+    def __init__(self, path=CACHE_PATH, negative_ttl=None):
+        self.path = path
+        self.negative_ttl = NEGATIVE_TTL if negative_ttl is None else negative_ttl
+        self._lock = threading.Lock()
+        self._data = None
+
+    def _read(self):
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _load(self):
+        if self._data is None:
+            self._data = self._read()
+        return self._data
+
+    def get_many(self, spotify_ids):
+        with self._lock:
+            data = self._load()
+            return {i: data[i] for i in spotify_ids if i in data and "missing_at" not in data[i]}
+
+    def known_missing(self, spotify_ids):
+        """Ids recorded as unknown to ReccoBeats within the last negative_ttl seconds."""
+        now = time.time()
+        with self._lock:
+            data = self._load()
+            return {i for i in spotify_ids
+                    if i in data and now - data[i].get("missing_at", -math.inf) < self.negative_ttl}
+
+    def put_many(self, features_by_id, missing=()):
+        entries = dict(features_by_id)
+        now = time.time()
+        entries.update({i: {"missing_at": now} for i in missing if i not in entries})
+        if not entries:
+            return
+        with self._lock, _file_lock(self.path + ".lock"):
+            # Re-read under the lock so entries other processes wrote since we loaded survive.
+            data = self._read()
+            data.update(entries)
+            tmp_path = f"{self.path}.{os.getpid()}.{uuid.uuid4().hex}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(data, f)
+            os.replace(tmp_path, self.path)
+            self._data = data
+
+
+_cache = MetadataCache()
+
+
 def _audio_features_only(item):
     """Return dict with only keys from acousticness onward."""
     return {k: item[k] for k in AUDIO_FEATURE_KEYS if k in item}
 
+
+def _spotify_id_of(item):
+    """ReccoBeats returns its own ids; the Spotify id is the last segment of href."""
+    href = item.get("href") or ""
+    return href.rstrip("/").rsplit("/", 1)[-1] or None
+
+
+def _retry_delay(response, attempt):
+    """Seconds to wait before retrying: Retry-After if the server sent one, else exponential backoff."""
+    retry_after = response.headers.get("Retry-After") if response is not None else None
+    if retry_after:
+        try:
+            return float(retry_after)
+        except ValueError:
+            pass
+    return BACKOFF_SECONDS * 2 ** attempt
+
+
 def get_audio_features(ids):
-    response = requests.get(
-        f"{BASE_URL}/audio-features",
-        params={"ids": ",".join(ids)},
-        timeout=30,
-    )
-    response.raise_for_status()
-    return response.json()
+    """
+    Raw audio-features response for up to MAX_BATCH ids. Retries on rate limits
+    (429), server errors and connection failures.
+    """
+    session = _get_session()
+    for attempt in range(MAX_RETRIES + 1):
+        response = None
+        try:
+            response = session.get(
+                f"{BASE_URL}/audio-features",
+                params={"ids": ",".join(ids)},
+                timeout=30,
+            )
+            if response.status_code != 429 and response.status_code < 500:
+                response.raise_for_status()
+                return response.json()
+        except (requests.ConnectionError, requests.Timeout):
+            if attempt == MAX_RETRIES:
+                raise
+        if attempt == MAX_RETRIES:
+            response.raise_for_status()
+        time.sleep(_retry_delay(response, attempt))
+
+
+def get_metadata_for_tracks(spotify_ids, use_cache=True):
+    """
+    Audio-features metadata for many tracks. Ids already in the on-disk cache
+    are not requested again; the rest are fetched in batches of MAX_BATCH.
+    Returns {spotify_id: features}; ids ReccoBeats doesn't know are left out,
+    and cached as unknown so the next run doesn't ask again.
+    """
+    wanted = list(dict.fromkeys(spotify_ids))
+    found = _cache.get_many(wanted) if use_cache else {}
+    known_missing = _cache.known_missing(wanted) if use_cache else set()
+    missing = [i for i in wanted if i not in found and i not in known_missing]
+    for start in range(0, len(missing), MAX_BATCH):
+        batch = missing[start:start + MAX_BATCH]
+        data = get_audio_features(batch)
+        fetched = {}
+        for item in data.get("content", []):
+            spotify_id = _spotify_id_of(item)
+            if spotify_id in batch:
+                fetched[spotify_id] = _audio_features_only(item)
+        # A single-id batch can only be that id, even if href is missing.
+        if len(batch) == 1 and not fetched and data.get("content"):
+            fetched[batch[0]] = _audio_features_only(data["content"][0])
+        _cache.put_many(fetched, missing=[i for i in batch if i not in fetched])
+        found.update(fetched)
+    return found
+
 
 def get_metadata_for_track(spotify_id: str):
     """
     Get audio-features metadata for a single track by Spotify ID.
     Returns a dict with AUDIO_FEATURE_KEYS only, or None if not found.
     """
-    data = get_audio_features([spotify_id])
-    for item in data.get("content", []):
-        return _audio_features_only(item)
-    return None
+    return get_metadata_for_tracks([spotify_id]).get(spotify_id)
+
 
 def main():
     if len(sys.argv) < 2:
@@ -45,13 +221,16 @@ def main():
     if not ids:
         print("No IDs found in file.", file=sys.stderr)
         sys.exit(1)
+    try:
+        features = get_metadata_for_tracks(ids)
+    except requests.RequestException as e:
+        print(json.dumps({"error": str(e)}), file=sys.stderr)
+        sys.exit(1)
     for track_id in ids:
-        try:
-            data = get_audio_features([track_id])
-            for item in data.get("content", []):
-                print(json.dumps(_audio_features_only(item)))
-        except requests.RequestException as e:
-            print(json.dumps({"id": track_id, "error": str(e)}), file=sys.stderr)
+        if track_id in features:
+            print(json.dumps(features[track_id]))
+        else:
+            print(json.dumps({"id": track_id, "error": "not found"}), file=sys.stderr)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
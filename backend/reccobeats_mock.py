@@ -0,0 +1,210 @@
+"""
+Local stand-in for the ReccoBeats audio-features API, for exercising and
+benchmarking recco_beats.py without touching the real service.
+
+    python reccobeats_mock.py serve [port]        # then RECCOBEATS_BASE_URL=http://127.0.0.1:<port>/v1
+    python reccobeats_mock.py bench [n_ids]       # one-id-per-request vs batched, cold and warm cache
+    python reccobeats_mock.py check               # assert batching, retries and caching; exit 1 on failure
+
+The server answers GET /v1/audio-features?ids=a,b,c with deterministic fake
+features (ids starting with "unknown" get none, as for tracks ReccoBeats
+doesn't have), sleeps LATENCY seconds per request and returns 429 with
+Retry-After once more than RATE_LIMIT requests arrive within a second.
+"""
+
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+LATENCY = 0.05
+RATE_LIMIT = 20
+
+
+def fake_features(spotify_id):
+    rng = random.Random(spotify_id)
+    return {
+        "id": f"rb-{spotify_id}",
+        "href": f"https://open.spotify.com/track/{spotify_id}",
+        "acousticness": rng.random(), "danceability": rng.random(), "energy": rng.random(),
+        "instrumentalness": rng.random(), "key": rng.randrange(12), "liveness": rng.random(),
+        "loudness": rng.uniform(-20, 0), "mode": rng.randrange(2), "speechiness": rng.random(),
+        "tempo": rng.uniform(60, 180), "valence": rng.random(),
+    }
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        server = self.server
+        url = urlparse(self.path)
+        if url.path != "/v1/audio-features":
+            self.send_error(404)
+            return
+        with server.lock:
+            server.requests += 1
+            now = time.monotonic()
+            server.window = [t for t in server.window if now - t < 1.0]
+            limited = len(server.window) >= server.rate_limit
+            if limited:
+                server.rejected += 1
+            else:
+                server.window.append(now)
+        if limited:
+            self.send_response(429)
+            self.send_header("Retry-After", "0.2")
+            self.end_headers()
+            return
+        time.sleep(server.latency)
+        ids = [i for i in parse_qs(url.query).get("ids", [""])[0].split(",") if i]
+        body = json.dumps({"content": [fake_features(i) for i in ids if not i.startswith("unknown")]}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_server(port=0, latency=LATENCY, rate_limit=RATE_LIMIT):
+    """Start the mock in a background thread. Returns (server, base_url)."""
+    server = ThreadingHTTPServer(("127.0.0.1", port), _Handler)
+    server.daemon_threads = True
+    server.lock = threading.Lock()
+    server.latency = latency
+    server.rate_limit = rate_limit
+    server.requests = 0
+    server.rejected = 0
+    server.window = []
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/v1"
+
+
+def bench(n_ids=200):
+    import os
+    import tempfile
+    import requests
+    import recco_beats
+
+    server, base_url = start_server()
+    recco_beats.BASE_URL = base_url
+    recco_beats._cache = recco_beats.MetadataCache(os.path.join(tempfile.mkdtemp(), "cache.json"))
+    ids = [f"track{n:05d}" for n in range(n_ids)]
+    results = {}
+
+    # Old behaviour: one request and one fresh connection per id, no retries.
+    start = time.perf_counter()
+    ok = 0
+    for spotify_id in ids:
+        r = requests.get(f"{base_url}/audio-features", params={"ids": spotify_id}, timeout=30)
+        ok += r.status_code == 200
+    results["per_id_unpooled"] = {"seconds": round(time.perf_counter() - start, 3), "ok": ok, "requests": server.requests}
+
+    for label in ("batched_cold_cache", "batched_warm_cache"):
+        server.requests = server.rejected = 0
+        start = time.perf_counter()
+        found = recco_beats.get_metadata_for_tracks(ids)
+        results[label] = {
+            "seconds": round(time.perf_counter() - start, 3),
+            "ok": len(found),
+            "requests": server.requests,
+            "rate_limited": server.rejected,
+        }
+    server.shutdown()
+    return results
+
+
+def _put_entries(path, ids):
+    import recco_beats
+    cache = recco_beats.MetadataCache(path)
+    for spotify_id in ids:
+        cache.put_many({spotify_id: {"key": 1}})
+
+
+def check():
+    """Assert the client's batching, retry and cache behaviour against the mock. Returns a list of failures."""
+    import math
+    import multiprocessing
+    import os
+    import tempfile
+    import recco_beats
+
+    failures = []
+
+    def expect(label, got, want):
+        status = "ok" if got == want else "FAIL"
+        print(f"  {status:4} {label}: {got}" + ("" if got == want else f" (expected {want})"))
+        if got != want:
+            failures.append(label)
+
+    server, base_url = start_server(latency=0.01)
+    recco_beats.BASE_URL = base_url
+    root = tempfile.mkdtemp(prefix="reccobeats-check-")
+    recco_beats._cache = recco_beats.MetadataCache(os.path.join(root, "cache.json"))
+    known = [f"track{n:05d}" for n in range(100)]
+    unknown = [f"unknown{n}" for n in range(5)]
+
+    found = recco_beats.get_metadata_for_tracks(known + unknown)
+    expect("cold: features returned", len(found), len(known))
+    expect("cold: requests", server.requests, math.ceil(105 / recco_beats.MAX_BATCH))
+    expect("cold: features match", found["track00007"], recco_beats._audio_features_only(fake_features("track00007")))
+
+    server.requests = 0
+    found = recco_beats.get_metadata_for_tracks(known + unknown)
+    expect("warm: features returned", len(found), len(known))
+    expect("warm: requests (unknown ids cached too)", server.requests, 0)
+
+    server.requests = 0
+    recco_beats._cache.negative_ttl = 0
+    recco_beats.get_metadata_for_tracks(known + unknown)
+    expect("expired negatives: requests", server.requests, 1)
+    recco_beats._cache.negative_ttl = recco_beats.NEGATIVE_TTL
+
+    server.requests = server.rejected = 0
+    server.rate_limit = 2
+    recco_beats._cache = recco_beats.MetadataCache(os.path.join(root, "rate-limited.json"))
+    found = recco_beats.get_metadata_for_tracks([f"limited{n}" for n in range(200)])
+    expect("rate limited: features returned", len(found), 200)
+    expect("rate limited: 429s retried", server.rejected > 0, True)
+    server.shutdown()
+
+    path = os.path.join(root, "shared.json")
+    ctx = multiprocessing.get_context("spawn")
+    procs = [ctx.Process(target=_put_entries, args=(path, [f"p{p}-{n}" for n in range(25)])) for p in range(4)]
+    for proc in procs:
+        proc.start()
+    for proc in procs:
+        proc.join()
+    with open(path) as f:
+        expect("4 processes writing one cache: entries kept", len(json.load(f)), 100)
+    expect("no temp files left", [n for n in os.listdir(root) if n.endswith(".tmp")], [])
+    return failures
+
+
+if __name__ == "__main__":
+    import sys
+    if len(sys.argv) >= 2 and sys.argv[1] == "serve":
+        port = int(sys.argv[2]) if len(sys.argv) > 2 else 8765
+        server, base_url = start_server(port)
+        print(f"Mock ReccoBeats at {base_url}")
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            server.shutdown()
+    elif len(sys.argv) >= 2 and sys.argv[1] == "bench":
+        n = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+        print(json.dumps(bench(n), indent=2))
+    elif len(sys.argv) >= 2 and sys.argv[1] == "check":
+        failed = check()
+        print("FAILED: " + ", ".join(failed) if failed else "OK")
+        sys.exit(1 if failed else 0)
+    else:
+        print("Usage:")
+        print("  python reccobeats_mock.py serve [port]")
+        print("  python reccobeats_mock.py bench [n_ids]")
+        print("  python reccobeats_mock.py check")
+        sys.exit(1)
@@ -0,0 +1,51 @@
+"""
+Helpers shared by everything that serves a game round (the Flask API and the
+match server): which songs are playable, where the clip starts, and the
+songmap names the similarity model uses.
+"""
+
+import os
+import random
+
+PLAY_PATH = os.path.join(os.path.dirname(__file__), 'play.txt')
+SONGMAP_PATH = os.path.join(os.path.dirname(__file__), 'songmap.txt')
+DEFAULT_DURATION = 180.0
+
+
+def play_spotify_ids(path=PLAY_PATH):
+    """Read play.txt; return list of spotify IDs. Lines can be 'id' or 'name,id'."""
+    if not os.path.exists(path):
+        return []
+    ids = []
+    with open(path, 'r') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            part = line.split(',')[-1].strip()
+            if part:
+                ids.append(part)
+    return ids
+
+
+def load_songmap(path=SONGMAP_PATH):
+    """Parse songmap.txt ('song-name,spotify_id' lines) into (spotify_to_songname, songname_to_spotify)."""
+    spotify_to_songname = {}
+    songname_to_spotify = {}
+    with open(path, 'r') as f:
+        for line in f:
+            line = line.strip()
+            if line and ',' in line:
+                song_name, spotify_id = line.split(',', 1)
+                spotify_to_songname[spotify_id] = song_name
+                songname_to_spotify[song_name] = spotify_id
+    return spotify_to_songname, songname_to_spotify
+
+
+def pick_clip_start(duration, snippet_length):
+    """Random clip start so a snippet_length clip fits inside the song (DEFAULT_DURATION if unknown)."""
+    if duration and duration > snippet_length:
+        max_start_time = duration - snippet_length
+    else:
+        max_start_time = max(0, DEFAULT_DURATION - snippet_length)
+    return random.random() * max_start_time
@@ -0,0 +1,259 @@
+"""
+Minimal in-memory S3 stand-in for exercising and benchmarking aws.py and
+upload_stems_to_s3.py locally. Supports the calls those modules make:
+PutObject, HeadObject, GetObject (including If-None-Match), DeleteObject and
+multipart uploads, with path-style addressing and S3-compatible ETags.
+
+    python s3_mock.py serve [port]     # then S3_ENDPOINT_URL=http://127.0.0.1:<port>
+    python s3_mock.py bench [stem_mb]  # sequential vs concurrent stem upload, then an unchanged re-run
+    python s3_mock.py presign-bench [rounds]  # signing a round's 7 URLs: per-URL client vs batched + cached
+
+LATENCY seconds are added to every request to mimic a network round trip.
+"""
+
+import hashlib
+import json
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlparse
+
+LATENCY = 0.02
+
+
+def _decode_aws_chunked(body):
+    """Strip aws-chunked framing (size[;chunk-signature=..]\\r\\ndata\\r\\n ... 0\\r\\ntrailers)."""
+    out = bytearray()
+    pos = 0
+    while True:
+        line_end = body.index(b"\r\n", pos)
+        size = int(body[pos:line_end].split(b";")[0], 16)
+        if size == 0:
+            return bytes(out)
+        start = line_end + 2
+        out += body[start:start + size]
+        pos = start + size + 2
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def _target(self):
+        url = urlparse(self.path)
+        bucket, _, key = unquote(url.path).lstrip("/").partition("/")
+        return bucket, key, {k: v[0] for k, v in parse_qs(url.query, keep_blank_values=True).items()}
+
+    def _body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length)
+        if "aws-chunked" in (self.headers.get("Content-Encoding") or "") or self.headers.get("x-amz-decoded-content-length"):
+            body = _decode_aws_chunked(body)
+        return body
+
+    def _reply(self, status, body=b"", headers=None):
+        self.send_response(status)
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if body and self.command != "HEAD":
+            self.wfile.write(body)
+
+    def _not_found(self):
+        self._reply(404, b"<Error><Code>NoSuchKey</Code><Message>Not Found</Message></Error>",
+                    {"Content-Type": "application/xml"})
+
+    def do_PUT(self):
+        time.sleep(self.server.latency)
+        bucket, key, query = self._target()
+        body = self._body()
+        etag = hashlib.md5(body).hexdigest()
+        with self.server.lock:
+            self.server.stats["PUT"] += 1
+            if "uploadId" in query:
+                self.server.uploads[query["uploadId"]][int(query["partNumber"])] = body
+            else:
+                self.server.objects[(bucket, key)] = (body, etag)
+        self._reply(200, headers={"ETag": f'"{etag}"'})
+
+    def do_POST(self):
+        time.sleep(self.server.latency)
+        bucket, key, query = self._target()
+        body = self._body()
+        if "uploads" in query:
+            upload_id = uuid.uuid4().hex
+            with self.server.lock:
+                self.server.uploads[upload_id] = {}
+            xml = (f"<InitiateMultipartUploadResult><Bucket>{bucket}</Bucket><Key>{key}</Key>"
+                   f"<UploadId>{upload_id}</UploadId></InitiateMultipartUploadResult>")
+            self._reply(200, xml.encode(), {"Content-Type": "application/xml"})
+            return
+        if "uploadId" in query:
+            numbers = [int(n) for n in re.findall(rb"<PartNumber>(\d+)</PartNumber>", body)]
+            with self.server.lock:
+                self.server.stats["PUT"] += 1
+                parts = self.server.uploads.pop(query["uploadId"])
+                data = b"".join(parts[n] for n in numbers)
+                digests = b"".join(hashlib.md5(parts[n]).digest() for n in numbers)
+                etag = f"{hashlib.md5(digests).hexdigest()}-{len(numbers)}"
+                self.server.objects[(bucket, key)] = (data, etag)
+            xml = (f"<CompleteMultipartUploadResult><Bucket>{bucket}</Bucket><Key>{key}</Key>"
+                   f"<ETag>\"{etag}\"</ETag></CompleteMultipartUploadResult>")
+            self._reply(200, xml.encode(), {"Content-Type": "application/xml"})
+            return
+        self._reply(400)
+
+    def _get_or_head(self):
+        time.sleep(self.server.latency)
+        bucket, key, _ = self._target()
+        with self.server.lock:
+            self.server.stats[self.command] += 1
+            obj = self.server.objects.get((bucket, key))
+        if obj is None:
+            self._not_found()
+            return
+        data, etag = obj
+        if self.headers.get("If-None-Match") == f'"{etag}"':
+            self._reply(304, headers={"ETag": f'"{etag}"'})
+            return
+        self._reply(200, data, {"ETag": f'"{etag}"', "Content-Type": "application/octet-stream"})
+
+    do_GET = _get_or_head
+    do_HEAD = _get_or_head
+
+    def do_DELETE(self):
+        time.sleep(self.server.latency)
+        bucket, key, _ = self._target()
+        with self.server.lock:
+            self.server.objects.pop((bucket, key), None)
+        self._reply(204)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_server(port=0, latency=LATENCY):
+    """Start the stand-in in a background thread. Returns (server, endpoint_url)."""
+    server = ThreadingHTTPServer(("127.0.0.1", port), _Handler)
+    server.daemon_threads = True
+    server.lock = threading.Lock()
+    server.latency = latency
+    server.objects = {}
+    server.uploads = {}
+    server.stats = {"PUT": 0, "GET": 0, "HEAD": 0}
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def bench(stem_mb=8):
+    import os
+    import tempfile
+    import boto3
+
+    server, endpoint = start_server()
+    os.environ["S3_ENDPOINT_URL"] = endpoint
+    os.environ.setdefault("AWS_ACCESS_KEY_ID", "local")
+    os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "local")
+    import aws
+    from upload_stems_to_s3 import INSTRUMENTS, upload_stems_to_s3
+
+    root = tempfile.mkdtemp()
+    os.makedirs(os.path.join(root, "song"))
+    for inst in INSTRUMENTS:
+        with open(os.path.join(root, "song", f"{inst}.wav"), "wb") as f:
+            f.write(os.urandom(stem_mb * 1024 * 1024))
+    results = {}
+
+    # Old behaviour: a fresh client per file, one stem after another.
+    start = time.perf_counter()
+    for inst in INSTRUMENTS:
+        client = boto3.client("s3", endpoint_url=endpoint, region_name=aws.DEFAULT_REGION)
+        client.upload_file(os.path.join(root, "song", f"{inst}.wav"), "bench", f"old-{inst}.wav")
+    results["sequential_new_client"] = {"seconds": round(time.perf_counter() - start, 3)}
+
+    for label in ("concurrent_pooled", "concurrent_pooled_unchanged"):
+        server.stats.update({"PUT": 0, "HEAD": 0})
+        start = time.perf_counter()
+        upload_stems_to_s3("song", "new", "bench", downloads_root=root)
+        results[label] = {"seconds": round(time.perf_counter() - start, 3), **server.stats}
+    server.shutdown()
+    return results
+
+
+def presign_bench(rounds=2000, songs=50):
+    """Rounds per second when signing a round's original + six stems, old way vs aws.presign_urls."""
+    import os
+    import random
+    import requests
+    import boto3
+
+    server, endpoint = start_server(latency=0)
+    os.environ["S3_ENDPOINT_URL"] = endpoint
+    os.environ.setdefault("AWS_ACCESS_KEY_ID", "local")
+    os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "local")
+    import aws
+    from upload_stems_to_s3 import INSTRUMENTS
+
+    rng = random.Random(0)
+    round_keys = [[f"songs/song-{i}.wav"] + [f"songs/song-{i}-{inst}.wav" for inst in INSTRUMENTS] for i in range(songs)]
+    plays = [rng.choice(round_keys) for _ in range(rounds)]
+
+    def timed(label, fn, n):
+        start = time.perf_counter()
+        for keys in plays[:n]:
+            fn(keys)
+        seconds = time.perf_counter() - start
+        results[label] = {"rounds": n, "rounds_per_second": round(n / seconds, 1),
+                          "us_per_round": round(seconds / n * 1e6, 1)}
+
+    results = {}
+
+    def new_client_per_url(keys):
+        for key in keys:
+            client = boto3.client("s3", endpoint_url=endpoint, region_name=aws.DEFAULT_REGION)
+            client.generate_presigned_url("get_object", Params={"Bucket": "bench", "Key": key}, ExpiresIn=120)
+
+    def shared_client_per_url(keys):
+        client = aws.get_client()
+        for key in keys:
+            client.generate_presigned_url("get_object", Params={"Bucket": "bench", "Key": key}, ExpiresIn=120)
+
+    timed("new_client_per_url", new_client_per_url, min(rounds, 50))
+    timed("shared_client_per_url", shared_client_per_url, rounds)
+    aws._presigned.clear()
+    timed("presign_urls_cold", lambda keys: (aws._presigned.clear(), aws.presign_urls("bench", keys)), rounds)
+    aws._presigned.clear()
+    timed("presign_urls_cached", lambda keys: aws.presign_urls("bench", keys), rounds)
+
+    # The signed URL must actually address the object.
+    server.objects[("bench", round_keys[0][0])] = (b"RIFF", hashlib.md5(b"RIFF").hexdigest())
+    url = aws.presign_urls("bench", round_keys[0][:1])[round_keys[0][0]]
+    results["signed_url_fetch_status"] = requests.get(url).status_code
+    server.shutdown()
+    return results
+
+
+if __name__ == "__main__":
+    import sys
+    if len(sys.argv) >= 2 and sys.argv[1] == "serve":
+        port = int(sys.argv[2]) if len(sys.argv) > 2 else 9000
+        server, endpoint = start_server(port)
+        print(f"Local S3 at {endpoint}")
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            server.shutdown()
+    elif len(sys.argv) >= 2 and sys.argv[1] == "bench":
+        mb = int(sys.argv[2]) if len(sys.argv) > 2 else 8
+        print(json.dumps(bench(mb), indent=2))
+    elif len(sys.argv) >= 2 and sys.argv[1] == "presign-bench":
+        print(json.dumps(presign_bench(int(sys.argv[2]) if len(sys.argv) > 2 else 2000), indent=2))
+    else:
+        print("Usage:")
+        print("  python s3_mock.py serve [port]")
+        print("  python s3_mock.py bench [stem_mb]")
+        print("  python s3_mock.py presign-bench [rounds]")
+        sys.exit(1)
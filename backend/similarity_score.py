@@ -1,53 +1,279 @@
-import os, io, time, requests
-import librosa
-import torch
-import numpy as np
-from transformers import Wav2Vec2Processor, Data2VecAudioModel
-from sklearn.metrics.pairwise import cosine_similarity
+# The ML stack (torch, transformers, librosa, sklearn) is imported on first use,
+# not at module load, so importing this module (and app.py) stays cheap.
+import os, io, json, threading, time
+from contextlib import contextmanager
 
 from dotenv import load_dotenv
 load_dotenv()
 
-from supabase_helpers import get_metadata_by_spotify_id
+from supabase_helpers import get_metadata_by_spotify_id, get_metadata_by_spotify_ids, FEATURE_COLUMNS
+from catalog import get_catalog
+import analysis_audio
 
 sampling_rate=16000
-song_lookup = {}
-with open('songmap.txt') as f:
-    for line in f.read().split('\n'):
-        song_lookup[line.split(',')[0]] = line.split(',')[1]
 
-# Retrieves audio file from s3 bucket and converts to list
+# Weight of each component in the overall score, in calculate_similarity's order
+WEIGHTS = {'embedding': 0.4, 'key': 0.2, 'tempo': 0.15, 'energy': 0.1, 'mood': 0.1, 'loud': 0.05}
+_METADATA_WEIGHTS = {k: w for k, w in WEIGHTS.items() if k != 'embedding'}
+
+# Guess windows per forward pass in calculate_similarity_batch
+BATCH_WINDOWS = int(os.environ.get("SCORING_BATCH_WINDOWS", 16))
+
+# Cheaper embedding modes, traded against accuracy with profile_embedding.py:
+#   SCORING_EMBEDDING_LAYERS  run only the first N transformer layers and pool their
+#                             output (0 = all of them, the full model)
+#   SCORING_FRAME_POOL        average every N feature frames before the transformer (1 = off)
+#   SCORING_INPUT_SECONDS     embed only the middle N seconds of each clip and window (0 = all)
+EMBEDDING_LAYERS = int(os.environ.get("SCORING_EMBEDDING_LAYERS", 0))
+FRAME_POOL = int(os.environ.get("SCORING_FRAME_POOL", 1))
+INPUT_SECONDS = float(os.environ.get("SCORING_INPUT_SECONDS", 0))
+
+# Seconds a locally cached song's audio is used before its source is asked
+# (If-None-Match on the stored ETag) whether it was re-ingested.
+AUDIO_REVALIDATE_SECONDS = float(os.environ.get("SCORING_AUDIO_REVALIDATE_SECONDS", 300))
+_audio_checked = {}  # file_id -> time.monotonic() its cached audio was last confirmed current
+# Connect and read timeouts for audio fetches. They run inside a scoring admission
+# slot, so a stalled connection must fail the guess rather than hold the slot.
+AUDIO_FETCH_TIMEOUT = (float(os.environ.get("SCORING_AUDIO_CONNECT_TIMEOUT", 3.05)),
+                       float(os.environ.get("SCORING_AUDIO_READ_TIMEOUT", 10)))
+
+_model_lock = threading.Lock()
+_mode_cond = threading.Condition()
+_forward_passes = 0
+_switching_mode = False
+_processor = None
+_model = None
+_full_layers = None
+_frame_pool_hook = None
+
+# Loads the processor and model once per process
+def _load_model():
+    global _processor, _model, _full_layers
+    with _model_lock:
+        if _model is None:
+            from transformers import Wav2Vec2Processor, Data2VecAudioModel
+            _processor = Wav2Vec2Processor.from_pretrained("facebook/data2vec-audio-base-960h")
+            model = Data2VecAudioModel.from_pretrained("m-a-p/music2vec-v1")
+            model.eval()
+            _full_layers = model.encoder.layers
+            _configure_model(model)
+            _model = model
+    return _processor, _model
+
+# Averages the projected feature frames in groups of FRAME_POOL, so every
+# transformer layer sees a sequence FRAME_POOL times shorter
+def _pool_frames(module, inputs, output):
+    import torch.nn.functional as F
+    def pool(frames):
+        return F.avg_pool1d(frames.transpose(1, 2), FRAME_POOL, ceil_mode=True).transpose(1, 2)
+    hidden_states, extract_features = output
+    return pool(hidden_states), pool(extract_features)
+
+# Applies EMBEDDING_LAYERS and FRAME_POOL to a loaded model. Dropping the
+# trailing layers is a real early exit: last_hidden_state is then the output of
+# layer EMBEDDING_LAYERS, and the layers after it never run.
+def _configure_model(model):
+    global _frame_pool_hook
+    layers = EMBEDDING_LAYERS if 0 < EMBEDDING_LAYERS < len(_full_layers) else len(_full_layers)
+    model.encoder.layers = _full_layers[:layers]
+    if _frame_pool_hook is not None:
+        _frame_pool_hook.remove()
+        _frame_pool_hook = None
+    if FRAME_POOL > 1:
+        _frame_pool_hook = model.feature_projection.register_forward_hook(_pool_frames)
+
+# Forward passes run concurrently; a mode switch waits for the running ones to
+# finish and holds new ones back until the model is reconfigured, so no pass
+# sees its layers or frame pooling change halfway through.
+@contextmanager
+def _forward_pass():
+    global _forward_passes
+    with _mode_cond:
+        while _switching_mode:
+            _mode_cond.wait()
+        _forward_passes += 1
+    try:
+        yield
+    finally:
+        with _mode_cond:
+            _forward_passes -= 1
+            _mode_cond.notify_all()
+
+# Switches the embedding mode at runtime (for profiling; the server takes it from the environment).
+# Arguments left as None keep their current value.
+def set_embedding_mode(layers=None, frame_pool=None, input_seconds=None):
+    global EMBEDDING_LAYERS, FRAME_POOL, INPUT_SECONDS, _switching_mode
+    with _mode_cond:
+        while _switching_mode:
+            _mode_cond.wait()
+        _switching_mode = True
+        while _forward_passes:
+            _mode_cond.wait()
+    try:
+        with _model_lock:
+            if layers is not None:
+                EMBEDDING_LAYERS = layers
+            if frame_pool is not None:
+                FRAME_POOL = frame_pool
+            if input_seconds is not None:
+                INPUT_SECONDS = input_seconds
+            if _model is not None:
+                _configure_model(_model)
+            return {'layers': EMBEDDING_LAYERS, 'frame_pool': FRAME_POOL, 'input_seconds': INPUT_SECONDS}
+    finally:
+        with _mode_cond:
+            _switching_mode = False
+            _mode_cond.notify_all()
+
+# Number of transformer layers in the full model (loads it)
+def full_depth():
+    _load_model()
+    return len(_full_layers)
+
+# Imports the ML stack and loads the model ahead of the first guess
+def preload(background=True):
+    def load():
+        try:
+            import librosa, sklearn.metrics.pairwise
+            _load_model()
+            print("[scoring] model preloaded")
+        except Exception as e:
+            print(f"[scoring] preload failed: {e}")
+    if not background:
+        load()
+        return None
+    thread = threading.Thread(target=load, name="scoring-preload", daemon=True)
+    thread.start()
+    return thread
+
+def _open_analysis_audio(path):
+    """Memory-mapped 16 kHz samples from an analysis audio file, or None if it's missing or unusable."""
+    if not os.path.exists(path):
+        return None
+    try:
+        samples, rate = analysis_audio.open_samples(path)
+    except ValueError as e:
+        print(f"Ignoring analysis audio {path}: {e}")
+        return None
+    return samples if rate == sampling_rate else None
+
+# The source a cached analysis file was made from: {"url", "etag"} (see _get_audio_array)
+def _cache_source(cached):
+    try:
+        with open(cached + ".source") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def _save_cache_source(cached, url, response):
+    tmp_path = f"{cached}.source.{threading.get_ident()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump({"url": url, "etag": response.headers.get("ETag")}, f)
+    os.replace(tmp_path, cached + ".source")
+
+# GET url, conditional on the ETag stored for the cache when the cache was made from url
+def _revalidate(requests, url, source):
+    headers = {}
+    if source.get("url") == url and source.get("etag"):
+        headers["If-None-Match"] = source["etag"]
+    return requests.get(url, headers=headers, timeout=AUDIO_FETCH_TIMEOUT)
+
+# Retrieves a song's audio as 16 kHz samples. Prefers the analysis audio made at
+# ingest (see analysis_audio.py), cached locally and memory-mapped; falls back
+# to decoding the WAV, and caches the result so the next guess doesn't. The
+# cache remembers the ETag of what it was made from and is re-checked every
+# AUDIO_REVALIDATE_SECONDS, so a re-ingested song replaces it.
 def _get_audio_array(file_id):
+    import requests
+    cached = os.path.join(analysis_audio.CACHE_DIR, file_id + analysis_audio.SUFFIX)
+    checked = _audio_checked.get(file_id)
+    if checked is not None and time.monotonic() - checked < AUDIO_REVALIDATE_SECONDS:
+        samples = _open_analysis_audio(cached)
+        if samples is not None:
+            return samples
+
     url = os.getenv('AWS_FILE_FORM').replace('placeholder', file_id)
-    response = requests.get(url)
+    artefact_url = analysis_audio.artefact_path(url)
+    source = _cache_source(cached) if os.path.exists(cached) else {}
+    try:
+        response = _revalidate(requests, artefact_url, source)
+        if response.status_code == 304:
+            samples = _open_analysis_audio(cached)
+            if samples is not None:
+                _audio_checked[file_id] = time.monotonic()
+                return samples
+            response = requests.get(artefact_url, timeout=AUDIO_FETCH_TIMEOUT)
+        if response.status_code == 200:
+            os.makedirs(analysis_audio.CACHE_DIR, exist_ok=True)
+            tmp_path = f"{cached}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(response.content)
+            os.replace(tmp_path, cached)
+            _save_cache_source(cached, artefact_url, response)
+            samples = _open_analysis_audio(cached)
+            if samples is not None:
+                _audio_checked[file_id] = time.monotonic()
+                return samples
+
+        response = _revalidate(requests, url, source)
+        if response.status_code == 304:
+            samples = _open_analysis_audio(cached)
+            if samples is not None:
+                _audio_checked[file_id] = time.monotonic()
+                return samples
+            response = requests.get(url, timeout=AUDIO_FETCH_TIMEOUT)
+    except requests.RequestException as e:
+        samples = _open_analysis_audio(cached)
+        if samples is None:
+            raise
+        print(f"Could not revalidate audio for {file_id}, using the cached copy: {e}")
+        return samples
+
+    import librosa
     if response.status_code == 200:
         audio_array, _ = librosa.load(io.BytesIO(response.content), sr=sampling_rate)
     else:
         print(f"Failed to access id. Status code: {response.status_code}")
         return []
+    try:
+        analysis_audio.write(audio_array, cached, sampling_rate)
+        _save_cache_source(cached, url, response)
+        _audio_checked[file_id] = time.monotonic()
+    except OSError as e:
+        print(f"Could not cache analysis audio for {file_id}: {e}")
     return audio_array
 
-# Feedforwards an audio window through pretrained model
+# The middle INPUT_SECONDS of a clip or window (all of it when unset or already shorter)
+def _crop_input(audio_array):
+    keep = int(INPUT_SECONDS * sampling_rate)
+    if keep <= 0 or len(audio_array) <= keep:
+        return audio_array
+    start = (len(audio_array) - keep) // 2
+    return audio_array[start : start + keep]
+
+# Feedforwards an audio window through pretrained model. Input is cast to float32:
+# analysis audio is stored as float16, which the processor would otherwise pass
+# on to the float32 model as a half-precision tensor.
 def _get_embedding(processor, model, audio_array):
-    inputs = processor(audio_array, sampling_rate=sampling_rate, return_tensors="pt")
-    with torch.inference_mode():
-        outputs = model(**inputs)
+    import numpy as np
+    import torch
+    with _forward_pass():
+        if isinstance(audio_array, list):
+            audio_array = [np.asarray(_crop_input(a), dtype=np.float32) for a in audio_array]
+        else:
+            audio_array = np.asarray(_crop_input(audio_array), dtype=np.float32)
+        inputs = processor(audio_array, sampling_rate=sampling_rate, return_tensors="pt")
+        if FRAME_POOL > 1:
+            # The mask is per unpooled frame; inputs in one call are equal-length, so nothing is masked anyway
+            inputs.pop("attention_mask", None)
+        with torch.inference_mode():
+            outputs = model(**inputs)
 
     embedding = outputs.last_hidden_state.mean(dim=1).cpu().numpy()
     return embedding
 
-# Calculates the maximum similarity between first audio clip and various windows in the second song
-def _embedding_score(orig_id, guess_id, start_second, duration):
-    if orig_id == guess_id: return 1
-    processor = Wav2Vec2Processor.from_pretrained("facebook/data2vec-audio-base-960h")
-    model = Data2VecAudioModel.from_pretrained("m-a-p/music2vec-v1")
-
-    max_sim = 0
-
-    orig_audio_array = _get_audio_array(orig_id)[start_second * sampling_rate : (start_second + duration) * sampling_rate]
-    orig_embedding = _get_embedding(processor, model, orig_audio_array)
-
-    guess_audio_array_all = _get_audio_array(guess_id)
+# Splits a song into duration-second windows every 60 seconds, plus one ending at the last sample
+def _guess_windows(guess_audio_array_all, duration):
     guess_audio_array = []
     guess_padding = 60
     pointer = 0
@@ -57,7 +283,20 @@ def _embedding_score(orig_id, guess_id, start_second, duration):
             break
         guess_audio_array.append(guess_audio_array_all[pointer : pointer + duration * sampling_rate])
         pointer += guess_padding * sampling_rate
-    
+    return guess_audio_array
+
+# Calculates the maximum similarity between first audio clip and various windows in the second song
+def _embedding_score(orig_id, guess_id, start_second, duration):
+    if orig_id == guess_id: return 1
+    from sklearn.metrics.pairwise import cosine_similarity
+    processor, model = _load_model()
+
+    max_sim = 0
+
+    orig_audio_array = _get_audio_array(orig_id)[start_second * sampling_rate : (start_second + duration) * sampling_rate]
+    orig_embedding = _get_embedding(processor, model, orig_audio_array)
+
+    guess_audio_array = _guess_windows(_get_audio_array(guess_id), duration)
     guess_embedding = _get_embedding(processor, model, guess_audio_array)
     max_sim = max(cosine_similarity(orig_embedding, guess_embedding)[0])
     return max_sim
@@ -71,8 +310,9 @@ def _circle_of_fifths(key1, mode1, key2, mode2):
 
 # Calculates the difference between various metadata labels
 def _filter_metadata_diff(orig_id, guess_id):
-    orig_metadata = get_metadata_by_spotify_id(song_lookup[orig_id])
-    guess_metadata = get_metadata_by_spotify_id(song_lookup[guess_id])
+    catalog = get_catalog()
+    orig_metadata = get_metadata_by_spotify_id(catalog.spotify_id_for_slug(orig_id))
+    guess_metadata = get_metadata_by_spotify_id(catalog.spotify_id_for_slug(guess_id))
     
     results = {
         'key' : _circle_of_fifths(orig_metadata['key'], orig_metadata['mode'], guess_metadata['key'], guess_metadata['mode']),
@@ -85,6 +325,7 @@ def _filter_metadata_diff(orig_id, guess_id):
 
 # Returns a float between 0 and 1 denoting similarity
 def calculate_similarity(orig_id, guess_id, start_second, duration=15):
+    import numpy as np
     max_sim = _embedding_score(orig_id, guess_id, start_second, duration)
     metadata_diff, orig_metadata, guess_metadata = _filter_metadata_diff(orig_id, guess_id)
 
@@ -96,7 +337,141 @@ def calculate_similarity(orig_id, guess_id, start_second, duration=15):
         metadata_diff['mood'],
         metadata_diff['loud'],
     ])
-    weights = np.array([0.4, 0.2, 0.15, 0.1, 0.1, 0.05])
+    weights = np.array(list(WEIGHTS.values()))
     return np.sum(characteristics * weights), orig_metadata, guess_metadata, metadata_diff
 
+# Metadata-only score, for when embedding scoring is shed under load (see admission.py):
+# calculate_similarity's weights without the embedding term, rescaled to sum to 1
+def metadata_similarity(orig_id, guess_id):
+    metadata_diff, orig_metadata, guess_metadata = _filter_metadata_diff(orig_id, guess_id)
+    score = sum(metadata_diff[k] * w for k, w in _METADATA_WEIGHTS.items()) / sum(_METADATA_WEIGHTS.values())
+    return score, orig_metadata, guess_metadata, metadata_diff
+
+# Embeds many windows, batch_size per forward pass, as one (len(windows), hidden) array.
+# A forward pass needs equal-length inputs; only songs shorter than the clip
+# produce a short window, so windows are grouped by length and batched within each group.
+def _embed_windows(processor, model, windows, batch_size=BATCH_WINDOWS):
+    import numpy as np
+    embeddings = None
+    by_length = {}
+    for i, window in enumerate(windows):
+        by_length.setdefault(len(window), []).append(i)
+    for indices in by_length.values():
+        for start in range(0, len(indices), batch_size):
+            chunk = indices[start : start + batch_size]
+            chunk_embeddings = _get_embedding(processor, model, [windows[i] for i in chunk])
+            if embeddings is None:
+                embeddings = np.empty((len(windows), chunk_embeddings.shape[1]), dtype=np.float32)
+            embeddings[chunk] = chunk_embeddings
+    return embeddings
+
+# Max cosine similarity between the clip and each guess's windows, as an array
+# aligned with guess_ids (nan where a guess has no audio). The clip is embedded
+# once; every guess's windows are embedded together, batch_size per forward pass.
+def _embedding_scores(orig_id, guess_ids, start_second, duration, batch_size=BATCH_WINDOWS):
+    import numpy as np
+    from concurrent.futures import ThreadPoolExecutor
+
+    scores = np.full(len(guess_ids), np.nan)
+    scores[[i for i, g in enumerate(guess_ids) if g == orig_id]] = 1
+    others = list(dict.fromkeys(g for g in guess_ids if g != orig_id))
+    if not others:
+        return scores
+
+    processor, model = _load_model()
+    orig_audio_array = _get_audio_array(orig_id)[start_second * sampling_rate : (start_second + duration) * sampling_rate]
+    orig_embedding = _get_embedding(processor, model, orig_audio_array)[0]
+
+    # A candidate whose audio can't be fetched (e.g. a timeout) gets no score; the rest still do.
+    def fetch(file_id):
+        try:
+            return _get_audio_array(file_id)
+        except Exception as e:
+            print(f"Could not fetch audio for {file_id}: {e}")
+            return []
+    with ThreadPoolExecutor(max_workers=min(8, len(others))) as pool:
+        audio_arrays = list(pool.map(fetch, others))
+    windows, owners = [], []
+    for owner, audio_array in enumerate(audio_arrays):
+        if len(audio_array) == 0:
+            continue
+        for window in _guess_windows(audio_array, duration):
+            windows.append(window)
+            owners.append(owner)
+    if not windows:
+        return scores
+
+    embeddings = _embed_windows(processor, model, windows, batch_size)
+    norms = np.linalg.norm(embeddings, axis=1) * np.linalg.norm(orig_embedding)
+    sims = np.divide(embeddings @ orig_embedding, norms, out=np.zeros(len(windows)), where=norms > 0)
+    best = np.full(len(others), np.nan)
+    np.fmax.at(best, owners, sims)
+    best_by_id = dict(zip(others, best))
+    for i, guess_id in enumerate(guess_ids):
+        if guess_id != orig_id:
+            scores[i] = best_by_id[guess_id]
+    return scores
+
+# _filter_metadata_diff for many guesses at once: {component: array aligned with guess_metadata}
+def _metadata_diff_arrays(orig_metadata, guess_metadata):
+    import numpy as np
+    cols = {c: np.array([md[c] for md in guess_metadata], dtype=float) for c in FEATURE_COLUMNS}
+    pos1 = ((orig_metadata['key'] + 3 * (orig_metadata['mode'] == 0)) * 7) % 12
+    pos2 = ((cols['key'] + 3 * (cols['mode'] == 0)) * 7) % 12
+    key_diff = np.abs(pos1 - pos2)
+    return {
+        'key' : 1 - np.minimum(key_diff, 12 - key_diff) / 6,
+        'tempo' : 1 - np.abs(orig_metadata['tempo'] - cols['tempo']) / 150,
+        'energy' : 1 - np.abs(orig_metadata['energy'] - cols['energy']),
+        'mood' : 1 - np.abs(orig_metadata['valence'] + orig_metadata['danceability'] - cols['valence'] - cols['danceability']),
+        'loud' : 1 - np.abs(orig_metadata['loudness'] - cols['loudness']) / 10,
+    }
+
+# Overall scores from embedding scores and _metadata_diff_arrays output, weighted
+# as calculate_similarity does; embedding=None gives metadata_similarity's weighting
+def _combine_scores(embedding, diffs):
+    import numpy as np
+    if embedding is not None:
+        weights = WEIGHTS
+        components = np.column_stack([embedding] + [diffs[k] for k in _METADATA_WEIGHTS])
+    else:
+        weights = _METADATA_WEIGHTS
+        components = np.column_stack([diffs[k] for k in _METADATA_WEIGHTS])
+    w = np.array(list(weights.values()))
+    return components @ w / w.sum()
+
+# Scores many guesses against one clip in one go: the clip is embedded once,
+# all guesses' windows share forward passes, metadata comes from one query and
+# is compared as arrays. Returns a list aligned with guess_ids holding the
+# (score, orig_metadata, guess_metadata, metadata_diff) calculate_similarity
+# would return for each guess -- or metadata_similarity's, with embed=False --
+# and None for a guess that can't be scored (unknown slug, missing metadata or audio).
+def calculate_similarity_batch(orig_id, guess_ids, start_second, duration=15, embed=True, batch_size=BATCH_WINDOWS):
+    import numpy as np
+    catalog = get_catalog()
+    spotify_ids = [catalog.spotify_id_for_slug(g) for g in guess_ids]
+    orig_spotify_id = catalog.spotify_id_for_slug(orig_id)
+    metadata = get_metadata_by_spotify_ids([orig_spotify_id] + spotify_ids)
+    orig_metadata = metadata.get(orig_spotify_id)
+    if orig_metadata is None or any(orig_metadata[c] is None for c in FEATURE_COLUMNS):
+        raise ValueError(f"No metadata for {orig_id}")
+
+    scorable = [i for i, sid in enumerate(spotify_ids)
+                if sid in metadata and all(metadata[sid][c] is not None for c in FEATURE_COLUMNS)]
+    results = [None] * len(guess_ids)
+    if not scorable:
+        return results
+    guess_metadata = [metadata[spotify_ids[i]] for i in scorable]
+    diffs = _metadata_diff_arrays(orig_metadata, guess_metadata)
+
+    embedding = _embedding_scores(orig_id, [guess_ids[i] for i in scorable], start_second, duration, batch_size) if embed else None
+    scores = _combine_scores(embedding, diffs)
+
+    for row, i in enumerate(scorable):
+        if np.isnan(scores[row]):
+            continue
+        metadata_diff = {k: float(diffs[k][row]) for k in _METADATA_WEIGHTS}
+        results[i] = (float(scores[row]), orig_metadata, guess_metadata[row], metadata_diff)
+    return results
+
 # Example usage: calculate_similarity('blinding-lights', 'see-you-again', 10, 15)
@@ -0,0 +1,543 @@
+"""
+Embedded SQLite storage backend for single-node deployments and offline runs.
+
+SQLiteClient answers the same supabase-py calls the backend makes
+(table().select/eq/gt/in_/or_/order/limit/range/insert/update/upsert and
+rpc("record_game_events")), so app.py and supabase_helpers.py use it unchanged.
+Select it with
+
+    STORAGE_BACKEND=sqlite          (default: supabase)
+    SQLITE_PATH=backend/wics.db     (default)
+
+The schema mirrors supabase/migrations (songs with the typed feature and stem
+columns, users, game_events) with the same unique and keyset indexes. The
+database runs in WAL mode so readers never wait on the writer. Queries are
+built as parameterised SQL with stable text, so each pooled connection's
+statement cache reuses the compiled statement instead of re-preparing it.
+
+    python sqlite_store.py init [path]    # create an empty database
+    python sqlite_store.py pull [path]    # copy songs and users down from Supabase
+    python sqlite_store.py bench [n]      # per-query latency on n synthetic songs
+"""
+
+import json
+import os
+import queue
+import re
+import sqlite3
+import time
+import uuid
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+DEFAULT_PATH = os.path.join(os.path.dirname(__file__), "wics.db")
+
+_SCHEMA = """
+create table if not exists songs (
+  id text primary key,
+  spotify_id text,
+  title text not null,
+  artists text not null,
+  year integer,
+  metadata text,
+  url_original text not null,
+  created_at text not null,
+  key integer,
+  mode integer,
+  tempo real,
+  energy real,
+  valence real,
+  danceability real,
+  loudness real,
+  duration real,
+  url_drum text,
+  url_bass text,
+  url_piano text,
+  url_guitar text,
+  url_vocals text,
+  url_other text
+);
+create unique index if not exists songs_spotify_id_key on songs(spotify_id);
+create index if not exists songs_created_at_id_idx on songs(created_at desc, id desc);
+
+create table if not exists users (
+  id text primary key,
+  username text not null unique,
+  email text not null unique,
+  password_hash text not null,
+  elo_rating integer not null default 1200,
+  created_at text not null,
+  updated_at text
+);
+create trigger if not exists update_users_updated_at after update on users
+for each row when new.updated_at is old.updated_at begin
+  update users set updated_at = strftime('%Y-%m-%dT%H:%M:%f+00:00', 'now') where id = new.id;
+end;
+
+create table if not exists game_events (
+  id text primary key,
+  user_id text references users(id) on delete cascade,
+  actual_song_id text,
+  guessed_song_id text,
+  similarity_score integer,
+  is_correct integer,
+  stems_unmuted text not null default '[]',
+  elo_delta integer not null default 0,
+  elo_set integer,
+  created_at text not null
+);
+create index if not exists game_events_user_id_created_at_idx on game_events(user_id, created_at desc);
+"""
+
+COLUMNS = {
+    "songs": [
+        "id", "spotify_id", "title", "artists", "year", "metadata", "url_original", "created_at",
+        "key", "mode", "tempo", "energy", "valence", "danceability", "loudness", "duration",
+        "url_drum", "url_bass", "url_piano", "url_guitar", "url_vocals", "url_other",
+    ],
+    "users": ["id", "username", "email", "password_hash", "elo_rating", "created_at", "updated_at"],
+    "game_events": [
+        "id", "user_id", "actual_song_id", "guessed_song_id", "similarity_score",
+        "is_correct", "stems_unmuted", "elo_delta", "elo_set", "created_at",
+    ],
+}
+_JSON_COLUMNS = {"metadata", "stems_unmuted"}
+_BOOL_COLUMNS = {"is_correct"}
+_OPERATORS = {"eq": "=", "neq": "!=", "lt": "<", "lte": "<=", "gt": ">", "gte": ">="}
+
+
+def _now():
+    # Fixed-width, so text order is time order (what the keyset index relies on).
+    return datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%f+00:00")
+
+
+def _encode(column, value):
+    if column in _JSON_COLUMNS and value is not None and not isinstance(value, str):
+        return json.dumps(value)
+    if isinstance(value, bool):
+        return int(value)
+    return value
+
+
+def _decode(row):
+    out = dict(row)
+    for column in _JSON_COLUMNS.intersection(out):
+        if isinstance(out[column], str):
+            out[column] = json.loads(out[column])
+    for column in _BOOL_COLUMNS.intersection(out):
+        if out[column] is not None:
+            out[column] = bool(out[column])
+    return out
+
+
+def _split_top_level(text):
+    """Split a PostgREST logic list on commas that are not inside parentheses or quotes."""
+    parts, depth, quoted, current = [], 0, False, ""
+    for ch in text:
+        if ch == '"':
+            quoted = not quoted
+        elif not quoted and ch == "(":
+            depth += 1
+        elif not quoted and ch == ")":
+            depth -= 1
+        if ch == "," and depth == 0 and not quoted:
+            parts.append(current)
+            current = ""
+        else:
+            current += ch
+    parts.append(current)
+    return parts
+
+
+class SQLiteClient:
+    def __init__(self, path=DEFAULT_PATH):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._pool = queue.SimpleQueue()
+        conn = self._connect()
+        conn.executescript(_SCHEMA)
+        # Databases created before elo_set (migration 005) existed.
+        if "elo_set" not in {row["name"] for row in conn.execute("pragma table_info(game_events)")}:
+            conn.execute("alter table game_events add column elo_set integer")
+        self._pool.put(conn)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False,
+                               isolation_level=None, cached_statements=512)
+        conn.row_factory = sqlite3.Row
+        conn.execute("pragma journal_mode=wal")
+        conn.execute("pragma synchronous=normal")
+        conn.execute("pragma foreign_keys=on")
+        return conn
+
+    def _execute(self, fn):
+        """Run fn(conn) on a pooled connection; the pool grows to the number of concurrent callers."""
+        try:
+            conn = self._pool.get_nowait()
+        except queue.Empty:
+            conn = self._connect()
+        try:
+            return fn(conn)
+        finally:
+            self._pool.put(conn)
+
+    def table(self, name):
+        if name not in COLUMNS:
+            raise ValueError(f"unknown table {name!r}")
+        return _Query(self, name)
+
+    def rpc(self, name, params):
+        if name != "record_game_events":
+            raise ValueError(f"sqlite store has no function {name!r}")
+        events = params.get("events") or []
+        return _Result(lambda: self._execute(lambda conn: _record_game_events(conn, events)))
+
+    def close(self):
+        while True:
+            try:
+                self._pool.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+# game_events columns the Postgres function casts to uuid.
+_UUID_EVENT_COLUMNS = ("id", "user_id", "actual_song_id", "guessed_song_id")
+
+
+def _check_event_ids(values):
+    """Raise IntegrityError for an id Postgres would refuse to cast, so both backends reject the same events."""
+    for column in _UUID_EVENT_COLUMNS:
+        value = values.get(column)
+        if value is None:
+            continue
+        try:
+            uuid.UUID(str(value))
+        except ValueError:
+            raise sqlite3.IntegrityError(f"invalid uuid for game_events.{column}: {value!r}") from None
+
+
+def _record_game_events(conn, events):
+    """
+    Same contract as the Postgres function in migrations 003 and 005: skip known
+    ids, then apply each event in order, setting the rating for an elo_set event
+    and adding elo_delta otherwise. The whole batch rolls back if any event is
+    refused (a bad uuid or an unknown user_id), and the IntegrityError reaches
+    the caller, which bisects the batch and dead-letters the refused events
+    (see elo.WriteBehindBuffer).
+    """
+    columns = COLUMNS["game_events"]
+    insert = (f"insert into game_events ({', '.join(columns)}) values ({', '.join('?' for _ in columns)}) "
+              "on conflict(id) do nothing returning user_id, elo_delta, elo_set")
+    updated = 0
+    conn.execute("begin immediate")
+    try:
+        for event in events:
+            values = dict(event)
+            _check_event_ids(values)
+            values.setdefault("stems_unmuted", [])
+            values["elo_delta"] = values.get("elo_delta") or 0
+            values["created_at"] = values.get("created_at") or _now()
+            row = conn.execute(insert, [_encode(c, values.get(c)) for c in columns]).fetchone()
+            if row is None or row["user_id"] is None:
+                continue
+            if row["elo_set"] is not None:
+                updated += conn.execute("update users set elo_rating = ? where id = ?",
+                                        (row["elo_set"], row["user_id"])).rowcount
+            elif row["elo_delta"]:
+                updated += conn.execute("update users set elo_rating = elo_rating + ? where id = ?",
+                                        (row["elo_delta"], row["user_id"])).rowcount
+        conn.execute("commit")
+    except Exception:
+        conn.execute("rollback")
+        raise
+    return updated
+
+
+class _Result:
+    def __init__(self, fn):
+        self._fn = fn
+
+    def execute(self):
+        return SimpleNamespace(data=self._fn())
+
+
+class _Query:
+    def __init__(self, client, name):
+        self._client = client
+        self._name = name
+        self._columns = COLUMNS[name]
+        self._select = "*"
+        self._where = []
+        self._params = []
+        self._order = []
+        self._limit = None
+        self._offset = None
+        self._action = "select"
+        self._payload = None
+        self._on_conflict = None
+
+    def _column(self, name):
+        name = name.strip()
+        if name not in self._columns:
+            raise ValueError(f"unknown column {self._name}.{name}")
+        return name
+
+    # ----- builders -----
+
+    def select(self, columns="*"):
+        if columns.strip() != "*":
+            self._select = ", ".join(self._column(c) for c in columns.split(","))
+        return self
+
+    def _compare(self, column, op, value):
+        column = self._column(column)
+        self._where.append(f"{column} {_OPERATORS[op]} ?")
+        self._params.append(_encode(column, value))
+        return self
+
+    def eq(self, column, value):
+        return self._compare(column, "eq", value)
+
+    def neq(self, column, value):
+        return self._compare(column, "neq", value)
+
+    def gt(self, column, value):
+        return self._compare(column, "gt", value)
+
+    def gte(self, column, value):
+        return self._compare(column, "gte", value)
+
+    def lt(self, column, value):
+        return self._compare(column, "lt", value)
+
+    def lte(self, column, value):
+        return self._compare(column, "lte", value)
+
+    def in_(self, column, values):
+        column = self._column(column)
+        values = list(values)
+        if not values:
+            self._where.append("0")
+            return self
+        self._where.append(f"{column} in ({', '.join('?' for _ in values)})")
+        self._params.extend(_encode(column, v) for v in values)
+        return self
+
+    def _logic(self, text, joiner):
+        clauses = []
+        for part in _split_top_level(text):
+            part = part.strip()
+            m = re.fullmatch(r"(and|or)\((.*)\)", part)
+            if m:
+                clauses.append(self._logic(m.group(2), m.group(1)))
+                continue
+            column, op, value = part.split(".", 2)
+            if op not in _OPERATORS:
+                raise ValueError(f"unsupported filter operator {op!r}")
+            if len(value) >= 2 and value[0] == value[-1] == '"':
+                value = value[1:-1]
+            clauses.append(f"{self._column(column)} {_OPERATORS[op]} ?")
+            self._params.append(value)
+        return "(" + f" {joiner} ".join(clauses) + ")"
+
+    def or_(self, expression):
+        # Keyset filter "a.lt.x,and(a.eq.x,b.lt.y)": as a row-value comparison SQLite
+        # seeks straight to the cursor in the (a, b) index instead of scanning from the top.
+        m = re.fullmatch(r'(\w+)\.(lt|gt)\.("[^"]*"|[^,()]*),and\(\1\.eq\.\3,(\w+)\.\2\.("[^"]*"|[^,()]*)\)',
+                         expression.strip())
+        if m:
+            a, op, x, b, y = m.groups()
+            self._where.append(f"({self._column(a)}, {self._column(b)}) {_OPERATORS[op]} (?, ?)")
+            self._params.extend(v[1:-1] if v.startswith('"') else v for v in (x, y))
+            return self
+        self._where.append(self._logic(expression, "or"))
+        return self
+
+    def order(self, column, desc=False):
+        self._order.append(f"{self._column(column)} {'desc' if desc else 'asc'}")
+        return self
+
+    def limit(self, n):
+        self._limit = int(n)
+        return self
+
+    def range(self, start, end):
+        self._offset = int(start)
+        self._limit = int(end) - int(start) + 1
+        return self
+
+    def insert(self, rows):
+        self._action, self._payload = "insert", rows
+        return self
+
+    def update(self, values):
+        self._action, self._payload = "update", values
+        return self
+
+    def upsert(self, rows, on_conflict=None):
+        self._action, self._payload = "upsert", rows
+        self._on_conflict = self._column(on_conflict or "id")
+        return self
+
+    # ----- execution -----
+
+    def _where_sql(self):
+        return f" where {' and '.join(self._where)}" if self._where else ""
+
+    def _write(self, conn, rows):
+        out = []
+        for row in rows:
+            values = dict(row)
+            values.setdefault("id", str(uuid.uuid4()))
+            values.setdefault("created_at", _now())
+            if "updated_at" in self._columns:
+                values.setdefault("updated_at", values["created_at"])
+            columns = [self._column(c) for c in values]
+            sql = (f"insert into {self._name} ({', '.join(columns)}) "
+                   f"values ({', '.join('?' for _ in columns)})")
+            if self._action == "upsert":
+                # Only the caller's columns are overwritten; id and created_at stay as first inserted.
+                updates = [c for c in row if c not in ("id", "created_at", self._on_conflict)]
+                sql += f" on conflict({self._on_conflict}) do " + (
+                    f"update set {', '.join(f'{c} = excluded.{c}' for c in updates)}" if updates else "nothing")
+            sql += " returning *"
+            found = conn.execute(sql, [_encode(c, values[c]) for c in columns]).fetchone()
+            if found is None:
+                found = conn.execute(f"select * from {self._name} where {self._on_conflict} = ?",
+                                     (_encode(self._on_conflict, values[self._on_conflict]),)).fetchone()
+            out.append(_decode(found))
+        return out
+
+    def _run(self, conn):
+        if self._action == "select":
+            sql = f"select {self._select} from {self._name}{self._where_sql()}"
+            if self._order:
+                sql += " order by " + ", ".join(self._order)
+            if self._limit is not None or self._offset is not None:
+                sql += " limit ? offset ?"
+                params = self._params + [-1 if self._limit is None else self._limit, self._offset or 0]
+            else:
+                params = self._params
+            return [_decode(r) for r in conn.execute(sql, params).fetchall()]
+        if self._action == "update":
+            columns = [self._column(c) for c in self._payload]
+            sql = (f"update {self._name} set {', '.join(f'{c} = ?' for c in columns)}"
+                   f"{self._where_sql()} returning *")
+            params = [_encode(c, self._payload[c]) for c in columns] + self._params
+            return [_decode(r) for r in conn.execute(sql, params).fetchall()]
+        rows = self._payload if isinstance(self._payload, list) else [self._payload]
+        if len(rows) == 1:
+            return self._write(conn, rows)
+        conn.execute("begin immediate")
+        try:
+            out = self._write(conn, rows)
+            conn.execute("commit")
+        except Exception:
+            conn.execute("rollback")
+            raise
+        return out
+
+    def execute(self):
+        return SimpleNamespace(data=self._client._execute(self._run))
+
+
+def pull(path=DEFAULT_PATH, page_size=1000):
+    """Copy the songs and users tables from Supabase into a local database. Returns row counts."""
+    from supabase import create_client
+    from supabase_helpers import SUPABASE_KEY, SUPABASE_URL
+
+    if not SUPABASE_URL or not SUPABASE_KEY:
+        raise RuntimeError("SUPABASE_URL and SUPABASE_KEY (or SUPABASE_SERVICE_ROLE_KEY) must be set")
+    remote = create_client(SUPABASE_URL, SUPABASE_KEY)
+    local = SQLiteClient(path)
+    counts = {}
+    for name in ("songs", "users"):
+        counts[name] = 0
+        start = 0
+        while True:
+            rows = remote.table(name).select("*").order("id").range(start, start + page_size - 1).execute().data or []
+            rows = [{k: v for k, v in row.items() if k in COLUMNS[name]} for row in rows]
+            if rows:
+                local.table(name).upsert(rows, on_conflict="id").execute()
+            counts[name] += len(rows)
+            if len(rows) < page_size:
+                break
+            start += page_size
+    local.close()
+    return counts
+
+
+def bench(n=10000):
+    """Median/p99 latency of the queries the API makes, against a temporary database of n songs."""
+    import random
+    import tempfile
+
+    path = os.path.join(tempfile.mkdtemp(prefix="sqlite-bench-"), "bench.db")
+    client = SQLiteClient(path)
+    rng = random.Random(0)
+    songs = [{
+        "spotify_id": f"sp{i:08d}", "title": f"Song {i}", "artists": f"Artist {i % 500}", "year": 1970 + i % 55,
+        "url_original": f"https://bucket.s3.amazonaws.com/songs/{i}.wav", "duration": 180.0,
+        "key": rng.randrange(12), "mode": rng.randrange(2), "tempo": rng.uniform(70, 170),
+        "energy": rng.random(), "valence": rng.random(), "danceability": rng.random(), "loudness": -6.0,
+    } for i in range(n)]
+    start = time.perf_counter()
+    for i in range(0, n, 1000):
+        client.table("songs").insert(songs[i:i + 1000]).execute()
+    load_seconds = time.perf_counter() - start
+    client.table("users").insert({"username": "bench", "email": "bench@example.com", "password_hash": "x"}).execute()
+
+    ids = [r["id"] for r in client.table("songs").select("id").limit(1000).execute().data]
+    # A cursor halfway down the list, so the keyset page can't get away with a scan from the top.
+    cursor = client.table("songs").select("id, created_at").order("created_at", desc=True) \
+        .order("id", desc=True).range(n // 2, n // 2).execute().data[0]
+    song_columns = ("id, spotify_id, title, artists, year, duration, created_at, url_original, "
+                    "url_drum, url_bass, url_piano, url_guitar, url_vocals, url_other")
+    queries = {
+        "song_by_spotify_id": lambda: client.table("songs").select(song_columns)
+            .eq("spotify_id", f"sp{rng.randrange(n):08d}").limit(1).execute(),
+        "features_by_spotify_id": lambda: client.table("songs")
+            .select("key, mode, tempo, energy, valence, danceability, loudness")
+            .eq("spotify_id", f"sp{rng.randrange(n):08d}").limit(1).execute(),
+        "two_songs_by_id": lambda: client.table("songs").select(song_columns)
+            .in_("id", rng.sample(ids, 2)).execute(),
+        "keyset_page_50_mid": lambda: client.table("songs").select(song_columns)
+            .order("created_at", desc=True).order("id", desc=True).limit(50)
+            .or_(f'created_at.lt."{cursor["created_at"]}",and(created_at.eq."{cursor["created_at"]}",'
+                 f'id.lt.{cursor["id"]})').execute(),
+        "user_by_username": lambda: client.table("users").select("*").eq("username", "bench").execute(),
+    }
+    results = {"songs": n, "load_seconds": round(load_seconds, 3)}
+    for name, fn in queries.items():
+        for _ in range(50):
+            fn()
+        timings = []
+        for _ in range(2000):
+            t = time.perf_counter()
+            fn()
+            timings.append(time.perf_counter() - t)
+        timings.sort()
+        results[name] = {"p50_us": round(timings[len(timings) // 2] * 1e6, 1),
+                         "p99_us": round(timings[int(len(timings) * 0.99)] * 1e6, 1)}
+    client.close()
+    return results
+
+
+if __name__ == "__main__":
+    import sys
+    command = sys.argv[1] if len(sys.argv) > 1 else None
+    if command == "init":
+        path = sys.argv[2] if len(sys.argv) > 2 else DEFAULT_PATH
+        SQLiteClient(path).close()
+        print(f"Created {path}")
+    elif command == "pull":
+        path = sys.argv[2] if len(sys.argv) > 2 else DEFAULT_PATH
+        print(json.dumps(pull(path), indent=2))
+    elif command == "bench":
+        print(json.dumps(bench(int(sys.argv[2]) if len(sys.argv) > 2 else 10000), indent=2))
+    else:
+        print("Usage:")
+        print("  python sqlite_store.py init [path]")
+        print("  python sqlite_store.py pull [path]")
+        print("  python sqlite_store.py bench [n_songs]")
+        sys.exit(1)
@@ -1,5 +1,5 @@
 import os
-import re
+import threading
 
 try:
     from dotenv import load_dotenv
@@ -10,26 +10,68 @@ except ImportError:
 
 SUPABASE_URL = os.environ.get("SUPABASE_URL")
 SUPABASE_KEY = os.environ.get("SUPABASE_SERVICE_ROLE_KEY") or os.environ.get("SUPABASE_KEY")
+# "supabase" (default) or "sqlite" for an embedded database at SQLITE_PATH (see sqlite_store.py).
+STORAGE_BACKEND = os.environ.get("STORAGE_BACKEND", "supabase").lower()
+SQLITE_PATH = os.environ.get("SQLITE_PATH") or None
 _supabase = None
+_client_lock = threading.Lock()
+
+# Typed audio-feature columns on songs (see supabase/migrations/004_add_song_feature_columns.sql).
+FEATURE_COLUMNS = ["key", "mode", "tempo", "energy", "valence", "danceability", "loudness"]
 
 
 def _client():
     global _supabase
-    if _supabase is None:
-        if not SUPABASE_URL or not SUPABASE_KEY:
-            raise RuntimeError("SUPABASE_URL and SUPABASE_KEY (or SUPABASE_SERVICE_ROLE_KEY) must be set")
-        from supabase import create_client
-        _supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
+    if _supabase is not None:
+        return _supabase
+    with _client_lock:
+        if _supabase is None:
+            if STORAGE_BACKEND == "sqlite":
+                from sqlite_store import DEFAULT_PATH, SQLiteClient
+                _supabase = SQLiteClient(SQLITE_PATH or DEFAULT_PATH)
+                return _supabase
+            if not SUPABASE_URL or not SUPABASE_KEY:
+                raise RuntimeError("SUPABASE_URL and SUPABASE_KEY (or SUPABASE_SERVICE_ROLE_KEY) must be set")
+            from supabase import create_client
+            _supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
     return _supabase
 
 
+def feature_columns(metadata: dict | None):
+    """Typed column values for the audio features in a ReccoBeats metadata dict."""
+    if not metadata:
+        return {}
+    return {k: metadata[k] for k in FEATURE_COLUMNS if metadata.get(k) is not None}
+
+
 def get_metadata_by_spotify_id(spotify_id: str):
+    """Audio features for a song as a dict keyed by FEATURE_COLUMNS, or None if not found."""
     client = _client()
-    r = client.table("songs").select("metadata").eq("spotify_id", spotify_id).execute()
+    r = client.table("songs").select(",".join(FEATURE_COLUMNS)).eq("spotify_id", spotify_id).limit(1).execute()
     rows = r.data or []
     if not rows:
         return None
-    return rows[0].get("metadata")
+    return rows[0]
+
+
+def get_metadata_by_spotify_ids(spotify_ids):
+    """{spotify_id: audio features} for many songs in one query; ids not found are left out."""
+    spotify_ids = list(dict.fromkeys(i for i in spotify_ids if i))
+    if not spotify_ids:
+        return {}
+    client = _client()
+    r = client.table("songs").select(",".join(["spotify_id"] + FEATURE_COLUMNS)).in_("spotify_id", spotify_ids).execute()
+    return {row["spotify_id"]: {k: row.get(k) for k in FEATURE_COLUMNS} for row in (r.data or [])}
+
+
+def get_song(*, song_id: str | None = None, spotify_id: str | None = None,
+             columns: str = "id, spotify_id, title, artists, duration, url_original"):
+    """One songs row by id or spotify_id, with only the given columns. None if not found."""
+    client = _client()
+    query = client.table("songs").select(columns)
+    query = query.eq("id", song_id) if song_id is not None else query.eq("spotify_id", spotify_id)
+    rows = query.limit(1).execute().data or []
+    return rows[0] if rows else None
 
 
 def get_elo_rating(user_id: str):
@@ -50,6 +92,32 @@ def set_elo_rating(user_id: str, elo_rating: int):
     return rows[0].get("elo_rating")
 
 
+def record_game_events(events: list[dict]):
+    """
+    Persist a batch of game events and apply their ELO deltas and set-to values
+    in one round trip (see supabase/migrations/003_create_game_events_table.sql
+    and 005_add_game_event_elo_set.sql). Events whose id
+    was already recorded are ignored, so re-sending a batch is safe.
+    """
+    if not events:
+        return 0
+    client = _client()
+    r = client.rpc("record_game_events", {"events": events}).execute()
+    return r.data
+
+
+def get_existing_songs(spotify_ids: list[str], chunk_size: int = 200):
+    """{spotify_id: {"id", "url_original"}} for the ids that already have a songs row."""
+    client = _client()
+    found = {}
+    for start in range(0, len(spotify_ids), chunk_size):
+        chunk = spotify_ids[start:start + chunk_size]
+        r = client.table("songs").select("id, spotify_id, url_original").in_("spotify_id", chunk).execute()
+        for row in r.data or []:
+            found[row["spotify_id"]] = {"id": row["id"], "url_original": row["url_original"]}
+    return found
+
+
 def insert_song(
     *,
     spotify_id: str | None = None,
@@ -58,6 +126,7 @@ def insert_song(
     year: int | None = None,
     metadata: dict | None = None,
     url_original: str,
+    duration: float | None = None,
 ):
     client = _client()
     row = {
@@ -71,55 +140,36 @@ def insert_song(
         row["year"] = year
     if metadata is not None:
         row["metadata"] = metadata
-    r = client.table("songs").insert(row).execute()
+        row.update(feature_columns(metadata))
+    if duration is not None:
+        row["duration"] = duration
+    if spotify_id is not None:
+        # spotify_id is unique, so re-ingesting a song updates its row instead of failing.
+        r = client.table("songs").upsert(row, on_conflict="spotify_id").execute()
+    else:
+        r = client.table("songs").insert(row).execute()
     rows = r.data or []
     if not rows:
         return None
     return rows[0]
 
 
-def load_songs_from_txt(txt_path: str, bucket: str | None = None):
-    from download_song import download_and_upload_to_s3
-    from recco_beats import get_metadata_for_track
+def load_songs_from_txt(txt_path: str, bucket: str | None = None, *, dry_run: bool = False, checkpoint_path: str | None = None):
+    """
+    Download, upload and insert every song listed in txt_path (lines of
+    'title, artist, year, spotify_id') using the staged pipeline in
+    ingest_pipeline.py. Returns the inserted rows.
+    """
+    from ingest_pipeline import ingest
 
     if bucket is None:
         bucket = os.environ.get("AWS_S3_BUCKET") or os.environ.get("S3_BUCKET")
-    if not bucket:
+    if not bucket and not dry_run:
         raise RuntimeError("S3 bucket required: set AWS_S3_BUCKET or S3_BUCKET or pass bucket=")
 
-    inserted = []
-    with open(txt_path) as f:
-        for line in f:
-            line = line.strip()
-            if not line:
-                continue
-            parts = [p.strip() for p in line.rsplit(",", 3)]
-            if len(parts) != 4:
-                continue
-            title, artist, year_str, spotify_id = parts
-            try:
-                year = int(year_str)
-            except ValueError:
-                continue
-            song_name = f"{title} {artist}"
-            # object_name = f"{spotify_id}.wav"
-            slug = re.sub(r"[^a-z0-9-]", "", title.lower().replace(" ", "-"))
-            object_name = f"{slug}.wav" if slug else f"{spotify_id}.wav"
-            url_original = download_and_upload_to_s3(song_name, bucket, object_name)
-            if url_original is None:
-                continue
-            metadata = get_metadata_for_track(spotify_id)
-            row = insert_song(
-                spotify_id=spotify_id,
-                title=title,
-                artists=artist,
-                year=year,
-                metadata=metadata,
-                url_original=url_original,
-            )
-            if row is not None:
-                inserted.append(row)
-    return inserted
+    completed, stats = ingest(txt_path, bucket, dry_run=dry_run, checkpoint_path=checkpoint_path)
+    print(f"Ingest: {stats['total']}")
+    return [item["row"] for item in completed if item.get("row") is not None]
 
 
 if __name__ == "__main__":
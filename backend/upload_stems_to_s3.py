@@ -10,6 +10,9 @@ import os
 # Order matters: "vocals" before "vocal" so we match the full word first.
 INSTRUMENTS = ["drums", "piano", "vocals", "bass", "guitar", "other"]
 
+# songs table column holding each instrument's stem URL.
+STEM_URL_COLUMNS = {"drums": "url_drum", "bass": "url_bass", "piano": "url_piano", "guitar": "url_guitar", "vocals": "url_vocals", "other": "url_other"}
+
 
 def _instrument_from_filename(filename):
     """Return the instrument key if the filename suggests one, else None."""
@@ -20,10 +23,23 @@ def _instrument_from_filename(filename):
     return None
 
 
-def upload_stems_to_s3(folder_name, object_name, bucket, downloads_root="downloads"):
+def stem_urls_from_original(url_original):
+    """
+    Public stem URLs for a song, derived from its url_original the same way
+    upload_stems_to_s3 names objects: <base>-drums.wav, <base>-bass.wav, ...
+    Returns a dict keyed by the songs table column (url_drum, url_bass, ...).
+    """
+    if not url_original or not url_original.strip():
+        return {}
+    base = url_original.rsplit(".", 1)[0] if "." in url_original else url_original
+    return {STEM_URL_COLUMNS[inst]: f"{base}-{inst}.wav" for inst in INSTRUMENTS}
+
+
+def upload_stems_to_s3(folder_name, object_name, bucket, downloads_root="downloads", skip_unchanged=True, max_workers=6):
     """
     Upload all stem files in a downloads subfolder to S3, with the instrument
     appended to the object name (e.g. object_name="song" -> song-drums.wav, song-piano.wav).
+    Stems are uploaded concurrently through the shared S3 client.
 
     Parameters
     ----------
@@ -36,20 +52,29 @@ def upload_stems_to_s3(folder_name, object_name, bucket, downloads_root="downloa
         S3 bucket name.
     downloads_root : str
         Root folder for downloads; default "downloads".
+    skip_unchanged : bool
+        Don't re-upload stems whose S3 object already has the same content (ETag).
+    max_workers : int
+        Number of stems uploaded at the same time.
 
     Returns
     -------
     dict
-        {"uploaded": [(local_path, s3_key), ...], "skipped": [path, ...]}
+        {"uploaded": [(local_path, s3_key), ...], "unchanged": [(local_path, s3_key), ...],
+         "skipped": [path, ...], "failed": [path, ...]}; skipped files matched no instrument,
+        unchanged ones were already in S3 with the same content
     """
+    from concurrent.futures import ThreadPoolExecutor
     import aws
 
     folder_path = os.path.join(downloads_root, folder_name)
     if not os.path.isdir(folder_path):
         raise FileNotFoundError(f"Folder not found: {folder_path}")
 
-    object_name = object_name.rstrip("/").rstrip(".wav")
-    uploaded = []
+    object_name = object_name.rstrip("/")
+    if object_name.lower().endswith(".wav"):
+        object_name = object_name[:-len(".wav")]
+    uploads = []
     skipped = []
 
     for filename in os.listdir(folder_path):
@@ -63,17 +88,27 @@ def upload_stems_to_s3(folder_name, object_name, bucket, downloads_root="downloa
         if instrument is None:
             skipped.append(local_path)
             continue
-
-        s3_key = f"{object_name}-{instrument}.wav"
-        if aws.upload_file(local_path, bucket, s3_key):
-            uploaded.append((local_path, s3_key))
-            print(f"Uploaded {filename} -> s3://{bucket}/{s3_key}")
-        else:
-            skipped.append(local_path)
-
+        uploads.append((local_path, f"{object_name}-{instrument}.wav"))
+
+    uploaded, unchanged, failed = [], [], []
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        results = pool.map(lambda u: aws.upload_file(u[0], bucket, u[1], skip_unchanged=skip_unchanged), uploads)
+        for (local_path, s3_key), status in zip(uploads, results):
+            if status == aws.UPLOADED:
+                uploaded.append((local_path, s3_key))
+                print(f"Uploaded {os.path.basename(local_path)} -> s3://{bucket}/{s3_key}")
+            elif status == aws.UNCHANGED:
+                unchanged.append((local_path, s3_key))
+            else:
+                failed.append(local_path)
+
+    if unchanged:
+        print(f"Unchanged in S3, not uploaded: {[os.path.basename(p) for p, _ in unchanged]}")
     if skipped:
-        print(f"Skipped (no instrument match or upload failed): {[os.path.basename(p) for p in skipped]}")
-    return {"uploaded": uploaded, "skipped": skipped}
+        print(f"Skipped (no instrument match): {[os.path.basename(p) for p in skipped]}")
+    if failed:
+        print(f"Upload failed: {[os.path.basename(p) for p in failed]}")
+    return {"uploaded": uploaded, "unchanged": unchanged, "skipped": skipped, "failed": failed}
 
 
 if __name__ == "__main__":
@@ -88,5 +123,6 @@ if __name__ == "__main__":
     object_name = sys.argv[2]
     bucket = "wics-2026-audio"
     result = upload_stems_to_s3(folder_name, object_name, bucket)
-    print(f"Done: {len(result['uploaded'])} uploaded, {len(result['skipped'])} skipped")
-    sys.exit(0 if result["uploaded"] else 1)
+    print(f"Done: {len(result['uploaded'])} uploaded, {len(result['unchanged'])} unchanged, "
+          f"{len(result['skipped'])} skipped, {len(result['failed'])} failed")
+    sys.exit(0 if (result["uploaded"] or result["unchanged"]) and not result["failed"] else 1)
@@ -606,19 +606,29 @@ function WavPlayer() {
       const response = await axios.post(`${API_URL}/guess`, {
         actual_song_id: randomSong.id,
         guessed_song_id: guessedSongId,
-        clip_start_time: randomSong.clip_start_time || 0
+        clip_start_time: randomSong.clip_start_time || 0,
+        user_id: user ? user.id : null,
+        stems_unmuted: Object.keys(stemsUnmuted)
       });
       setSimilarityData(response.data);
       
-      // Calculate ELO change once when results arrive
-      const baseScore = response.data.similarity_score;
-      const nonVocalStems = Object.keys(stemsUnmuted).filter(stem => stem !== 'Vocals').length;
-      const vocalsUnmuted = stemsUnmuted['Vocals'] ? 1 : 0;
-      const finalPoints = baseScore - (nonVocalStems * POINTS_PER_NON_VOCAL_STEM) - (vocalsUnmuted * POINTS_FOR_VOCALS);
-      const newElo = currentElo + finalPoints;
-      
-      setCalculatedNewElo(newElo);
-      setEloChange(finalPoints);
+      // Unrated guesses (server busy or scoring failed) don't move the ELO.
+      // The backend computes and stores the change for signed-in users; guests
+      // get a local estimate.
+      if (response.data.rated === false) {
+        setCalculatedNewElo(null);
+        setEloChange(null);
+      } else if (user) {
+        setCalculatedNewElo(response.data.elo_rating ?? null);
+        setEloChange(response.data.elo_change ?? null);
+      } else {
+        const baseScore = response.data.similarity_score;
+        const nonVocalStems = Object.keys(stemsUnmuted).filter(stem => stem !== 'Vocals').length;
+        const vocalsUnmuted = stemsUnmuted['Vocals'] ? 1 : 0;
+        const finalPoints = baseScore - (nonVocalStems * POINTS_PER_NON_VOCAL_STEM) - (vocalsUnmuted * POINTS_FOR_VOCALS);
+        setCalculatedNewElo(currentElo + finalPoints);
+        setEloChange(finalPoints);
+      }
     } catch (err) {
       console.error('Error fetching similarity data:', err);
       setResultsError('Failed to fetch similarity data');
@@ -628,25 +638,14 @@ function WavPlayer() {
   };
 
   const handleCloseModal = async () => {
-    // Update ELO using the pre-calculated value
+    // The backend already saved the new ELO when the guess was submitted;
+    // unrated guesses leave calculatedNewElo null and change nothing.
     if (calculatedNewElo !== null && user) {
-      // Update local state
       setCurrentElo(calculatedNewElo);
       
-      // Update ELO on backend
-      try {
-        await axios.patch(`${API_URL}/users/${user.id}/elo`, {
-          elo_rating: calculatedNewElo
-        });
-        
-        // Update user in localStorage to persist the new ELO
-        const updatedUser = { ...user, elo_rating: calculatedNewElo };
-        localStorage.setItem('user', JSON.stringify(updatedUser));
-        
-        console.log('ELO updated successfully:', calculatedNewElo);
-      } catch (error) {
-        console.error('Error updating ELO:', error);
-      }
+      // Update user in localStorage to persist the new ELO
+      const updatedUser = { ...user, elo_rating: calculatedNewElo };
+      localStorage.setItem('user', JSON.stringify(updatedUser));
     }
     
     setResultsModalOpen(false);
@@ -920,6 +919,7 @@ function WavPlayer() {
 
                   {(() => {
                     // Use pre-calculated values to avoid double-calculation
+                    const rated = eloChange !== null;
                     const finalPoints = eloChange || 0;
                     const newElo = calculatedNewElo || currentElo;
                     
@@ -963,6 +963,11 @@ function WavPlayer() {
                           <p style={{ margin: '10px 0 0 0', fontSize: '1rem', color: '#333', textAlign: 'center', fontFamily: '"Courier Prime", monospace' }}>
                             {similarityData.message}
                           </p>
+                          {similarityData.degraded && (
+                            <p style={{ margin: '8px 0 0 0', fontSize: '0.85rem', color: '#8a5a00', textAlign: 'center', fontFamily: '"Courier Prime", monospace' }}>
+                              Server busy: this score is based on song metadata only.
+                            </p>
+                          )}
                         </div>
                         
                         <div style={{ 
@@ -989,30 +994,46 @@ function WavPlayer() {
                             </span>
                           </div>
                           
-                          <div style={{ 
-                            display: 'flex', 
-                            justifyContent: 'space-between',
-                            alignItems: 'center',
-                            padding: '15px 0',
-                            borderBottom: '2px solid #e9ecef'
-                          }}>
-                            <span style={{ fontSize: '1.1rem', fontWeight: 600, color: '#495057', fontFamily: '"Courier Prime", monospace' }}>ELO Gained</span>
-                            <span style={{ fontSize: '1.3rem', fontWeight: 'bold', color: eloColor, fontFamily: '"Courier Prime", monospace' }}>
-                              {eloDisplay}
-                            </span>
-                          </div>
-                          
-                          <div style={{ 
-                            display: 'flex', 
-                            justifyContent: 'space-between',
-                            alignItems: 'center',
-                            padding: '15px 0'
-                          }}>
-                            <span style={{ fontSize: '1.1rem', fontWeight: 600, color: '#495057', fontFamily: '"Courier Prime", monospace' }}>New Overall ELO</span>
-                            <span style={{ fontSize: '1.3rem', fontWeight: 'bold', color: '#333', fontFamily: '"Courier Prime", monospace' }}>
-                              {newElo}
-                            </span>
-                          </div>
+                          {rated ? (
+                            <>
+                              <div style={{ 
+                                display: 'flex', 
+                                justifyContent: 'space-between',
+                                alignItems: 'center',
+                                padding: '15px 0',
+                                borderBottom: '2px solid #e9ecef'
+                              }}>
+                                <span style={{ fontSize: '1.1rem', fontWeight: 600, color: '#495057', fontFamily: '"Courier Prime", monospace' }}>ELO Gained</span>
+                                <span style={{ fontSize: '1.3rem', fontWeight: 'bold', color: eloColor, fontFamily: '"Courier Prime", monospace' }}>
+                                  {eloDisplay}
+                                </span>
+                              </div>
+                              
+                              <div style={{ 
+                                display: 'flex', 
+                                justifyContent: 'space-between',
+                                alignItems: 'center',
+                                padding: '15px 0'
+                              }}>
+                                <span style={{ fontSize: '1.1rem', fontWeight: 600, color: '#495057', fontFamily: '"Courier Prime", monospace' }}>New Overall ELO</span>
+                                <span style={{ fontSize: '1.3rem', fontWeight: 'bold', color: '#333', fontFamily: '"Courier Prime", monospace' }}>
+                                  {newElo}
+                                </span>
+                              </div>
+                            </>
+                          ) : (
+                            <div style={{ 
+                              display: 'flex', 
+                              justifyContent: 'space-between',
+                              alignItems: 'center',
+                              padding: '15px 0'
+                            }}>
+                              <span style={{ fontSize: '1.1rem', fontWeight: 600, color: '#495057', fontFamily: '"Courier Prime", monospace' }}>ELO</span>
+                              <span style={{ fontSize: '1.3rem', fontWeight: 'bold', color: '#9ca3af', fontFamily: '"Courier Prime", monospace' }}>
+                                Not rated
+                              </span>
+                            </div>
+                          )}
                         </div>
                       </div>
                     );
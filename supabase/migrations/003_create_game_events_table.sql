@@ -0,0 +1,57 @@
+-- Per-guess game events, written in batches by the backend's write-behind buffer
+create table if not exists public.game_events (
+  id uuid primary key,
+  user_id uuid references public.users(id) on delete cascade,
+  actual_song_id uuid,
+  guessed_song_id uuid,
+  similarity_score integer,
+  is_correct boolean,
+  stems_unmuted jsonb not null default '[]'::jsonb,
+  elo_delta integer not null default 0,
+  created_at timestamptz default now()
+);
+
+comment on table public.game_events is 'One row per guess (or manual ELO adjustment) with the ELO delta it applied';
+comment on column public.game_events.elo_delta is 'Change applied to users.elo_rating when the event was recorded';
+
+create index if not exists game_events_user_id_created_at_idx on public.game_events(user_id, created_at desc);
+
+-- Insert a batch of events and apply their ELO deltas atomically.
+-- Events that were already recorded (same id) are skipped, so a batch replayed
+-- from the backend journal after a crash is not counted twice.
+-- Returns the number of users whose rating changed.
+create or replace function public.record_game_events(events jsonb)
+returns integer as $$
+declare
+  updated integer;
+begin
+  with inserted as (
+    insert into public.game_events (
+      id, user_id, actual_song_id, guessed_song_id, similarity_score,
+      is_correct, stems_unmuted, elo_delta, created_at
+    )
+    select
+      e.id, e.user_id, e.actual_song_id, e.guessed_song_id, e.similarity_score,
+      e.is_correct, coalesce(e.stems_unmuted, '[]'::jsonb), coalesce(e.elo_delta, 0), coalesce(e.created_at, now())
+    from jsonb_to_recordset(events) as e(
+      id uuid, user_id uuid, actual_song_id uuid, guessed_song_id uuid, similarity_score integer,
+      is_correct boolean, stems_unmuted jsonb, elo_delta integer, created_at timestamptz
+    )
+    on conflict (id) do nothing
+    returning user_id, elo_delta
+  ),
+  totals as (
+    select user_id, sum(elo_delta) as delta
+    from inserted
+    where user_id is not null
+    group by user_id
+  )
+  update public.users u
+  set elo_rating = u.elo_rating + t.delta
+  from totals t
+  where u.id = t.user_id and t.delta <> 0;
+
+  get diagnostics updated = row_count;
+  return updated;
+end;
+$$ language plpgsql;
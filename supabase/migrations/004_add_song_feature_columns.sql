@@ -0,0 +1,45 @@
+-- Typed audio-feature and stem columns on songs, plus indexes for the lookups the backend does.
+-- Run backend/backfill_song_columns.py afterwards to fill duration and stem URLs.
+alter table public.songs
+  add column if not exists key smallint,
+  add column if not exists mode smallint,
+  add column if not exists tempo real,
+  add column if not exists energy real,
+  add column if not exists valence real,
+  add column if not exists danceability real,
+  add column if not exists loudness real,
+  add column if not exists duration real,
+  add column if not exists url_drum text,
+  add column if not exists url_bass text,
+  add column if not exists url_piano text,
+  add column if not exists url_guitar text,
+  add column if not exists url_vocals text,
+  add column if not exists url_other text;
+
+comment on column public.songs.key is 'Pitch class 0-11 (ReccoBeats audio features)';
+comment on column public.songs.mode is '1 = major, 0 = minor';
+comment on column public.songs.tempo is 'Beats per minute';
+comment on column public.songs.loudness is 'Average loudness in dB';
+comment on column public.songs.duration is 'Length of url_original in seconds';
+
+-- Copy features out of the metadata jsonb for existing rows.
+update public.songs set
+  key = coalesce(key, (metadata->>'key')::smallint),
+  mode = coalesce(mode, (metadata->>'mode')::smallint),
+  tempo = coalesce(tempo, (metadata->>'tempo')::real),
+  energy = coalesce(energy, (metadata->>'energy')::real),
+  valence = coalesce(valence, (metadata->>'valence')::real),
+  danceability = coalesce(danceability, (metadata->>'danceability')::real),
+  loudness = coalesce(loudness, (metadata->>'loudness')::real)
+where metadata is not null;
+
+-- Re-running ingest used to insert the same track again; keep the oldest row
+-- per spotify_id so the unique index below can be built.
+delete from public.songs s
+using public.songs older
+where s.spotify_id is not null
+  and s.spotify_id = older.spotify_id
+  and (older.created_at, older.id) < (s.created_at, s.id);
+
+create unique index if not exists songs_spotify_id_key on public.songs(spotify_id);
+create index if not exists songs_created_at_id_idx on public.songs(created_at desc, id desc);
@@ -0,0 +1,48 @@
+-- Absolute ELO adjustments (PATCH /api/users/<id>/elo) recorded as "set to" events.
+-- A worker's in-memory rating can be stale when several workers serve the same
+-- user, so a delta computed from it would land the user on the wrong rating;
+-- the function below sets elo_set outright instead.
+alter table public.game_events
+  add column if not exists elo_set integer;
+
+comment on column public.game_events.elo_set is 'Rating the user was set to by a manual adjustment (elo_delta is then informational)';
+
+-- Insert a batch of events and apply them to users.elo_rating atomically, in
+-- batch order, so a set-to event and the deltas around it resolve in the order
+-- they were recorded. Events that were already recorded (same id) are skipped,
+-- so a batch replayed from the backend journal after a crash is not counted twice.
+-- Returns the number of rating updates applied.
+create or replace function public.record_game_events(events jsonb)
+returns integer as $$
+declare
+  item jsonb;
+  e public.game_events;
+  updated integer := 0;
+  changed integer;
+begin
+  for item in select value from jsonb_array_elements(events) with ordinality as a(value, n) order by n loop
+    e := jsonb_populate_record(null::public.game_events, item);
+    insert into public.game_events (
+      id, user_id, actual_song_id, guessed_song_id, similarity_score,
+      is_correct, stems_unmuted, elo_delta, elo_set, created_at
+    ) values (
+      e.id, e.user_id, e.actual_song_id, e.guessed_song_id, e.similarity_score,
+      e.is_correct, coalesce(e.stems_unmuted, '[]'::jsonb), coalesce(e.elo_delta, 0), e.elo_set, coalesce(e.created_at, now())
+    )
+    on conflict (id) do nothing;
+    if not found or e.user_id is null then
+      continue;
+    end if;
+    if e.elo_set is not null then
+      update public.users set elo_rating = e.elo_set where id = e.user_id;
+    elsif coalesce(e.elo_delta, 0) <> 0 then
+      update public.users set elo_rating = elo_rating + e.elo_delta where id = e.user_id;
+    else
+      continue;
+    end if;
+    get diagnostics changed = row_count;
+    updated := updated + changed;
+  end loop;
+  return updated;
+end;
+$$ language plpgsql;